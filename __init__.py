@@ -4,25 +4,42 @@
 
 """
 from trytond.pool import Pool
-from carrier import Carrier, TestConnectionStart, TestConnection
-from party import Address
+from carrier import Carrier, CarrierGroupAccount, TestConnectionStart, \
+    TestConnection
+from party import Address, AddressDHLDE, Party
 from sale import Sale, SaleConfiguration
-from shipment import ShipmentOut, GenerateShippingLabel, ShippingDHLDE
+from ledger import DHLDERequest
+from tracking import TrackingEvent
+from package import Package, StockMove, Template, Product
+from shipment import ShipmentOut, GenerateShippingLabel, ShippingDHLDE, \
+    GenerateLabelsStart, GenerateLabelsResult, GenerateLabels
 
 
 def register():
     Pool.register(
+        Party,
         Address,
+        AddressDHLDE,
         Carrier,
+        CarrierGroupAccount,
         SaleConfiguration,
         Sale,
         ShipmentOut,
         ShippingDHLDE,
         TestConnectionStart,
+        DHLDERequest,
+        TrackingEvent,
+        Package,
+        StockMove,
+        Template,
+        Product,
+        GenerateLabelsStart,
+        GenerateLabelsResult,
         module='shipping_dhl_de', type_='model'
     )
     Pool.register(
         TestConnection,
         GenerateShippingLabel,
+        GenerateLabels,
         module='shipping_dhl_de', type_='wizard'
     )
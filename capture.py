@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+    capture.py
+
+    Capture of the last SOAP exchanges of a worker with DHL, written to
+    files only when a call fails or is slow.
+
+    The exchanges are kept as the bytes sent and received, in a ring buffer
+    of ``capture_size`` exchanges (20 by default, 0 to disable), so a call
+    going well costs an append. On a fault, or when a call takes more than
+    ``capture_threshold`` seconds (10 by default), the buffer is written to
+    a new file of ``capture_path`` (the temporary directory by default)
+    with the credentials removed, keeping the last ``capture_files`` files.
+    All are options of the ``[shipping_dhl_de]`` section of the trytond
+    configuration.
+
+"""
+import os
+import re
+import time
+import tempfile
+import threading
+from collections import deque
+from itertools import count
+
+from logbook import Logger
+
+from trytond.config import config
+
+from forksafe import ProcessLocal
+
+log = Logger('shipping_dhl_de')
+
+FILE_PREFIX = 'shipping_dhl_de-wire-'
+
+# Content of the elements holding credentials
+REDACT_RE = re.compile(
+    r'(<(?:[\w-]+:)?(?:user|signature|password)\b[^>]*>)[^<]*(</)', re.I
+)
+
+
+def redact(content):
+    """
+    Return the content without the credentials of the SOAP headers
+    """
+    return REDACT_RE.sub(r'\1***\2', content)
+
+
+def to_bytes(content):
+    """
+    Return the captured content as bytes, read lazily by chunks for the
+    streamed responses
+    """
+    if content is None:
+        return '(nothing)'
+    if isinstance(content, list):
+        return ''.join(content)
+    if isinstance(content, unicode):
+        return content.encode('utf-8')
+    return str(content)
+
+
+class WireCapture(object):
+    """
+    Ring buffer of the last exchanges of the worker
+
+    :param size: Number of exchanges kept
+    :param threshold: Seconds above which a call is slow and dumped, None
+                      to dump the failed calls only
+    :param directory: Directory of the dump files
+    :param max_files: Number of dump files kept in the directory
+    """
+
+    def __init__(
+            self, size=20, threshold=None, directory=None, max_files=10):
+        self.size = size
+        self.threshold = threshold
+        self.directory = directory or tempfile.gettempdir()
+        self.max_files = max_files
+        self.exchanges = deque(maxlen=size)
+        self.lock = threading.Lock()
+        self.counter = count()
+
+    def record(self, operation, sent, received, duration, failed=False):
+        """
+        Keep the exchange, dumping the buffer if the call failed or was
+        slow
+
+        :param sent: Bytes sent
+        :param received: Bytes received, or list of the chunks of a
+                         streamed response
+        :return: Path of the dump file if any
+        """
+        if not self.size:
+            return
+        self.exchanges.append(
+            (time.time(), operation, duration, sent, received)
+        )
+        if failed:
+            return self.dump('%s failed' % operation)
+        if self.threshold and duration > self.threshold:
+            return self.dump('%s took %.3fs' % (operation, duration))
+
+    def dump(self, reason):
+        """
+        Write the exchanges kept to a new file and forget them
+
+        :return: Path of the file
+        """
+        with self.lock:
+            exchanges = list(self.exchanges)
+            self.exchanges.clear()
+            path = os.path.join(self.directory, '%s%s-%d-%04d.log' % (
+                FILE_PREFIX, time.strftime('%Y%m%d%H%M%S'), os.getpid(),
+                next(self.counter),
+            ))
+            with open(path, 'wb') as dump_file:
+                dump_file.write('# %s\n' % reason)
+                for at, operation, duration, sent, received in exchanges:
+                    dump_file.write('\n# %s %s %.3fs\n>>> sent\n%s\n' % (
+                        time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(at)),
+                        operation, duration, redact(to_bytes(sent)),
+                    ))
+                    dump_file.write(
+                        '<<< received\n%s\n' % redact(to_bytes(received))
+                    )
+            self.rotate()
+        log.warning('DHL DE exchanges saved in %s: %s' % (path, reason))
+        return path
+
+    def rotate(self):
+        """
+        Remove the oldest dump files beyond `max_files`
+        """
+        names = sorted(
+            n for n in os.listdir(self.directory) if n.startswith(FILE_PREFIX)
+        )
+        for name in names[:-self.max_files or None]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:  # pragma: no cover
+                # Already removed by another worker
+                pass
+
+
+def new_wire_capture():
+    """
+    Return a capture configured from the trytond configuration
+    """
+    return WireCapture(
+        size=config.getint('shipping_dhl_de', 'capture_size', default=20),
+        threshold=config.getfloat(
+            'shipping_dhl_de', 'capture_threshold', default=10
+        ),
+        directory=config.get('shipping_dhl_de', 'capture_path'),
+        max_files=config.getint('shipping_dhl_de', 'capture_files', default=10),
+    )
+
+
+# A forked worker does not dump the exchanges of its parent
+_capture = ProcessLocal(new_wire_capture)
+
+
+def get_wire_capture():
+    """
+    Return the capture of the worker
+    """
+    return _capture.get()
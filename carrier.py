@@ -3,22 +3,33 @@
     carrier.py
 
 """
+import os
+import sys
+import time
+import threading
 from decimal import Decimal
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 
-from suds import WebFault
-from suds.client import Client
-from suds.plugin import MessagePlugin
+from sql import Table
 
 from trytond.pool import PoolMeta, Pool
-from trytond.model import fields, ModelView
+from trytond.model import fields, ModelView, ModelSQL
 from trytond.pyson import Eval
-from trytond.wizard import Wizard, StateView, Button
+from trytond.wizard import Wizard, StateView, StateTransition, Button
 from trytond.transaction import Transaction
+from trytond.config import config
+from trytond.cache import Cache
 from logbook import Logger
 
+from states import DHLDEFault
+from ratelimit import TokenBucket
+
 log = Logger('shipping_dhl_de')
 
-__all__ = ['Carrier', 'TestConnectionStart', 'TestConnection']
+__all__ = [
+    'Carrier', 'CarrierGroupAccount', 'TestConnectionStart', 'TestConnection',
+]
 __metaclass__ = PoolMeta
 
 STATES = {
@@ -26,22 +37,162 @@ STATES = {
     'invisible': Eval('carrier_cost_method') != 'dhl_de'
 }
 
+DHL_DE_API_VERSIONS = [
+    ('1.0', '1.0 (Label URL)'),
+    ('2.2', '2.2 (Inline Label)'),
+]
+
+# Maximum number of ShipmentOrders per request by API version
+DHL_DE_BATCH_SIZES = {
+    '1.0': 10,
+    '2.2': 30,
+}
+
+# Maximum number of shipment numbers per cancellation, label or manifest
+# request
+DHL_DE_NUMBER_BATCH_SIZE = 30
+
+# Statistics of the rate limit bucket shown by the fields of the carrier
+DHL_DE_RATE_STATS = {
+    'dhl_de_rate_calls': 'calls',
+    'dhl_de_rate_waited': 'waited',
+    'dhl_de_rate_wait_time': 'wait_time',
+}
+
+DHL_DE_SOAP_BACKENDS = [
+    ('suds', 'suds'),
+    ('lxml', 'lxml (API 1.0 only)'),
+]
+
+DHL_DE_CREDENTIALS_STATUSES = [
+    (None, ''),
+    ('ok', 'OK'),
+    ('failed', 'Failed'),
+]
+
+# Carriers tested at the same time
+CREDENTIALS_TEST_THREADS = 8
 
-class FixPrefix(MessagePlugin):
+# Outcome of the credentials test of a carrier
+CredentialsCheck = namedtuple('CredentialsCheck', [
+    'status', 'latency', 'message', 'checked_at',
+])
+
+
+def get_credentials_error_message(exc):
     """
-    Suds client plugin to fix prefixes
+    Return the message shown for the exception raised by a credentials test
     """
-    def marshalled(self, context):
-        shipment_dd = context.envelope.getChild(
-            'Body'
-        ).getChild('CreateShipmentDDRequest')
+    if isinstance(exc, DHLDEFault):
+        return exc.message
+    if exc.args and isinstance(exc.args[0], tuple):
+        status, reason = exc.args[0]
+        if status == 401:
+            return 'Invalid Credentials'
+        return 'Status: %s\nReason: %s' % (status, reason)
+    return unicode(exc) or exc.__class__.__name__
 
-        shipment_dd.getChild('Version').setPrefix('ns0')
-        shipment_details = shipment_dd.getChild('ShipmentOrder') \
-            .getChild('Shipment').getChild('ShipmentDetails')
-        shipment_details.getChild('EKP').setPrefix('ns0')
-        shipment_details.getChild('Attendance').getChild('partnerID') \
-            .setPrefix('ns0')
+
+def check_dhl_de_credentials(calls, threads=CREDENTIALS_TEST_THREADS):
+    """
+    Make the calls asking DHL for the version at the same time
+
+    :param calls: List of callables making the call without database
+                  access and returning its round trip in seconds
+    :return: List of `CredentialsCheck`, one per call
+    """
+    def check(call):
+        try:
+            latency = call()
+        except Exception, exc:
+            return CredentialsCheck(
+                'failed', None, get_credentials_error_message(exc),
+                time.time()
+            )
+        return CredentialsCheck('ok', latency, None, time.time())
+
+    if not calls:
+        return []
+    pool = ThreadPool(min(threads, len(calls)))
+    try:
+        return pool.map(check, calls)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def split_by_weights(items, weights):
+    """
+    Split the items in consecutive lists, one per weight, of lengths in
+    proportion to the weights
+
+    The items left by the rounding go to the largest remainders.
+    """
+    total = float(sum(weights))
+    quotas = [len(items) * weight / total for weight in weights]
+    counts = [int(quota) for quota in quotas]
+    by_remainder = sorted(
+        range(len(weights)), key=lambda i: counts[i] - quotas[i]
+    )
+    for index in by_remainder[:len(items) - sum(counts)]:
+        counts[index] += 1
+    parts, start = [], 0
+    for count in counts:
+        parts.append(items[start:start + count])
+        start += count
+    return parts
+
+
+# Seconds the versions of the API asked by the worker are used, so a new
+# release of the endpoint is seen without a restart
+DHL_DE_VERSION_TTL = 3600
+
+# Versions of the API asked by the worker with the time they were asked,
+# by WSDL and location
+_dhl_de_versions = {}
+
+# Databases whose DHL DE carriers the worker warms up
+_warmed_up = set()
+
+# States of the modules while the database is updated
+UPDATE_MODULE_STATES = ('to install', 'to upgrade', 'to remove')
+
+
+def is_dhl_de_warm_up_wanted(database_name):
+    """
+    Return True if the DHL DE carriers of the database must be warmed up:
+    asked by the configuration, not done yet by the worker and the database
+    not being updated (by trytond -u or the module wizard), as the
+    process then stops or loads the pool again
+    """
+    if not config.getboolean('shipping_dhl_de', 'warm_up'):
+        return False
+    if database_name in _warmed_up:
+        return False
+    cursor = Transaction().cursor
+    module = Table('ir_module_module')
+    cursor.execute(*module.select(
+        module.id, where=module.state.in_(UPDATE_MODULE_STATES), limit=1
+    ))
+    return cursor.fetchone() is None
+
+
+def warm_up_dhl_de_carriers(database_name):
+    """
+    Build the clients of the DHL DE carriers of the database and ask their
+    versions of the API, once the pool of the database is initialised
+    """
+    pool = Pool(database_name)
+    with Transaction().start(database_name, 0, readonly=True):
+        # Waits for the initialisation in progress
+        pool.init()
+        Carrier = pool.get('carrier')
+        carriers = Carrier.search([('carrier_cost_method', '=', 'dhl_de')])
+        start = time.time()
+        Carrier.warm_up_dhl_de(carriers)
+    log.info('%d DHL DE carriers of %s warmed up in %.3fs' % (
+        len(carriers), database_name, time.time() - start
+    ))
 
 
 class Carrier:
@@ -72,11 +223,113 @@ class Carrier:
         ('sandbox', 'Testing & Development (Sandbox)'),
         ('production', 'Production'),
     ], 'Environment', states=STATES, depends=['carrier_cost_method'])
+    dhl_de_api_version = fields.Selection(
+        DHL_DE_API_VERSIONS, 'API Version', states=STATES,
+        depends=['carrier_cost_method'],
+        help="Version 2.2 returns the label within the response instead of "
+        "an URL to download it from"
+    )
+    dhl_de_soap_backend = fields.Selection(
+        DHL_DE_SOAP_BACKENDS, 'SOAP Backend', states=STATES,
+        depends=['carrier_cost_method'],
+        help="lxml builds requests and reads responses much faster than "
+        "suds but only supports the API version 1.0"
+    )
+    dhl_de_rate_limit = fields.Float(
+        'Rate Limit', states={
+            'invisible': Eval('carrier_cost_method') != 'dhl_de',
+        }, depends=['carrier_cost_method'],
+        help="Maximum number of calls per second made with the account by "
+        "all the workers of this host. 0 disables the limit."
+    )
+    dhl_de_rate_burst = fields.Integer(
+        'Rate Burst', states={
+            'invisible': Eval('carrier_cost_method') != 'dhl_de',
+        }, depends=['carrier_cost_method'],
+        help="Number of calls which can be made in a row before the rate "
+        "limit applies"
+    )
+    dhl_de_rate_calls = fields.Function(
+        fields.Integer(
+            'Rate Limited Calls',
+            help="Calls made with the account by the workers of this host "
+            "since the state of its rate limit was created"
+        ), 'get_dhl_de_rate_stats'
+    )
+    dhl_de_rate_waited = fields.Function(
+        fields.Integer(
+            'Rate Limited Waits',
+            help="Calls which had to wait for the rate limit"
+        ), 'get_dhl_de_rate_stats'
+    )
+    dhl_de_rate_wait_time = fields.Function(
+        fields.Float(
+            'Rate Limited Wait Time', digits=(16, 3),
+            help="Seconds spent by the calls waiting for the rate limit"
+        ), 'get_dhl_de_rate_stats'
+    )
+    dhl_de_weight = fields.Integer(
+        'Weight', states={
+            'invisible': Eval('carrier_cost_method') != 'dhl_de',
+        }, depends=['carrier_cost_method'],
+        help="Share of the shipments of a label batch created with this "
+        "account among the accounts of its group. 0 leaves the account "
+        "out of the batches."
+    )
+    dhl_de_group_accounts = fields.Many2Many(
+        'shipping_dhl_de.carrier-account', 'carrier', 'account',
+        'Group Accounts', domain=[
+            ('carrier_cost_method', '=', 'dhl_de'),
+            ('id', '!=', Eval('id')),
+            ('dhl_de_environment', '=', Eval('dhl_de_environment')),
+            ('dhl_de_api_version', '=', Eval('dhl_de_api_version')),
+        ], states={
+            'invisible': Eval('carrier_cost_method') != 'dhl_de',
+        }, depends=[
+            'carrier_cost_method', 'id', 'dhl_de_environment',
+            'dhl_de_api_version',
+        ],
+        help="Other DHL DE accounts creating the shipments of the label "
+        "batches of this carrier with it, at the same time and in "
+        "proportion to their weights"
+    )
+    dhl_de_status = fields.Function(
+        fields.Selection(
+            DHL_DE_CREDENTIALS_STATUSES, 'DHL DE Status',
+            help="Outcome of the last credentials test, kept for a few "
+            "minutes"
+        ), 'get_dhl_de_credentials_check'
+    )
+    dhl_de_latency = fields.Function(
+        fields.Float(
+            'DHL DE Latency', digits=(16, 3),
+            help="Seconds taken by DHL to answer the last credentials test"
+        ), 'get_dhl_de_credentials_check'
+    )
+
+    _dhl_de_credentials_cache = Cache(
+        'carrier.dhl_de_credentials', context=False
+    )
 
     def __init__(self, *args, **kwargs):
         super(Carrier, self).__init__(*args, **kwargs)
         self._dhl_de_version = None
         self._dhl_de_client = None
+        self._dhl_de_rate_limiter = None
+
+    @classmethod
+    def __post_setup__(cls):
+        super(Carrier, cls).__post_setup__()
+        database_name = Transaction().cursor.database_name
+        if not is_dhl_de_warm_up_wanted(database_name):
+            return
+        _warmed_up.add(database_name)
+        thread = threading.Thread(
+            target=warm_up_dhl_de_carriers, args=(database_name,),
+            name='shipping_dhl_de-warm-up',
+        )
+        thread.daemon = True
+        thread.start()
 
     @classmethod
     def view_attributes(cls):
@@ -92,7 +345,16 @@ class Carrier:
             'dhl_de_test_conn_error':
                 "Error while testing credentials from DHL DE: \n\n%s",
             'dhl_de_label_error':
-                "Error while generating label from DHL DE: \n\n%s"
+                "Error while generating label from DHL DE: \n\n%s",
+            'dhl_de_cancel_error':
+                "Error while cancelling shipments at DHL DE: \n\n%s",
+            'dhl_de_get_label_error':
+                "Error while getting labels from DHL DE: \n\n%s",
+            'dhl_de_manifest_error':
+                "Error while manifesting shipments at DHL DE: \n\n%s",
+            'dhl_de_soap_backend_api_version':
+                "The SOAP backend \"%s\" does not support the API "
+                "version %s.",
         })
 
         selection = ('dhl_de', 'DHL (DE)')
@@ -100,88 +362,481 @@ class Carrier:
             cls.carrier_cost_method.selection.append(selection)
 
         cls._buttons.update({
-            'test_dhl_de_credentials': {},
+            'test_dhl_de_connection': {},
         })
 
-        cls.dhl_de_wsdl_url = "https://cig.dhl.de/cig-wsdls/com/dpdhl/wsdl/geschaeftskundenversand-api/1.0/geschaeftskundenversand-api-1.0.wsdl"    # noqa
+        cls.dhl_de_wsdl_urls = {
+            '1.0': "https://cig.dhl.de/cig-wsdls/com/dpdhl/wsdl/geschaeftskundenversand-api/1.0/geschaeftskundenversand-api-1.0.wsdl",    # noqa
+            '2.2': "https://cig.dhl.de/cig-wsdls/com/dpdhl/wsdl/geschaeftskundenversand-api/2.2/geschaeftskundenversand-api-2.2.wsdl",    # noqa
+        }
 
     @staticmethod
     def default_dhl_de_environment():
         return 'sandbox'
 
-    def get_dhl_de_client(self):
+    @staticmethod
+    def default_dhl_de_api_version():
+        return '1.0'
+
+    @staticmethod
+    def default_dhl_de_soap_backend():
+        return 'suds'
+
+    @staticmethod
+    def default_dhl_de_rate_limit():
+        return 0
+
+    @staticmethod
+    def default_dhl_de_rate_burst():
+        return 1
+
+    @staticmethod
+    def default_dhl_de_weight():
+        return 1
+
+    def get_dhl_de_accounts(self):
+        """
+        Return the carriers of the DHL DE accounts creating the shipments of
+        this carrier, itself and the accounts of its group, with their
+        weights
+        """
+        accounts = []
+        for account in [self] + list(self.dhl_de_group_accounts):
+            if account.carrier_cost_method != 'dhl_de' or \
+                    account.dhl_de_environment != self.dhl_de_environment or \
+                    account.dhl_de_api_version != self.dhl_de_api_version:
+                # Changed since added to the group
+                continue
+            weight = account.dhl_de_weight
+            if weight is None:
+                weight = 1
+            if weight > 0:
+                accounts.append((account, weight))
+        return accounts or [(self, 1)]
+
+    def get_dhl_de_rate_limiter(self):
         """
-        Return the DHL DE client with the username and password set
+        Return the token bucket of the account (EKP) of the carrier or None
+        if the calls are not limited
         """
-        if self._dhl_de_client is None:
-            location = 'https://cig.dhl.de/services/sandbox/soap'
-            if self.dhl_de_environment == 'production':  # pragma: no cover
-                location = 'https://cig.dhl.de/services/production/soap'
+        if not self.dhl_de_rate_limit or self.dhl_de_rate_limit <= 0:
+            return None
+        if self._dhl_de_rate_limiter is None:
+            ekp = (self.dhl_de_account_no or '')[:10]
+            self._dhl_de_rate_limiter = TokenBucket(
+                '%s-%s' % (self.dhl_de_environment, ekp),
+                self.dhl_de_rate_limit,
+                self.dhl_de_rate_burst or 1,
+                config.get('shipping_dhl_de', 'rate_limit_path'),
+                config.getfloat(
+                    'shipping_dhl_de', 'rate_limit_warning', default=1
+                ),
+            )
+        return self._dhl_de_rate_limiter
 
-            client = Client(
-                self.dhl_de_wsdl_url,
-                username=self.dhl_de_username,
-                password=self.dhl_de_password,
-                location=location,
+    @classmethod
+    def get_dhl_de_rate_stats(cls, carriers, names):
+        """
+        Return the calls made and the waits for the rate limit of the
+        accounts of the carriers, read from the state of their buckets
+        """
+        result = dict((n, dict((c.id, None) for c in carriers)) for n in names)
+        for carrier in carriers:
+            limiter = carrier.get_dhl_de_rate_limiter()
+            if limiter is None:
+                continue
+            stats = limiter.get_stats()
+            for name in names:
+                result[name][carrier.id] = stats[DHL_DE_RATE_STATS[name]]
+        return result
+
+    def _wait_dhl_de_rate_limit(self):
+        """
+        Wait until a call can be made with the account of the carrier
+
+        :return: Seconds spent waiting
+        """
+        limiter = self.get_dhl_de_rate_limiter()
+        if limiter is None:
+            return 0
+        return limiter.acquire()
+
+    def _get_dhl_de_transport_args(self):
+        """
+        Return the name of the SOAP backend of the carrier and the
+        arguments of its transport
+        """
+        location = 'https://cig.dhl.de/services/sandbox/soap'
+        if self.dhl_de_environment == 'production':  # pragma: no cover
+            location = 'https://cig.dhl.de/services/production/soap'
+
+        api_version = self.dhl_de_api_version or '1.0'
+        backend = self.dhl_de_soap_backend or 'suds'
+        if backend == 'lxml' and api_version != '1.0':  # pragma: no cover
+            self.raise_user_error(
+                'dhl_de_soap_backend_api_version',
+                error_args=(backend, api_version)
             )
-            self._dhl_de_client = client
+        return backend, (
+            self.dhl_de_wsdl_urls[api_version],
+            location,
+            self.dhl_de_username,
+            self.dhl_de_password,
+        )
+
+    def get_dhl_de_client(self):
+        """
+        Return the DHL DE client (a transport of the SOAP backend of the
+        carrier) with the username and password set, built again in the
+        processes forked since
+        """
+        if self._dhl_de_client is None or \
+                self._dhl_de_client.pid != os.getpid():
+            backend, args = self._get_dhl_de_transport_args()
+            # Imported with suds, lxml and requests only when first needed
+            from transport import TRANSPORTS
+            self._dhl_de_client = TRANSPORTS[backend](*args)
 
         return self._dhl_de_client
 
+    def _get_dhl_de_version_args(self):
+        """
+        Return the arguments of the getVersion call of the API version
+        """
+        if self.dhl_de_api_version == '2.2':
+            return ({
+                'majorRelease': '2',
+                'minorRelease': '2',
+            },)
+        return ()
+
+    def request_dhl_de_version(self):
+        """
+        Ask DHL for the version of the API
+        """
+        client = self.get_dhl_de_client()
+        self._wait_dhl_de_rate_limit()
+        return client.get_version(*self._get_dhl_de_version_args())
+
+    def _get_dhl_de_version_call(self):
+        """
+        Return a callable asking DHL for the version of the API with a new
+        client, without database access, and returning the round trip in
+        seconds
+        """
+        backend, args = self._get_dhl_de_transport_args()
+        version_args = self._get_dhl_de_version_args()
+        limiter = self.get_dhl_de_rate_limiter()
+
+        def call():
+            from transport import TRANSPORTS
+            client = TRANSPORTS[backend](*args)
+            if limiter is not None:
+                limiter.acquire()
+            start = time.time()
+            client.get_version(*version_args)
+            return time.time() - start
+        return call
+
+    def _get_dhl_de_credentials_key(self):
+        # Changing the credentials makes the last test obsolete
+        return (self.id, self.write_date or self.create_date)
+
+    @classmethod
+    def _get_dhl_de_cached_checks(cls, carriers):
+        """
+        Return the `CredentialsCheck` by carrier id of the tests made less
+        than `credentials_ttl` seconds ago
+        """
+        ttl = config.getint('shipping_dhl_de', 'credentials_ttl', default=300)
+        checks = {}
+        for carrier in carriers:
+            check = cls._dhl_de_credentials_cache.get(
+                carrier._get_dhl_de_credentials_key()
+            )
+            if check is not None and time.time() - check.checked_at < ttl:
+                checks[carrier.id] = check
+        return checks
+
+    @classmethod
+    def check_dhl_de_credentials(cls, carriers):
+        """
+        Test the credentials of the carriers at the same time, reusing the
+        outcomes of the tests made less than `credentials_ttl` seconds ago
+
+        :return: Dictionary of `CredentialsCheck` by carrier id
+        """
+        checks = cls._get_dhl_de_cached_checks(carriers)
+        to_check = [c for c in carriers if c.id not in checks]
+        calls = [c._get_dhl_de_version_call() for c in to_check]
+        for carrier, check in zip(
+                to_check, check_dhl_de_credentials(calls)):
+            cls._dhl_de_credentials_cache.set(
+                carrier._get_dhl_de_credentials_key(), check
+            )
+            checks[carrier.id] = check
+        return checks
+
+    @classmethod
+    def get_dhl_de_credentials_check(cls, carriers, names):
+        """
+        Return the outcome of the last credentials test of the carriers,
+        without testing them
+        """
+        checks = cls._get_dhl_de_cached_checks(carriers)
+        result = dict((n, dict((c.id, None) for c in carriers)) for n in names)
+        for carrier_id, check in checks.iteritems():
+            if 'dhl_de_status' in result:
+                result['dhl_de_status'][carrier_id] = check.status
+            if 'dhl_de_latency' in result:
+                result['dhl_de_latency'][carrier_id] = check.latency
+        return result
+
+    @classmethod
+    def warm_up_dhl_de(cls, carriers):
+        """
+        Build the clients of the carriers and ask their versions of the API,
+        logging the carriers which fail instead of raising
+        """
+        for carrier in carriers:
+            try:
+                carrier.get_dhl_de_client()
+                carrier.get_dhl_de_version()
+            except Exception:
+                log.exception(
+                    'Warm-up of the DHL DE carrier %d failed' % carrier.id
+                )
+
     def get_dhl_de_version(self):
         if self._dhl_de_version is None:
-            client = self.get_dhl_de_client()
-            self._dhl_de_version = client.service.getVersion()
+            if self.dhl_de_api_version == '2.2':
+                # The release is fixed by the WSDL, no need to ask for it
+                self._dhl_de_version = {
+                    'majorRelease': '2',
+                    'minorRelease': '2',
+                }
+            else:
+                # The same for all the carriers of the endpoint
+                key = self._get_dhl_de_transport_args()[1][:2]
+                version, asked_at = _dhl_de_versions.get(key, (None, 0))
+                if time.time() - asked_at > DHL_DE_VERSION_TTL:
+                    version = self.request_dhl_de_version()
+                    _dhl_de_versions[key] = version, time.time()
+                self._dhl_de_version = version
 
         return self._dhl_de_version
 
+    def _set_dhl_de_authentication(self, client):
+        """
+        Set the authentication header of the API version on the client
+        """
+        if self.dhl_de_api_version == '2.2':
+            client.set_authentication(
+                self.dhl_de_api_user, self.dhl_de_api_signature
+            )
+        else:
+            client.set_authentication(
+                self.dhl_de_api_user, self.dhl_de_api_signature, 0
+            )
+
+    def iter_dhl_de_create_shipment_shipment_dd(self, shipment_orders):
+        """
+        Send ShipmentDD Request and yield the `CreationState` of each order
+        as soon as it is read from the response
+        """
+        version = self.get_dhl_de_version()
+        client = self.get_dhl_de_client()
+        self._set_dhl_de_authentication(client)
+        self._wait_dhl_de_rate_limit()
+
+        try:
+            for creation_state in client.iter_create_shipment_dd(
+                    version, shipment_orders):
+                yield creation_state
+        except DHLDEFault, exc:  # pragma: no cover
+            self.raise_user_error(
+                'dhl_de_label_error', error_args=(exc.message, )
+            )
+
     def send_dhl_de_create_shipment_shipment_dd(self, shipment_orders):
         """
         Send ShipmentDD Request
+
+        :return: List of `CreationState`, one per order
+        """
+        return list(
+            self.iter_dhl_de_create_shipment_shipment_dd(shipment_orders)
+        )
+
+    def send_dhl_de_create_shipment_order(self, shipment_orders):
+        """
+        Send createShipmentOrder request of the 2.x API, asking for the
+        labels to be returned base64 encoded within the response
+
+        :return: List of `CreationState`, one per order
         """
         version = self.get_dhl_de_version()
         client = self.get_dhl_de_client()
-        client.set_options(soapheaders=[{
-            'user': self.dhl_de_api_user,
-            'signature': self.dhl_de_api_signature,
-            'type': 0,
-        }], plugins=[FixPrefix()])
+        self._set_dhl_de_authentication(client)
+        self._wait_dhl_de_rate_limit()
 
         try:
-            response = client.service.createShipmentDD(version, shipment_orders)
-        except WebFault, exc:  # pragma: no cover
-            log.debug(client.last_sent())
-            log.debug(client.last_received())
+            return client.create_shipment_order(version, shipment_orders)
+        except DHLDEFault, exc:  # pragma: no cover
             self.raise_user_error(
                 'dhl_de_label_error', error_args=(exc.message, )
             )
-        return response
+
+    def iter_dhl_de_shipments(self, shipment_orders):
+        """
+        Create the shipments at DHL using the API version of the carrier
+        and yield the `CreationState` of each order as soon as it is
+        available
+
+        :param shipment_orders: ShipmentOrders built for the API version
+        """
+        if self.dhl_de_api_version == '2.2':
+            return iter(
+                self.send_dhl_de_create_shipment_order(shipment_orders)
+            )
+        return self.iter_dhl_de_create_shipment_shipment_dd(shipment_orders)
+
+    def _get_dhl_de_create_call(self):
+        """
+        Return a callable creating at DHL the shipments of the
+        ShipmentOrders without database access, for the worker threads of
+        the label batches
+
+        The callable returns the iterator of the `CreationState` of each
+        order and raises `DHLDEFault` if DHL refuses the request, after the
+        states read before the fault. The whole response is read under the
+        lock of the client, released before the first state is yielded so
+        that an iterator left unfinished does not keep the client locked.
+        """
+        version = self.get_dhl_de_version()
+        client = self.get_dhl_de_client()
+        self._set_dhl_de_authentication(client)
+        limiter = self.get_dhl_de_rate_limiter()
+        api_version = self.dhl_de_api_version
+
+        def call(shipment_orders):
+            creation_states, fault = [], None
+            # The requests of the account may be sent by many threads
+            with client.lock:
+                if limiter is not None:
+                    limiter.acquire()
+                try:
+                    if api_version == '2.2':
+                        creation_states.extend(client.create_shipment_order(
+                            version, shipment_orders
+                        ))
+                    else:
+                        for creation_state in client.iter_create_shipment_dd(
+                                version, shipment_orders):
+                            creation_states.append(creation_state)
+                except Exception:
+                    fault = sys.exc_info()
+            for creation_state in creation_states:
+                yield creation_state
+            if fault is not None:
+                raise fault[0], fault[1], fault[2]
+        return call
+
+    def create_dhl_de_shipments(self, shipment_orders):
+        """
+        Create the shipments at DHL using the API version of the carrier
+
+        :param shipment_orders: ShipmentOrders built for the API version
+        :return: List of `CreationState`, one per order
+        """
+        return list(self.iter_dhl_de_shipments(shipment_orders))
+
+    def _send_dhl_de_shipment_numbers(
+            self, operations, shipment_numbers, error):
+        """
+        Send the shipment numbers to the operation of the API version of
+        the carrier
+
+        :param operations: Tuple of the transport methods for the API 1.0
+                           and 2.x
+        :param error: Error raised on fault
+        """
+        version = self.get_dhl_de_version()
+        client = self.get_dhl_de_client()
+        self._set_dhl_de_authentication(client)
+        self._wait_dhl_de_rate_limit()
+
+        operation = operations[self.dhl_de_api_version == '2.2']
+        try:
+            return getattr(client, operation)(version, shipment_numbers)
+        except DHLDEFault, exc:  # pragma: no cover
+            self.raise_user_error(error, error_args=(exc.message, ))
+
+    def send_dhl_de_delete_shipments(self, shipment_numbers):
+        """
+        Cancel the shipments at DHL using the API version of the carrier,
+        at most `DHL_DE_NUMBER_BATCH_SIZE` at a time
+
+        :return: List of `DeletionState`, one per shipment number
+        """
+        return self._send_dhl_de_shipment_numbers(
+            ('delete_shipment_dd', 'delete_shipment_order'),
+            shipment_numbers, 'dhl_de_cancel_error'
+        )
+
+    def send_dhl_de_get_labels(self, shipment_numbers):
+        """
+        Get the labels of shipments already created at DHL using the API
+        version of the carrier, at most `DHL_DE_NUMBER_BATCH_SIZE` at a time
+
+        :return: List of `LabelState`, one per shipment number
+        """
+        return self._send_dhl_de_shipment_numbers(
+            ('get_label_dd', 'get_label'),
+            shipment_numbers, 'dhl_de_get_label_error'
+        )
+
+    def send_dhl_de_manifest(self, shipment_numbers):
+        """
+        Manifest the shipments at DHL using the API version of the carrier,
+        at most `DHL_DE_NUMBER_BATCH_SIZE` at a time
+
+        :return: List of `ManifestState`, one per shipment number
+        """
+        return self._send_dhl_de_shipment_numbers(
+            ('do_manifest_dd', 'do_manifest'),
+            shipment_numbers, 'dhl_de_manifest_error'
+        )
+
+    def get_dhl_de_batch_size(self):
+        """
+        Return the maximum number of ShipmentOrders sent in one request
+        """
+        return DHL_DE_BATCH_SIZES[self.dhl_de_api_version or '1.0']
 
     @classmethod
     @ModelView.button_action('shipping_dhl_de.wizard_test_connection')
-    def test_dhl_de_credentials(cls, carriers):
+    def test_dhl_de_connection(cls, carriers):
         """
-        Tests the connection. If there is a WebFault, raises an UserError
+        Open the wizard testing the credentials of the carriers
         """
-        if len(carriers) != 1:  # pragma: no cover
-            cls.raise_user_error('Only one carrier can be tested at a time.')
+        pass
 
-        client = carriers[0].get_dhl_de_client()
-        try:
-            client.service.getVersion()
-        except WebFault, exc:  # pragma: no cover
+    @classmethod
+    def test_dhl_de_credentials(cls, carriers):
+        """
+        Tests the connection of the carriers at the same time. If DHL
+        refuses any of them, raises an UserError
+        """
+        checks = cls.check_dhl_de_credentials(carriers)
+        failed = [c for c in carriers if checks[c.id].status == 'failed']
+        if failed:  # pragma: no cover
             cls.raise_user_error(
-                'dhl_de_test_conn_error', error_args=(exc.message, )
+                'dhl_de_test_conn_error', error_args=('\n\n'.join(
+                    '%s: %s' % (c.rec_name, checks[c.id].message)
+                    for c in failed
+                ),)
             )
-        except Exception, exc:  # pragma: no cover
-            if exc.args and isinstance(exc.args[0], tuple):
-                status, reason = exc.args[0]
-                if status == 401:
-                    cls.raise_user_error('Invalid Credentials')
-                cls.raise_user_error(
-                    'Status: %s\nReason: %s' % exc.args[0]
-                )
-            raise
 
     def get_sale_price(self):
         """Estimates the shipment rate for the current shipment
@@ -204,6 +859,18 @@ class Carrier:
         return Decimal('0'), currency.id
 
 
+class CarrierGroupAccount(ModelSQL):
+    "Carrier Group Account"
+    __name__ = 'shipping_dhl_de.carrier-account'
+
+    carrier = fields.Many2One(
+        'carrier', 'Carrier', ondelete='CASCADE', required=True, select=True
+    )
+    account = fields.Many2One(
+        'carrier', 'Account', ondelete='CASCADE', required=True, select=True
+    )
+
+
 class TestConnectionStart(ModelView):
     "Test Connection"
     __name__ = 'shipping_dhl_de.wizard_test_connection.start'
@@ -215,6 +882,8 @@ class TestConnection(Wizard):
     """
     __name__ = 'shipping_dhl_de.wizard_test_connection'
 
+    start_state = 'test'
+    test = StateTransition()
     start = StateView(
         'shipping_dhl_de.wizard_test_connection.start',
         'shipping_dhl_de.wizard_test_connection_view_form',
@@ -222,3 +891,14 @@ class TestConnection(Wizard):
             Button('Ok', 'end', 'tryton-ok'),
         ]
     )
+
+    def transition_test(self):
+        """
+        Test the credentials of the selected carriers
+        """
+        Carrier = Pool().get('carrier')
+
+        Carrier.test_dhl_de_credentials(
+            Carrier.browse(Transaction().context['active_ids'])
+        )
+        return 'start'
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+    forksafe.py
+
+    State kept by a worker between calls (locks, buffers, HTTP sessions),
+    built again in the processes forked from it, so a server loading the
+    module before forking its workers does not share sockets or held locks
+    between them.
+
+    Python 2 runs nothing at fork, the state is checked against the id of
+    the process each time it is used. The parsed WSDL and the versions of
+    the API are plain values and stay shared by the forked workers.
+
+"""
+import os
+import threading
+
+__all__ = ['ProcessLocal', 'get_http_session']
+
+
+class ProcessLocal(object):
+    """
+    Value built by `factory` on first use in each process
+
+    :param factory: Callable without arguments returning the value
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.values = {}
+
+    def get(self):
+        """
+        Return the value of the current process
+        """
+        pid = os.getpid()
+        try:
+            return self.values[pid]
+        except KeyError:
+            # Threads building the value at the same time all get the one
+            # stored first, setdefault being atomic
+            return self.values.setdefault(pid, self.factory())
+
+
+_sessions = ProcessLocal(threading.local)
+
+
+def get_http_session():
+    """
+    Return the requests session of the thread, keeping the connections to
+    the hosts open for its next calls
+    """
+    local = _sessions.get()
+    session = getattr(local, 'session', None)
+    if session is None:
+        import requests
+        session = local.session = requests.Session()
+    return session
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+    ledger.py
+
+    Requests sent to DHL to create shipments, saved outside of the
+    transaction making the labels so that they are known even when this
+    transaction is rolled back after DHL created the shipments.
+
+"""
+import base64
+from contextlib import contextmanager
+
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.pyson import Eval
+from trytond.transaction import Transaction
+
+from states import CreationState
+
+__all__ = ['DHLDERequest']
+
+STATES = [
+    ('in_flight', 'In Flight'),
+    ('succeeded', 'Succeeded'),
+    ('failed', 'Failed'),
+    ('cancelled', 'Cancelled'),
+]
+
+
+class DHLDERequest(ModelSQL, ModelView):
+    "DHL DE Request"
+    __name__ = 'shipping_dhl_de.request'
+
+    # Not Many2One, the shipment and the carrier may not be committed yet
+    # when the request is saved from another transaction
+    shipment = fields.Reference(
+        'Shipment', selection=[
+            ('stock.shipment.out', 'Customer Shipment'),
+        ], required=True, readonly=True, select=True
+    )
+    account = fields.Char('Account', readonly=True)
+    carrier = fields.Reference(
+        'Carrier', selection=[
+            (None, ''),
+            ('carrier', 'Carrier'),
+        ], readonly=True
+    )
+    sequence_number = fields.Char('Sequence Number', readonly=True)
+    state = fields.Selection(STATES, 'State', required=True, readonly=True)
+    status_code = fields.Char('Status Code', readonly=True)
+    status_messages = fields.Text('Status Messages', readonly=True)
+    shipment_number = fields.Char('Shipment Number', readonly=True)
+    piece_numbers = fields.Text('Piece Numbers', readonly=True)
+    label_url = fields.Char('Label URL', readonly=True)
+    # Label returned in the response, kept in the attachment filestore
+    label_digest = fields.Char('Label Digest', readonly=True)
+    label_collision = fields.Integer('Label Collision', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(DHLDERequest, cls).__setup__()
+        cls._order.insert(0, ('create_date', 'DESC'))
+        cls._order.insert(1, ('id', 'DESC'))
+        cls._buttons.update({
+            'fail': {
+                'invisible': Eval('state') != 'in_flight',
+            },
+        })
+
+    @staticmethod
+    def default_state():
+        return 'in_flight'
+
+    @staticmethod
+    @contextmanager
+    def _ledger_transaction():
+        """
+        Run the block in its own transaction, committed at the end
+        """
+        with Transaction().new_cursor():
+            yield
+            Transaction().cursor.commit()
+
+    @classmethod
+    def get_last_requests(cls, shipments):
+        """
+        Return the last request of each shipment
+
+        :return: Dictionary of the requests by shipment id
+        """
+        requests = {}
+        for request in cls.search([
+                    ('shipment', 'in', [
+                        '%s,%s' % (s.__name__, s.id) for s in shipments
+                    ]),
+                    ]):
+            # Ordered from the most recent
+            requests.setdefault(request.shipment.id, request)
+        return requests
+
+    @classmethod
+    def start(cls, shipments, carrier):
+        """
+        Save the requests before sending the orders of the shipments with
+        the account of the carrier
+
+        :return: Dictionary of the requests by sequence number
+        """
+        with cls._ledger_transaction():
+            requests = cls.create([{
+                'shipment': '%s,%s' % (shipment.__name__, shipment.id),
+                'account': (carrier.dhl_de_account_no or '')[:10],
+                'carrier': '%s,%s' % (carrier.__name__, carrier.id),
+                'sequence_number': '%s' % shipment.id,
+            } for shipment in shipments])
+            # Read while the requests are visible
+            return dict((r.sequence_number, r) for r in requests)
+
+    @classmethod
+    def finish(cls, requests, creation_states, refused=False):
+        """
+        Save the results read from the response of DHL
+
+        :param requests: Dictionary of the requests by sequence number
+        :param creation_states: `CreationState` read from the response
+        :param refused: True if DHL refused the whole request, the requests
+                        without result then failed instead of staying in
+                        flight
+        """
+        Shipment = Pool().get('stock.shipment.out')
+
+        to_write = []
+        for creation_state in creation_states:
+            request = requests[creation_state.sequence_number]
+            label = {}
+            if creation_state.label_data:
+                label = Shipment._store_dhl_de_label(
+                    [base64.b64decode(creation_state.label_data)]
+                )
+            to_write.extend([[request], {
+                'state': (
+                    'succeeded' if creation_state.status_code == '0'
+                    else 'failed'
+                ),
+                'status_code': creation_state.status_code,
+                'status_messages': '\n'.join(
+                    creation_state.status_messages or []
+                ),
+                'shipment_number': creation_state.shipment_number,
+                'piece_numbers': '\n'.join(
+                    creation_state.piece_numbers or []
+                ),
+                'label_url': creation_state.label_url,
+                'label_digest': label.get('digest'),
+                'label_collision': label.get('collision'),
+            }])
+        if refused:
+            answered = set(s.sequence_number for s in creation_states)
+            unanswered = [
+                r for s, r in requests.iteritems() if s not in answered
+            ]
+            if unanswered:
+                to_write.extend([unanswered, {'state': 'failed'}])
+        if to_write:
+            with cls._ledger_transaction():
+                cls.write(*to_write)
+
+    def to_creation_state(self):
+        """
+        Return the result of the request as read from the response
+        """
+        return CreationState(
+            sequence_number=self.sequence_number,
+            status_code=self.status_code,
+            status_messages=(self.status_messages or '').splitlines(),
+            shipment_number=self.shipment_number,
+            piece_numbers=(self.piece_numbers or '').splitlines(),
+            label_url=self.label_url,
+            label_data=None,
+        )
+
+    def get_label_values(self):
+        """
+        Return the `digest` and `collision` values of the label kept in the
+        attachment filestore, or None if DHL only returned its URL
+        """
+        if not self.label_digest:
+            return None
+        return {
+            'digest': self.label_digest,
+            'collision': self.label_collision or 0,
+        }
+
+    @classmethod
+    def cancel(cls, shipments):
+        """
+        Mark the succeeded requests of the shipments cancelled at DHL
+        """
+        requests = cls.get_last_requests(shipments).values()
+        cls.write([r for r in requests if r.state == 'succeeded'], {
+            'state': 'cancelled',
+        })
+
+    @classmethod
+    @ModelView.button
+    def fail(cls, requests):
+        """
+        Mark requests which got no answer as failed, once checked that DHL
+        did not create the shipments, so they can be sent again
+        """
+        cls.write([r for r in requests if r.state == 'in_flight'], {
+            'state': 'failed',
+        })
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+    package.py
+
+    Weight of the packages in kg, stored and updated when their moves or the
+    weight of their products change so that the labels read it instead of
+    converting the weight of every move.
+
+"""
+from trytond.model import fields
+from trytond.pool import Pool, PoolMeta
+
+__metaclass__ = PoolMeta
+__all__ = ['Package', 'StockMove', 'Template', 'Product']
+
+# Fields of the moves changing the weight of their package
+MOVE_WEIGHT_FIELDS = set(['package', 'product', 'quantity', 'uom'])
+
+# Fields of the product templates changing the weight of the packages
+TEMPLATE_WEIGHT_FIELDS = set(['weight', 'weight_uom'])
+
+
+class Package:
+    __name__ = 'stock.package'
+
+    dhl_de_weight = fields.Float(
+        'Weight (kg)', digits=(16, 3), readonly=True
+    )
+
+    @classmethod
+    def create(cls, vlist):
+        packages = super(Package, cls).create(vlist)
+        cls.update_dhl_de_weight(packages)
+        return packages
+
+    @classmethod
+    def write(cls, *args):
+        super(Package, cls).write(*args)
+        actions = iter(args)
+        to_update = []
+        for packages, values in zip(actions, actions):
+            if 'override_weight' in values:
+                to_update.extend(packages)
+        if to_update:
+            cls.update_dhl_de_weight(to_update)
+
+    @classmethod
+    def update_dhl_de_weight(cls, packages):
+        """
+        Store the weight in kg of the packages
+        """
+        UOM = Pool().get('product.uom')
+
+        uom_kg = UOM.search([('symbol', '=', 'kg')])[0]
+        to_write = []
+        # Browsed again to read the moves as they are now
+        for package in cls.browse(list(set(p.id for p in packages))):
+            weight = package.compute_dhl_de_weight(uom_kg)
+            if weight != package.dhl_de_weight:
+                to_write.extend([[package], {'dhl_de_weight': weight}])
+        if to_write:
+            super(Package, cls).write(*to_write)
+
+    @classmethod
+    def update_dhl_de_weight_of_products(cls, products):
+        """
+        Store the weight in kg of the packages not sent yet holding the
+        products
+        """
+        Move = Pool().get('stock.move')
+
+        moves = Move.search([
+            ('product', 'in', [p.id for p in products]),
+            ('package', '!=', None),
+            ('state', 'not in', ['done', 'cancel']),
+        ])
+        if moves:
+            cls.update_dhl_de_weight([m.package for m in moves])
+
+    def compute_dhl_de_weight(self, uom_kg):
+        """
+        Return the weight of the package in kg from its moves, or the
+        weight overridden by the user
+        """
+        UOM = Pool().get('product.uom')
+
+        if self.override_weight and self.shipment:
+            return UOM.compute_qty(
+                self.weight_uom, self.override_weight, uom_kg
+            )
+        return sum(
+            move.get_weight(uom_kg, silent=True) for move in self.moves
+        )
+
+    def get_dhl_de_weight(self):
+        """
+        Return the weight of the package in kg
+        """
+        if self.dhl_de_weight is None:  # pragma: no cover
+            # Created before the weight was stored
+            UOM = Pool().get('product.uom')
+            return self.compute_dhl_de_weight(
+                UOM.search([('symbol', '=', 'kg')])[0]
+            )
+        return self.dhl_de_weight
+
+
+class StockMove:
+    __name__ = 'stock.move'
+
+    @classmethod
+    def create(cls, vlist):
+        Package = Pool().get('stock.package')
+
+        moves = super(StockMove, cls).create(vlist)
+        packages = [m.package for m in moves if m.package]
+        if packages:
+            Package.update_dhl_de_weight(packages)
+        return moves
+
+    @classmethod
+    def write(cls, *args):
+        Package = Pool().get('stock.package')
+
+        actions = iter(args)
+        moves = []
+        for records, values in zip(actions, actions):
+            if MOVE_WEIGHT_FIELDS.intersection(values):
+                moves.extend(records)
+        # The packages the moves leave and those they join
+        packages = [m.package for m in moves if m.package]
+        super(StockMove, cls).write(*args)
+        if moves:
+            packages.extend(
+                m.package for m in cls.browse([m.id for m in moves])
+                if m.package
+            )
+        if packages:
+            Package.update_dhl_de_weight(packages)
+
+    @classmethod
+    def delete(cls, moves):
+        Package = Pool().get('stock.package')
+
+        package_ids = list(set(m.package.id for m in moves if m.package))
+        super(StockMove, cls).delete(moves)
+        if package_ids:
+            Package.update_dhl_de_weight(Package.browse(package_ids))
+
+
+class Template:
+    __name__ = 'product.template'
+
+    @classmethod
+    def write(cls, *args):
+        Package = Pool().get('stock.package')
+
+        actions = iter(args)
+        templates = []
+        for records, values in zip(actions, actions):
+            if TEMPLATE_WEIGHT_FIELDS.intersection(values):
+                templates.extend(records)
+        super(Template, cls).write(*args)
+        if templates:
+            Package.update_dhl_de_weight_of_products(
+                [p for t in templates for p in t.products]
+            )
+
+
+class Product:
+    __name__ = 'product.product'
+
+    @classmethod
+    def write(cls, *args):
+        Package = Pool().get('stock.package')
+
+        actions = iter(args)
+        products = []
+        for records, values in zip(actions, actions):
+            # The weight is read from the template
+            if 'template' in values:
+                products.extend(records)
+        super(Product, cls).write(*args)
+        if products:
+            Package.update_dhl_de_weight_of_products(products)
@@ -3,16 +3,244 @@
     Customizes party address to have address in correct format for DHL API
 
 """
-from trytond.pool import PoolMeta
+import re
 
-__all__ = ['Address']
+from trytond.pool import PoolMeta, Pool
+from trytond.model import ModelSQL, fields
+from trytond.cache import Cache
+
+__all__ = ['Address', 'AddressDHLDE', 'Party']
 __metaclass__ = PoolMeta
 
+# House number at the end of the street when it is not in streetbis,
+# like "Marktplatz 1", "Hauptstr. 12a" or "Am Ring 3-5"
+STREET_NUMBER_RE = re.compile(
+    r'^(?P<name>.*?[^\d\s,])[\s,]+'
+    r'(?P<number>\d+\s*[a-zA-Z]?(?:\s*[-/]\s*\d+\s*[a-zA-Z]?)?)$'
+)
+
+ZIP_TYPES = [
+    ('germany', 'Germany'),
+    ('england', 'England'),
+    ('other', 'Other'),
+]
+
+# Fields of the normalized address
+NORMALIZED_FIELDS = [
+    'name', 'firstname', 'lastname', 'street_name', 'street_number', 'zip',
+    'zip_type', 'city', 'country_name', 'country_code', 'state',
+]
+
+
+def split_dhl_de_name(name):
+    """
+    Return the first and last names DHL DE expects from a full name
+    """
+    if ' ' in name:
+        return tuple(name.split(' ', 1))
+    return name, '-'  # pragma: no cover
+
+
+class AddressDHLDE(ModelSQL):
+    """
+    Address normalized the way DHL DE expects it, computed once per
+    revision of the address
+    """
+    __name__ = 'party.address.dhl_de'
+
+    address = fields.Many2One(
+        'party.address', 'Address', required=True, select=True,
+        ondelete='CASCADE'
+    )
+    revision = fields.Timestamp('Revision', required=True)
+    name = fields.Char('Name')
+    firstname = fields.Char('First Name')
+    lastname = fields.Char('Last Name')
+    street_name = fields.Char('Street Name')
+    street_number = fields.Char('Street Number')
+    zip = fields.Char('Zip')
+    zip_type = fields.Selection(ZIP_TYPES, 'Zip Type')
+    city = fields.Char('City')
+    country_name = fields.Char('Country Name')
+    country_code = fields.Char('Country Code')
+    state = fields.Char('State')
+
+    @classmethod
+    def __setup__(cls):
+        super(AddressDHLDE, cls).__setup__()
+        cls._sql_constraints += [
+            ('address_uniq', 'UNIQUE(address)',
+                'The DHL DE address must be unique per address.'),
+        ]
+
 
 class Address:
     "Address"
     __name__ = "party.address"
 
+    _dhl_de_cache = Cache('party.address.dhl_de', context=False)
+
+    @classmethod
+    def __setup__(cls):
+        super(Address, cls).__setup__()
+        cls._error_messages.update({
+            'dhl_de_field_required':
+                'Field "%s" of address "%s" is required by DHL DE.',
+        })
+
+    def get_dhl_de_revision(self):
+        """
+        Return the timestamp of the last change of the address or of its
+        party, which provides the name
+        """
+        return max(
+            self.write_date or self.create_date,
+            self.party.write_date or self.party.create_date,
+        )
+
+    def _normalize_dhl_de(self):
+        """
+        Return the values of the address normalized for DHL DE
+        """
+        name = self.name or self.party.name
+        firstname, lastname = split_dhl_de_name(name)
+
+        street_name, street_number = self.street, self.streetbis
+        if street_name and not street_number:  # pragma: no cover
+            match = STREET_NUMBER_RE.match(street_name.strip())
+            if match:
+                street_name = match.group('name')
+                street_number = match.group('number')
+
+        country_code = self.country and self.country.code or None
+        if country_code == 'DE':
+            zip_type = 'germany'
+        elif country_code == 'GB':  # pragma: no cover
+            zip_type = 'england'
+        else:
+            zip_type = 'other'
+
+        return {
+            'name': name,
+            'firstname': firstname,
+            'lastname': lastname,
+            'street_name': street_name,
+            'street_number': street_number,
+            'zip': self.zip,
+            'zip_type': zip_type,
+            'city': self.city,
+            'country_name': self.country and self.country.name or None,
+            'country_code': country_code,
+            # Field length must be less than or equal to 9.
+            'state': self.subdivision and self.subdivision.name[:9] or None,
+        }
+
+    @classmethod
+    def create(cls, vlist):
+        addresses = super(Address, cls).create(vlist)
+        cls.store_dhl_de_normalized(addresses)
+        return addresses
+
+    @classmethod
+    def write(cls, *args):
+        super(Address, cls).write(*args)
+        actions = iter(args)
+        cls.store_dhl_de_normalized(
+            [a for addresses, _ in zip(actions, actions) for a in addresses]
+        )
+
+    @classmethod
+    def store_dhl_de_normalized(cls, addresses):
+        """
+        Store the normalized values of the addresses for DHL DE, when they
+        are written so the labels only read them
+        """
+        AddressDHLDE = Pool().get('party.address.dhl_de')
+
+        # Browsed again to read the revision as it is now
+        addresses = cls.browse(list(set(a.id for a in addresses)))
+        stored = dict(
+            (r.address.id, r) for r in AddressDHLDE.search([
+                ('address', 'in', [a.id for a in addresses]),
+                ])
+        )
+        to_create, to_write = [], []
+        for address in addresses:
+            values = dict(
+                address._normalize_dhl_de(),
+                revision=address.get_dhl_de_revision()
+            )
+            record = stored.get(address.id)
+            if record:
+                to_write.extend([[record], values])
+            else:
+                to_create.append(dict(values, address=address.id))
+        if to_create:
+            AddressDHLDE.create(to_create)
+        if to_write:
+            AddressDHLDE.write(*to_write)
+
+    @classmethod
+    def get_dhl_de_normalized(cls, addresses):
+        """
+        Return the normalized values of the addresses for DHL DE, read from
+        the values stored when the addresses were written. Addresses
+        without up to date values are normalized without storing them, so
+        labels made at the same time do not write the same rows.
+
+        :return: Dictionary of the values by address id
+        """
+        AddressDHLDE = Pool().get('party.address.dhl_de')
+
+        result, missing = {}, {}
+        for address in addresses:
+            revision = address.get_dhl_de_revision()
+            values = cls._dhl_de_cache.get((address.id, revision))
+            if values is None:
+                missing[address.id] = (address, revision)
+            else:
+                result[address.id] = values
+        if not missing:
+            return result
+
+        stored = dict(
+            (r.address.id, r) for r in AddressDHLDE.search([
+                ('address', 'in', missing.keys()),
+                ])
+        )
+        for address_id, (address, revision) in missing.iteritems():
+            record = stored.get(address_id)
+            if record and record.revision == revision:
+                values = dict(
+                    (f, getattr(record, f)) for f in NORMALIZED_FIELDS
+                )
+            else:  # pragma: no cover
+                # Written before the module was installed
+                values = address._normalize_dhl_de()
+            result[address_id] = values
+            cls._dhl_de_cache.set((address_id, revision), values)
+        return result
+
+    def get_dhl_de_values(self):
+        """
+        Return the normalized values of this address for DHL DE
+        """
+        return self.get_dhl_de_normalized([self])[self.id]
+
+    def get_dhl_de_problems(self):
+        """
+        Return the list of reasons why DHL would refuse this address
+        """
+        problems = []
+        for field_name in ('street', 'zip', 'city', 'country'):
+            if not getattr(self, field_name):
+                problems.append(self.raise_user_error(
+                    'dhl_de_field_required', error_args=(
+                        self._fields[field_name].string, self.rec_name,
+                    ), raise_exception=False
+                ))
+        return problems
+
     def _get_dhl_de_communication_type(self, client):
         """
         Return `CommunicationType`
@@ -34,38 +262,86 @@ class Address:
         comm_type.contactPerson = self.name or party.name
         return comm_type
 
+    def _get_dhl_de_communication_v2(self):
+        """
+        Return `Communication` of the 2.x API
+        """
+        party = self.party
+        communication = {
+            'contactPerson': self.name or party.name,
+        }
+        if party.phone:
+            communication['phone'] = party.phone
+        if party.email:
+            communication['email'] = party.email
+        return communication
+
+    def as_dhl_de_address_v2(self):
+        """
+        Returns the address as NativeAddressType of the 2.x API
+        """
+        values = self.get_dhl_de_values()
+        address = {
+            'streetName': values['street_name'],
+            'streetNumber': values['street_number'],
+            'zip': values['zip'],
+            'city': values['city'],
+        }
+        if self.name:
+            address['name2'] = self.name
+
+        if values['country_code']:
+            address['Origin'] = {
+                'country': values['country_name'],
+                'countryISOCode': values['country_code'],
+            }
+            if values['state']:
+                address['Origin']['state'] = values['state']
+
+        return address
+
     def as_dhl_de_address(self, client):
         """
         Returns the address as ns1:NativeAddressType
         """
+        values = self.get_dhl_de_values()
         address = client.factory.create('ns1:NativeAddressType')
 
         address.careOfName = self.name
-        address.streetName = self.street
-        address.streetNumber = self.streetbis
+        address.streetName = values['street_name']
+        address.streetNumber = values['street_number']
 
-        if self.zip:
-            country = self.country and self.country.code or None
+        if values['zip']:
             zip_type = client.factory.create("ns1:ZipType")
-            if country == 'DE':
-                zip_type.germany = self.zip
-            elif country == 'GB':  # pragma: no cover
-                # TODO: Cover this in international shipping
-                zip_type.england = self.zip
-            else:
-                zip_type.other = self.zip
-
+            setattr(zip_type, values['zip_type'], values['zip'])
             address.Zip = zip_type
 
-        address.city = self.city
+        address.city = values['city']
 
-        if self.country:
+        if values['country_code']:
             country = client.factory.create('ns1:CountryType')
-            country.country = self.country.name
-            country.countryISOCode = self.country.code
-            if self.subdivision:
-                # Field length must be less than or equal to 9.
-                country.state = self.subdivision.name[:9]
+            country.country = values['country_name']
+            country.countryISOCode = values['country_code']
+            if values['state']:
+                country.state = values['state']
             address.Origin = country
 
         return address
+
+
+class Party:
+    __name__ = 'party.party'
+
+    @classmethod
+    def write(cls, *args):
+        Address = Pool().get('party.address')
+
+        super(Party, cls).write(*args)
+        # The name of the party is the name of its addresses without one
+        actions = iter(args)
+        party_ids = [
+            p.id for parties, _ in zip(actions, actions) for p in parties
+        ]
+        Address.store_dhl_de_normalized(
+            Address.search([('party', 'in', party_ids)])
+        )
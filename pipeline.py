@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+    pipeline.py
+
+    Chain of generator stages through which a label batch flows one chunk
+    at a time: the chunks of shipments are read, their orders built, sent,
+    the results parsed and the labels saved before the next chunk is read.
+
+    Each stage takes the iterator of the items of the previous stage and
+    pulls the next item only once its own item was taken, so no stage holds
+    more than the chunk it works on and the memory used stays the same
+    whatever the size of the batch.
+
+    The stages waiting on the network run in worker threads, connected to
+    the others by bounded queues, so the next chunk is built while one is
+    sent and the labels of the previous one are downloaded. The stages
+    using the database stay in the calling thread, which owns the
+    transaction. A stage may have several workers, to send the chunks of
+    different DHL accounts at the same time.
+
+"""
+import sys
+import threading
+from Queue import Queue, Empty
+from collections import deque
+
+__all__ = ['pipeline', 'threaded']
+
+# End of the items given to a worker
+_DONE = object()
+
+
+def pipeline(source, *stages):
+    """
+    Return the iterator of the items of `source` passed through the stages
+    in turn
+
+    Closing the iterator closes all the stages, from the last one.
+
+    :param stages: Callables taking the iterator of the items of the
+                   previous stage and returning the iterator of their own
+    """
+    chain = [iter(source)]
+    for stage in stages:
+        chain.append(stage(chain[-1]))
+    return _run(chain)
+
+
+def _run(chain):
+    try:
+        for item in chain[-1]:
+            yield item
+    finally:
+        for items in reversed(chain):
+            close = getattr(items, 'close', None)
+            if close is not None:
+                close()
+
+
+def threaded(function, size=1, abandon=None, workers=1):
+    """
+    Return a stage calling `function` on each item in worker threads while
+    the other stages go on in the calling thread
+
+    At most `size` items wait for the workers and `size` results wait to be
+    taken, the workers wait for the next stage when they go faster and the
+    calling thread waits for the workers when it is ahead by `size` items.
+    With more than one worker, the results come in the order they are
+    ready.
+
+    :param function: Callable without database access, thread-safe if
+                     there are many workers
+    :param abandon: Callable called in the calling thread with each result
+                    not taken and each item not processed when the pipeline
+                    is closed early
+    :param workers: Number of worker threads
+    """
+    # Room for the end of each worker
+    size = max(size, workers)
+
+    def stage(items):
+        inputs, outputs = Queue(size), Queue(size)
+        stop = threading.Event()
+
+        def work():
+            while not stop.is_set():
+                item = inputs.get()
+                if item is _DONE:
+                    break
+                try:
+                    outputs.put((item, function(item), None))
+                except Exception:
+                    outputs.put((item, None, sys.exc_info()))
+
+        threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=work, name='shipping_dhl_de')
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        # Items given to the workers whose result was not taken yet
+        pending = deque()
+        exhausted = False
+        try:
+            while pending or not exhausted:
+                block = True
+                if not exhausted and not inputs.full():
+                    # Work on the next item while the workers are busy
+                    item = next(items, _DONE)
+                    if item is _DONE:
+                        exhausted = True
+                        continue
+                    inputs.put(item)
+                    pending.append(item)
+                    block = False
+                try:
+                    item, result, exc_info = outputs.get(block)
+                except Empty:
+                    continue
+                pending.popleft()
+                if exc_info is not None:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                yield result
+        finally:
+            stop.set()
+            unprocessed = []
+            while True:
+                try:
+                    unprocessed.append(inputs.get_nowait())
+                except Empty:
+                    break
+            for _ in threads:
+                inputs.put(_DONE)
+            # Let the workers finish the items they work on
+            results = []
+            while any(t.is_alive() for t in threads) or not outputs.empty():
+                try:
+                    results.append(outputs.get(timeout=0.1))
+                except Empty:
+                    pass
+            for thread in threads:
+                thread.join()
+            if abandon is not None:
+                for item, result, exc_info in results:
+                    abandon(item if exc_info is not None else result)
+                for item in unprocessed:
+                    abandon(item)
+    return stage
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+    profiling.py
+
+    Opt-in profiling of the label making, to see where the time of a slow
+    label goes between the ORM, the marshalling of suds and DHL.
+
+    Enabled for all the calls with ``profile = True`` in the
+    ``[shipping_dhl_de]`` section of the trytond configuration, or for the
+    calls made with ``dhl_de_profile`` in the context. The statistics of
+    each call are dumped in ``profile_path``, the temporary directory by
+    default, and read with the ``pstats`` module.
+
+"""
+import os
+import time
+import cProfile
+import tempfile
+import threading
+from functools import wraps
+
+from logbook import Logger
+
+from trytond.config import config
+from trytond.transaction import Transaction
+
+log = Logger('shipping_dhl_de')
+
+# Ids of shipments put in the name of the files, the others are counted
+MAX_FILENAME_IDS = 10
+
+_local = threading.local()
+
+
+def is_profiling_enabled():
+    """
+    Return True if the calls are to be profiled
+    """
+    if (Transaction().context or {}).get('dhl_de_profile'):
+        return True
+    return bool(config.getboolean('shipping_dhl_de', 'profile'))
+
+
+def get_profile_filename(name, shipment_ids):
+    """
+    Return the path of the statistics file of a call for the shipments
+    """
+    directory = config.get(
+        'shipping_dhl_de', 'profile_path', default=tempfile.gettempdir()
+    )
+    ids = '_'.join(map(str, sorted(shipment_ids)[:MAX_FILENAME_IDS]))
+    if len(shipment_ids) > MAX_FILENAME_IDS:
+        ids += '_and_%d' % (len(shipment_ids) - MAX_FILENAME_IDS)
+    return os.path.join(directory, 'shipping_dhl_de-%s-%s-%d-%s.pstats' % (
+        name, time.strftime('%Y%m%d%H%M%S'), os.getpid(), ids,
+    ))
+
+
+def profiled(name):
+    """
+    Profile the decorated method if enabled, called either on a shipment
+    or with the list of shipments as first argument
+
+    Calls made while profiling are part of the profile of the outer call.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self_or_cls, *args, **kwargs):
+            if getattr(_local, 'profiling', False) or \
+                    not is_profiling_enabled():
+                return method(self_or_cls, *args, **kwargs)
+
+            shipments = args[0] if args else [self_or_cls]
+            filename = get_profile_filename(name, [s.id for s in shipments])
+            profiler = cProfile.Profile()
+            _local.profiling = True
+            try:
+                return profiler.runcall(method, self_or_cls, *args, **kwargs)
+            finally:
+                _local.profiling = False
+                profiler.dump_stats(filename)
+                log.info('Profile of %s saved in %s' % (name, filename))
+        return wrapper
+    return decorator
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+    ratelimit.py
+
+    Token bucket shared by all the threads and processes of a host, used to
+    keep the calls made with one DHL account under the limits of DHL.
+
+    The state of each bucket lives in a small file locked with `flock`
+    while it is read and updated, so workers started independently agree
+    on the number of tokens left without any server.
+
+"""
+import os
+import re
+import time
+import fcntl
+import tempfile
+import threading
+
+from logbook import Logger
+
+from forksafe import ProcessLocal
+
+log = Logger('shipping_dhl_de')
+
+# tokens, last refill, calls, calls that waited, total wait in seconds
+STATE_FORMAT = '%r %r %d %d %r\n'
+
+
+class TokenBucket(object):
+    """
+    Token bucket refilled with `rate` tokens per second up to `burst`
+    tokens
+
+    :param key: Name of the bucket, the buckets with the same key and
+                directory share their tokens
+    :param rate: Number of tokens added per second
+    :param burst: Maximum number of tokens, calls made in a row without
+                  waiting
+    :param directory: Directory of the state files, the temporary
+                      directory by default
+    :param warn_after: Seconds of wait above which a warning is logged,
+                       None to log the waits at debug level only
+    """
+
+    def __init__(self, key, rate, burst=1, directory=None, warn_after=None):
+        assert rate > 0, 'rate must be positive'
+        self.key = key
+        self.rate = float(rate)
+        self.burst = max(int(burst), 1)
+        self.warn_after = warn_after
+        self.path = os.path.join(
+            directory or tempfile.gettempdir(),
+            'shipping_dhl_de-%s.bucket' % re.sub(r'[^\w.-]', '_', key),
+        )
+        # flock is per open file description, threads of the process
+        # must take turns on top of it
+        self._lock = ProcessLocal(threading.Lock)
+
+    def _read(self, fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        content = os.read(fd, 256).split()
+        if len(content) != 5:
+            return float(self.burst), time.time(), 0, 0, 0.
+        tokens, last, calls, waited, wait_time = content
+        return (
+            float(tokens), float(last), int(calls), int(waited),
+            float(wait_time),
+        )
+
+    def _write(self, fd, state):
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, STATE_FORMAT % state)
+
+    def _take(self, waiting):
+        """
+        Take a token if one is available
+
+        :param waiting: Seconds already waited by the caller
+        :return: Seconds to wait before trying again, 0 if the token has
+                 been taken
+        """
+        with self._lock.get():
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                tokens, last, calls, waited, wait_time = self._read(fd)
+                now = time.time()
+                tokens = min(
+                    self.burst, tokens + max(now - last, 0) * self.rate
+                )
+                if tokens < 1:
+                    self._write(
+                        fd, (tokens, now, calls, waited, wait_time)
+                    )
+                    return (1 - tokens) / self.rate
+                calls += 1
+                if waiting:
+                    waited += 1
+                    wait_time += waiting
+                self._write(
+                    fd, (tokens - 1, now, calls, waited, wait_time)
+                )
+                return 0
+            finally:
+                os.close(fd)
+
+    def acquire(self):
+        """
+        Block until a token is available and take it
+
+        :return: Seconds spent waiting
+        """
+        start = None
+        waiting = 0
+        while True:
+            delay = self._take(waiting)
+            if not delay:
+                break
+            if start is None:
+                start = time.time()
+            time.sleep(delay)
+            waiting = time.time() - start
+        if waiting:
+            message = 'Waited %.3fs for the DHL DE rate limit of %s' % (
+                waiting, self.key
+            )
+            if self.warn_after is not None and waiting >= self.warn_after:
+                log.warning(message)
+            else:
+                log.debug(message)
+        return waiting
+
+    def get_stats(self):
+        """
+        Return the wait metrics of the bucket for all the processes
+
+        :return: Dictionary with the number of `calls`, the number of calls
+                 which had to wait (`waited`) and the total `wait_time` in
+                 seconds
+        """
+        if not os.path.exists(self.path):
+            return {'calls': 0, 'waited': 0, 'wait_time': 0.}
+        with self._lock.get():
+            fd = os.open(self.path, os.O_RDONLY)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                _, _, calls, waited, wait_time = self._read(fd)
+            finally:
+                os.close(fd)
+        return {'calls': calls, 'waited': waited, 'wait_time': wait_time}
@@ -3,19 +3,64 @@
     shipment.py
 
 """
-import requests
+import os
+import sys
+import base64
+import filecmp
+import hashlib
+import tempfile
+from contextlib import closing
+from collections import namedtuple
+from datetime import datetime, time, timedelta, date as datetime_date
+from decimal import Decimal
+from itertools import groupby, izip, izip_longest
+from multiprocessing.pool import ThreadPool
+from operator import attrgetter
+from time import mktime
+
+from sql.aggregate import Min
+from sql.operators import Concat
 
 from sale import INTERNATIONAL_STATES, INTERNATIONAL_DEPENDS
 from trytond.model import fields, ModelView
 from trytond.pool import Pool, PoolMeta
 from trytond.pyson import Eval, Bool
 from trytond.wizard import Wizard, StateView, Button
+from trytond.transaction import Transaction
+from trytond.config import config
+from trytond.tools import grouped_slice
 from sale import DHL_DE_PRODUCTS, DHL_DE_EXPORT_TYPES, DHL_DE_INCOTERMS
-from carrier import log
+from party import split_dhl_de_name
+from carrier import log, DHL_DE_NUMBER_BATCH_SIZE, split_by_weights
+from tracking import TRACKING_PROVIDERS
+from profiling import profiled
+from pipeline import pipeline, threaded
+from states import DHLDEFault
+from forksafe import get_http_session
+from capture import get_wire_capture
 
 __metaclass__ = PoolMeta
 __all__ = [
     'ShipmentOut', 'GenerateShippingLabel', 'ShippingDHLDE',
+    'GenerateLabelsStart', 'GenerateLabelsResult', 'GenerateLabels',
+]
+
+# Interval between two tracking syncs of a shipment by its age, older
+# shipments change less often
+DHL_DE_TRACKING_BACKOFF = [
+    (timedelta(days=1), timedelta(hours=1)),
+    (timedelta(days=3), timedelta(hours=4)),
+    (timedelta(days=14), timedelta(hours=12)),
+]
+DHL_DE_TRACKING_MAX_INTERVAL = timedelta(days=1)
+
+# Shipments older than this are not tracked anymore
+DHL_DE_TRACKING_MAX_AGE = timedelta(days=60)
+
+DHL_DE_MANIFEST_STATES = [
+    (None, ''),
+    ('manifested', 'Manifested'),
+    ('failed', 'Failed'),
 ]
 
 STATES = {
@@ -23,6 +68,156 @@ STATES = {
     'required': Bool(Eval('is_dhl_de_shipping')),
 }
 
+# Labels are streamed from DHL in chunks of this size
+LABEL_CHUNK_SIZE = 64 * 1024
+
+# Labels downloaded at the same time when fetched again in bulk
+LABEL_DOWNLOAD_THREADS = 8
+
+# Requests waiting between the stages of a label batch
+LABEL_QUEUE_SIZE = 2
+
+# Accounts of a carrier group sending their requests at the same time
+LABEL_SEND_THREADS = 4
+
+# Product and procedure (part of the account number) of the 2.x API for the
+# product codes of the 1.0 API
+DHL_DE_V2_PRODUCTS = {
+    'EPN': ('V01PAK', '01'),
+    'BPI': ('V53WPAK', '53'),
+}
+
+# Single position of the export document, the value is per unit
+ExportPosition = namedtuple('ExportPosition', [
+    'description', 'country_code', 'amount', 'net_weight', 'value',
+])
+
+# Data of the export document of a shipment, read for a whole batch
+ExportData = namedtuple('ExportData', ['invoice_date', 'positions'])
+
+# Single request of a label batch as it goes through the stages
+LabelChunk = namedtuple('LabelChunk', [
+    'carrier', 'shipments', 'requests', 'send', 'shipment_orders',
+    'directory', 'creation_states', 'fault', 'labels',
+])
+
+DHL_DE_V2_EXPORT_TYPES = {
+    '0': 'OTHER',
+    '1': 'PRESENT',
+    '2': 'COMMERCIAL_SAMPLE',
+    '3': 'DOCUMENT',
+    '4': 'RETURN_OF_GOODS',
+}
+
+
+def utc_day_bounds(date):
+    """
+    Return the start of the local day `date` and of the next day as naive
+    UTC datetimes, comparable with the `create_date` of the records
+    """
+    return tuple(
+        datetime.utcfromtimestamp(mktime(
+            datetime.combine(day, time.min).timetuple()
+        )) for day in (date, date + timedelta(days=1))
+    )
+
+
+def dhl_de_account_key(shipment):
+    """
+    Return the id of the carrier of the account the shipment was created
+    with at DHL
+    """
+    return shipment.get_dhl_de_account().id
+
+
+def spool_label(chunks, directory):
+    """
+    Write the label given as an iterable of byte chunks into a temporary
+    file of `directory` while hashing it. The database is not used, so
+    labels can be spooled from other threads.
+
+    :return: Tuple of the name of the temporary file and the md5 digest
+    """
+    md5 = hashlib.md5()
+    with tempfile.NamedTemporaryFile(
+            dir=directory, prefix='dhl_de-', delete=False) as tmp_file:
+        try:
+            for chunk in chunks:
+                md5.update(chunk)
+                tmp_file.write(chunk)
+        except Exception:
+            # Do not leave the part already written in the filestore
+            tmp_file.close()
+            os.remove(tmp_file.name)
+            raise
+    return tmp_file.name, md5.hexdigest()
+
+
+def fetch_label(label_url, directory):
+    """
+    Stream the label at `label_url` into a temporary file of `directory`
+    without loading the whole document in memory.
+
+    :return: Tuple of the name of the temporary file and the md5 digest
+    """
+    # The connection to the host is kept for the next labels of the thread
+    response = get_http_session().get(label_url, stream=True)
+    try:
+        response.raise_for_status()
+        return spool_label(
+            response.iter_content(LABEL_CHUNK_SIZE), directory
+        )
+    finally:
+        response.close()
+
+
+def send_label_chunk(chunk):
+    """
+    Send the orders of the `LabelChunk` to DHL, without database access
+
+    :return: The chunk with the `CreationState` read and the exception
+             info of the fault if any
+    """
+    creation_states = []
+    try:
+        for creation_state in chunk.send(chunk.shipment_orders):
+            creation_states.append(creation_state)
+    except Exception:
+        return chunk._replace(
+            creation_states=creation_states, fault=sys.exc_info()
+        )
+    return chunk._replace(creation_states=creation_states)
+
+
+def download_label_chunk(chunk):
+    """
+    Spool the labels of the orders of the `LabelChunk` accepted by DHL into
+    the filestore directory, without database access
+
+    :return: The chunk with, for each `CreationState`, the tuple of the
+             name of the temporary file and md5 digest of the label, the
+             exception raised if it could not be downloaded or None
+    """
+    import requests
+
+    labels = []
+    for creation_state in chunk.creation_states:
+        if creation_state.status_code != '0':  # pragma: no cover
+            labels.append(None)
+        elif creation_state.label_data:
+            labels.append(spool_label(
+                [base64.b64decode(creation_state.label_data)],
+                chunk.directory
+            ))
+        else:
+            try:
+                labels.append(
+                    fetch_label(creation_state.label_url, chunk.directory)
+                )
+            except requests.RequestException, exc:  # pragma: no cover
+                labels.append(exc)
+    return chunk._replace(labels=labels)
+
 
 class ShipmentOut:
     "Shipment Out"
@@ -48,6 +243,27 @@ class ShipmentOut:
         DHL_DE_INCOTERMS, 'Terms of Trade (incoterms)',
         depends=INTERNATIONAL_DEPENDS, states=INTERNATIONAL_STATES
     )
+    dhl_de_manifest_state = fields.Selection(
+        DHL_DE_MANIFEST_STATES, 'DHL DE Manifest State', readonly=True
+    )
+    dhl_de_manifest_date = fields.Date('DHL DE Manifest Date', readonly=True)
+    dhl_de_delivered = fields.Boolean('DHL DE Delivered', readonly=True)
+    dhl_de_tracking_sync = fields.DateTime(
+        'DHL DE Last Tracking Sync', readonly=True
+    )
+    dhl_de_tracking_events = fields.One2Many(
+        'shipping_dhl_de.tracking_event', 'shipment', 'DHL DE Tracking',
+        readonly=True
+    )
+    dhl_de_requests = fields.One2Many(
+        'shipping_dhl_de.request', 'shipment', 'DHL DE Requests',
+        readonly=True
+    )
+    dhl_de_account = fields.Many2One(
+        'carrier', 'DHL DE Account', readonly=True,
+        help="Carrier of the DHL DE account which created the shipment, "
+        "one of the group of its carrier"
+    )
 
     @classmethod
     def view_attributes(cls):
@@ -64,6 +280,12 @@ class ShipmentOut:
         """
         return self.carrier and self.carrier.carrier_cost_method == 'dhl_de'
 
+    def get_dhl_de_account(self):
+        """
+        Return the carrier of the DHL DE account creating the shipment
+        """
+        return self.dhl_de_account or self.carrier
+
     @fields.depends('is_dhl_de_shipping', 'carrier')
     def on_change_carrier(self):
         """
@@ -74,6 +296,52 @@ class ShipmentOut:
         self.is_dhl_de_shipping = self.carrier and \
             self.carrier.carrier_cost_method == 'dhl_de' or None
 
+    @classmethod
+    def __setup__(cls):
+        super(ShipmentOut, cls).__setup__()
+        cls._buttons.update({
+            'cancel_dhl_de_labels': {
+                'invisible': ~Bool(Eval('is_dhl_de_shipping')) |
+                ~Bool(Eval('tracking_number')) | (Eval('state') == 'done'),
+            },
+            'refetch_dhl_de_labels': {
+                'invisible': ~Bool(Eval('is_dhl_de_shipping')) |
+                ~Bool(Eval('tracking_number')),
+            },
+        })
+        cls._error_messages.update({
+            'dhl_de_multiple_packages': (
+                'Shipment %s has more than one package, which is not '
+                'supported by the DHL DE API version %s.'
+            ),
+            'dhl_de_invalid_shipments':
+                'Some shipments can not be sent to DHL DE:\n\n%s',
+            'dhl_de_product_code_missing': 'DHL DE product code is missing.',
+            'dhl_de_receiver_name_missing': 'Receiver name is missing.',
+            'dhl_de_package_weight_missing': 'Package %s has no weight.',
+            'dhl_de_export_data_missing': (
+                'Export type, export type description and terms of trade '
+                'are required for international shipments.'
+            ),
+            'dhl_de_customs_value_missing':
+                'Customs value of product "%s" is missing.',
+            'dhl_de_cancel_failed':
+                'Some shipments could not be cancelled at DHL DE:\n\n%s',
+            'dhl_de_fetch_labels_failed':
+                'Some labels could not be fetched from DHL DE:\n\n%s',
+            'dhl_de_label_download_failed':
+                'Error in downloading label from %s: %s',
+            'dhl_de_no_answer': 'No answer from DHL DE for shipment %s.',
+            'dhl_de_request_in_flight': (
+                'The last request to DHL DE for shipment %s got no answer, '
+                'its label may exist already. Check it at DHL and mark the '
+                'request as failed to send the shipment again.'
+            ),
+            'dhl_de_tracking_provider_unknown': (
+                'Unknown DHL DE tracking provider "%s", use one of: %s.'
+            ),
+        })
+
     def _get_weight_uom(self):
         """
         Return uom for DHL DE
@@ -95,7 +363,7 @@ class ShipmentOut:
         shipment_details.ShipmentDate = Date.today().isoformat()
 
         # TODO: add customs value in DeclaredValueOfGoods
-        dhl_de_account_no = self.carrier.dhl_de_account_no
+        dhl_de_account_no = self.get_dhl_de_account().dhl_de_account_no
         shipment_details.EKP = dhl_de_account_no[:10]
         shipment_details.Attendance = {
             'partnerID': dhl_de_account_no[-2:]
@@ -109,7 +377,7 @@ class ShipmentOut:
 
         for package in self.packages:
             shipment_item = client.factory.create('ns0:ShipmentItemDDType')
-            shipment_item.WeightInKG = package.weight
+            shipment_item.WeightInKG = package.get_dhl_de_weight()
 
             # TODO: Add package type
             shipment_item.PackageType = 'PK'
@@ -151,6 +419,18 @@ class ShipmentOut:
             from_address._get_dhl_de_communication_type(client)
         return shipper_type
 
+    def _get_dhl_de_receiver_name(self):
+        """
+        Return the name of the receiver with its first and last names: the
+        name of the delivery address or else the name of the customer
+        """
+        to_address = self.delivery_address
+        if to_address.name:
+            values = to_address.get_dhl_de_values()
+            return values['name'], values['firstname'], values['lastname']
+        name = self.customer.name
+        return (name, ) + split_dhl_de_name(name)
+
     def _get_dhl_de_receiver_type(self, client):
         """
         Return `ns0:ShipperDDType`
@@ -158,15 +438,11 @@ class ShipmentOut:
         receiver_type = client.factory.create('ns0:ReceiverDDType')
         to_address = self.delivery_address
 
-        receiver_name = to_address.name or self.customer.name
-        if ' ' in receiver_name:
-            fname, lname = receiver_name.split(' ', 1)
-        else:  # pragma: no cover
-            fname, lname = receiver_name, '-'
+        _, firstname, lastname = self._get_dhl_de_receiver_name()
         receiver_type.Company = {
             'Person': {
-                'firstname': fname,
-                'lastname': lname
+                'firstname': firstname,
+                'lastname': lastname,
             }
         }
         receiver_type.Address = to_address.as_dhl_de_address(client)
@@ -175,36 +451,180 @@ class ShipmentOut:
             to_address._get_dhl_de_communication_type(client)
         return receiver_type
 
+    @classmethod
+    def get_dhl_de_export_invoice_dates(cls, shipments):
+        """
+        Return the export invoice date of the shipments, read in a single
+        query for all of them
+
+        Fallback from invoice_date > sale_date > today_date
+
+        :return: Dictionary of the dates by shipment id
+        """
+        pool = Pool()
+        Date = pool.get('ir.date')
+        Move = pool.get('stock.move')
+        SaleLine = pool.get('sale.line')
+        Sale = pool.get('sale.sale')
+        LineMove = pool.get('account.invoice.line-stock.move')
+        InvoiceLine = pool.get('account.invoice.line')
+        Invoice = pool.get('account.invoice')
+        cursor = Transaction().cursor
+
+        move = Move.__table__()
+        sale_line = SaleLine.__table__()
+        sale = Sale.__table__()
+        line_move = LineMove.__table__()
+        invoice_line = InvoiceLine.__table__()
+        invoice = Invoice.__table__()
+
+        query = move.join(
+            sale_line, 'LEFT', condition=move.origin == Concat(
+                SaleLine.__name__ + ',', sale_line.id
+            )
+        ).join(
+            sale, 'LEFT', condition=sale.id == sale_line.sale
+        ).join(
+            line_move, 'LEFT', condition=line_move.stock_move == move.id
+        ).join(
+            invoice_line, 'LEFT',
+            condition=invoice_line.id == line_move.invoice_line
+        ).join(
+            invoice, 'LEFT', condition=invoice.id == invoice_line.invoice
+        )
+
+        today = Date.today()
+        dates = dict((s.id, today) for s in shipments)
+        for sub_shipments in grouped_slice(shipments):
+            cursor.execute(*query.select(
+                move.shipment, Min(invoice.invoice_date), Min(sale.sale_date),
+                where=move.shipment.in_([
+                    '%s,%s' % (cls.__name__, s.id) for s in sub_shipments
+                ]),
+                group_by=move.shipment
+            ))
+            for shipment, invoice_date, sale_date in cursor.fetchall():
+                date = invoice_date or sale_date
+                if not date:
+                    continue
+                if not isinstance(date, datetime_date):
+                    # Aggregates lose the type of the column with sqlite
+                    date = datetime_date(*map(int, date.split('-')))
+                dates[int(shipment.split(',')[1])] = date
+        return dates
+
     def _get_dhl_de_export_invoice_date(self):
         """
         Return DHL DE Export Invoice Date
+        """
+        return self.get_dhl_de_export_invoice_dates([self])[self.id]
 
-        Fallback from invoice_date > sale_date > today_date
+    @classmethod
+    def get_dhl_de_export_data(cls, shipments):
         """
-        Date = Pool().get('ir.date')
+        Return the data of the export documents of the shipments
 
-        try:
-            invoice_date = \
-                self.outgoing_moves[0].invoice_lines[0].invoice.invoice_date
-        except IndexError:  # pragma: no cover
-            invoice_date = None
-        try:
-            sale_date = self.outgoing_moves[0].sale.sale_date
-        except IndexError:  # pragma: no cover
-            sale_date = None
+        :return: Dictionary of `ExportData` by shipment id
+        """
+        invoice_dates = cls.get_dhl_de_export_invoice_dates(shipments)
+        positions = cls.get_dhl_de_export_positions(shipments)
+        return dict(
+            (s.id, ExportData(invoice_dates[s.id], positions[s.id]))
+            for s in shipments
+        )
 
-        return invoice_date or sale_date or Date.today()
+    @classmethod
+    def get_dhl_de_export_positions(cls, shipments):
+        """
+        Return the positions of the export documents of the shipments, one
+        per product, reading the customs data of each product only once
 
-    def _get_dhl_de_export_doc_type(self, client):
+        :return: Dictionary of the lists of `ExportPosition` by shipment id
+        """
+        pool = Pool()
+        Move = pool.get('stock.move')
+        UOM = pool.get('product.uom')
+
+        uom_kg = UOM.search([('symbol', '=', 'kg')])[0]
+        shipment_ids = {}
+        for shipment in shipments:
+            for move in shipment.outgoing_moves:
+                shipment_ids[move.id] = shipment.id
+
+        # Browsed together, the products of all the moves are read at once
+        customs, totals, keys = {}, {}, []
+        for move in Move.browse(sorted(shipment_ids)):
+            product = move.product
+            if product.id not in customs:
+                customs[product.id] = (
+                    product.name,
+                    product.country_of_origin and
+                    product.country_of_origin.code,
+                    product.customs_value_used or Decimal('0'),
+                )
+            key = (shipment_ids[move.id], product.id)
+            if key not in totals:
+                totals[key] = [0, 0]
+                keys.append(key)
+            totals[key][0] += move.internal_quantity
+            totals[key][1] += move.get_weight(uom_kg, silent=True)
+
+        positions = dict((s.id, []) for s in shipments)
+        for shipment_id, product_id in keys:
+            description, country_code, value = customs[product_id]
+            quantity, weight = totals[shipment_id, product_id]
+            if quantity == int(quantity):
+                amount = int(quantity)
+            else:
+                # Amounts are integers, declare the quantity as one unit
+                amount, value = 1, value * Decimal(str(quantity))
+            positions[shipment_id].append(ExportPosition(
+                description=description,
+                country_code=country_code,
+                amount=amount,
+                net_weight=weight,
+                value=value,
+            ))
+        return positions
+
+    def _get_dhl_de_declared_positions(self, export_positions):
+        """
+        Return the positions to declare for the shipment: one per product
+        with BPI, the only product allowing many, a single one otherwise
+        """
+        currency = self.company.currency
+        from_address = self._get_ship_from_address()
+        if self.dhl_de_product_code != 'BPI':
+            export_positions = [ExportPosition(
+                description=','.join(
+                    p.description for p in export_positions
+                ),
+                country_code=None,
+                amount=1,
+                net_weight=sum(
+                    p.get_dhl_de_weight() for p in self.packages
+                ),
+                value=sum(p.value * p.amount for p in export_positions),
+            )]
+        return [
+            p._replace(
+                country_code=p.country_code or from_address.country.code,
+                value=currency.round(p.value),
+            ) for p in export_positions
+        ]
+
+    def _get_dhl_de_export_doc_type(self, client, export_data=None):
         """
         Return `ExportDocumentDDType`
         """
+        if export_data is None:
+            export_data = self.get_dhl_de_export_data([self])[self.id]
+
         export_type = client.factory.create('ns0:ExportDocumentDDType')
         export_type.InvoiceType = 'commercial'
 
         # XXX: Invoice Date
-        export_type.InvoiceDate = \
-            self._get_dhl_de_export_invoice_date().isoformat()
+        export_type.InvoiceDate = export_data.invoice_date.isoformat()
 
         # Export type
         #   (
@@ -215,10 +635,6 @@ class ShipmentOut:
         export_type.ExportType = '0'
         export_type.ExportTypeDescription = self.dhl_de_export_type_description
 
-        value = 0
-        for move in self.outgoing_moves:
-            value += float(move.product.customs_value_used) * move.quantity
-
         # Element provides terms of trades,
         # i.e. incoterms codes like DDU, CIP et al. Field length must be = 3.
         export_type.TermsOfTrade = self.dhl_de_terms_of_trade
@@ -226,30 +642,30 @@ class ShipmentOut:
         # Amount of shipment positions. Multiple positions not allowed for EUP
         # and EPI, only BPI allows amount > 1. Field length must be less than
         # or equal to 22.
-        export_type.Amount = 1
-        description = ','.join([
-            move.product.name for move in self.outgoing_moves
-        ])
-        export_type.Description = description
+        positions = self._get_dhl_de_declared_positions(
+            export_data.positions
+        )
+        export_type.Amount = len(positions)
+        export_type.Description = ','.join(p.description for p in positions)
 
-        package_weight = sum([p.weight for p in self.packages])
         from_address = self._get_ship_from_address()
+        currency_code = self.company.currency.code
         export_type.CountryCodeOrigin = from_address.country.code
-        export_type.CustomsValue = value
-        export_type.CustomsCurrency = self.company.currency.code
-        export_type.ExportDocPosition = {
-            'Description': description,
-            'CountryCodeOrigin': from_address.country.code,
-            'Amount': 1,
-            'NetWeightInKG': package_weight,
-            'GrossWeightInKG': package_weight,
-            'CustomsValue': value,
-            'CustomsCurrency': self.company.currency.code,
-        }
+        export_type.CustomsValue = sum(p.value * p.amount for p in positions)
+        export_type.CustomsCurrency = currency_code
+        export_type.ExportDocPosition = [{
+            'Description': position.description,
+            'CountryCodeOrigin': position.country_code,
+            'Amount': position.amount,
+            'NetWeightInKG': position.net_weight,
+            'GrossWeightInKG': position.net_weight,
+            'CustomsValue': position.value,
+            'CustomsCurrency': currency_code,
+        } for position in positions]
 
         return export_type
 
-    def _get_dhl_de_shipment_type(self, client):
+    def _get_dhl_de_shipment_type(self, client, export_data=None):
         """
         Return `ns0:Shipment` element for this shipment
         """
@@ -260,71 +676,1005 @@ class ShipmentOut:
         shipment_type.Receiver = self._get_dhl_de_receiver_type(client)
         if self.is_international_shipping:
             shipment_type.ExportDocument = self._get_dhl_de_export_doc_type(
-                client)
+                client, export_data)
         return shipment_type
 
-    def make_dhl_de_labels(self):
+    @classmethod
+    def _get_dhl_de_label_directory(cls):
         """
-        Make labels for the shipment using DHL DE
+        Return the directory of the attachment filestore of the database
+        """
+        directory = os.path.join(
+            config.get('database', 'path'), Transaction().cursor.dbname
+        )
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0770)
+        return directory
 
-        :return: Tracking number as string
+    @classmethod
+    def _file_dhl_de_label(cls, tmp_name, digest):
+        """
+        Move the label spooled into `tmp_name` to its place in the
+        attachment filestore and return the `digest` and `collision` values
+        for the `ir.attachment` pointing to it.
+
+        The file is addressed by its md5 digest like `ir.attachment` does,
+        so an identical label already on disk is reused instead of copied.
         """
         Attachment = Pool().get('ir.attachment')
+        cursor = Transaction().cursor
+        table = Attachment.__table__()
 
-        if self.state not in ('packed', 'done'):  # pragma: no cover
-            self.raise_user_error('invalid_state')
+        directory = os.path.join(
+            os.path.dirname(tmp_name), digest[0:2], digest[2:4]
+        )
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0770)
+
+        collision = 0
+        filename = os.path.join(directory, digest)
+        if os.path.isfile(filename) and \
+                not filecmp.cmp(tmp_name, filename, shallow=False):
+            # Same digest but different content, find the matching
+            # collision or take the next free one
+            cursor.execute(*table.select(
+                table.collision,
+                where=(table.digest == digest) & (table.collision != 0),
+                group_by=table.collision,
+                order_by=table.collision
+            ))
+            collisions = [row[0] for row in cursor.fetchall()]
+            collision = (collisions[-1] if collisions else 0) + 1
+            for candidate in collisions:  # pragma: no cover
+                candidate_name = os.path.join(
+                    directory, '%s-%s' % (digest, candidate)
+                )
+                if os.path.isfile(candidate_name) and filecmp.cmp(
+                        tmp_name, candidate_name, shallow=False):
+                    collision = candidate
+                    break
+            filename = os.path.join(directory, '%s-%s' % (digest, collision))
+
+        if os.path.isfile(filename):
+            os.remove(tmp_name)
+        else:
+            os.rename(tmp_name, filename)
 
-        if not self.is_dhl_de_shipping:  # pragma: no cover
-            self.raise_user_error('wrong_carrier', 'DHL_DE')
+        return {
+            'digest': unicode(digest),
+            'collision': collision,
+        }
 
-        if self.tracking_number:  # pragma: no cover
-            self.raise_user_error('tracking_number_already_present')
+    @classmethod
+    def _store_dhl_de_label(cls, chunks):
+        """
+        Write the label given as an iterable of byte chunks into the
+        attachment filestore and return the `digest` and `collision` values
+        for the `ir.attachment` pointing to it.
+        """
+        return cls._file_dhl_de_label(
+            *spool_label(chunks, cls._get_dhl_de_label_directory())
+        )
 
-        if not self.packages:
-            self.raise_user_error("no_packages", error_args=(self.id,))
+    def _download_dhl_de_label(self, label_url):
+        """
+        Stream the label at `label_url` to the filestore without loading the
+        whole document in memory.
+
+        :return: Values to create the `ir.attachment` of the label with
+        """
+        import requests
+
+        try:
+            spooled = fetch_label(
+                label_url, self._get_dhl_de_label_directory()
+            )
+        except requests.RequestException:  # pragma: no cover
+            self.raise_user_error(
+                'Error in downloading label from %s' % label_url)
+        return self._file_dhl_de_label(*spooled)
+
+    def _get_dhl_de_shipment_order_v2(self, export_data=None):
+        """
+        Return `ShipmentOrder` of the 2.x API for this shipment
+        """
+        Date = Pool().get('ir.date')
+
+        if len(self.packages) > 1:
+            self.raise_user_error(
+                'dhl_de_multiple_packages', error_args=(
+                    self.id, self.carrier.dhl_de_api_version,
+                )
+            )
+
+        product, procedure = DHL_DE_V2_PRODUCTS[self.dhl_de_product_code]
+        dhl_de_account_no = self.get_dhl_de_account().dhl_de_account_no
+        package, = self.packages
+
+        from_address = self._get_ship_from_address()
+        if not from_address:  # pragma: no cover
+            self.raise_user_error('Shipper address is missing')
+        to_address = self.delivery_address
+
+        shipment = {
+            'ShipmentDetails': {
+                'product': product,
+                # EKP, procedure and participation
+                'accountNumber': '%s%s%s' % (
+                    dhl_de_account_no[:10], procedure,
+                    dhl_de_account_no[-2:],
+                ),
+                # Appear on Label
+                'customerReference': self.customer.code or self.customer.id,
+                'shipmentDate': Date.today().isoformat(),
+                'ShipmentItem': {
+                    'weightInKG': package.get_dhl_de_weight(),
+                },
+            },
+            'Shipper': {
+                'Name': {
+                    'name1': self.company.party.name,
+                },
+                'Address': from_address.as_dhl_de_address_v2(),
+                'Communication': from_address._get_dhl_de_communication_v2(),
+            },
+            'Receiver': {
+                'name1': self._get_dhl_de_receiver_name()[0],
+                'Address': to_address.as_dhl_de_address_v2(),
+                'Communication': to_address._get_dhl_de_communication_v2(),
+            },
+        }
+        if self.is_international_shipping:
+            shipment['ExportDocument'] = self._get_dhl_de_export_doc_v2(
+                export_data
+            )
+
+        return {
+            'sequenceNumber': '%s' % self.id,
+            'Shipment': shipment,
+        }
+
+    def _get_dhl_de_export_doc_v2(self, export_data=None):
+        """
+        Return `ExportDocument` of the 2.x API
+        """
+        if export_data is None:
+            export_data = self.get_dhl_de_export_data([self])[self.id]
+        from_address = self._get_ship_from_address()
+
+        return {
+            'exportType': DHL_DE_V2_EXPORT_TYPES.get(
+                self.dhl_de_export_type, 'OTHER'
+            ),
+            'exportTypeDescription': self.dhl_de_export_type_description,
+            'termsOfTrade': self.dhl_de_terms_of_trade,
+            'placeOfCommital': from_address.city,
+            'additionalFee': 0,
+            'ExportDocPosition': [{
+                'description': position.description,
+                'countryCodeOrigin': position.country_code,
+                'amount': position.amount,
+                'netWeightInKG': position.net_weight,
+                'customsValue': position.value,
+            } for position in self._get_dhl_de_declared_positions(
+                export_data.positions
+            )],
+        }
+
+    def _get_dhl_de_shipment_order(self, client, export_data=None):
+        """
+        Return the ShipmentOrder for this shipment in the API version of the
+        carrier
+
+        :param export_data: `ExportData` of the shipment if already read for
+                            the batch
+        """
+        if self.get_dhl_de_account().dhl_de_api_version == '2.2':
+            return self._get_dhl_de_shipment_order_v2(export_data)
 
-        client = self.carrier.get_dhl_de_client()
         shipment_order_type = client.factory.create('ns0:ShipmentOrderDDType')
         shipment_order_type.SequenceNumber = '%s' % self.id
-        shipment_order_type.Shipment = self._get_dhl_de_shipment_type(client)
-
-        response = self.carrier.send_dhl_de_create_shipment_shipment_dd(
-            [shipment_order_type]
+        shipment_order_type.Shipment = self._get_dhl_de_shipment_type(
+            client, export_data
         )
+        return shipment_order_type
+
+    def _apply_dhl_de_creation_state(self, creation_state, label=None):
+        """
+        Save tracking numbers and label returned by DHL for this shipment
+
+        :param creation_state: `CreationState` of this shipment
+        :param label: Label already spooled by `download_label_chunk`, or
+                      the values of a label already in the filestore
+        :return: Tracking number as string
+        """
+        Attachment = Pool().get('ir.attachment')
 
-        creation_state, = response.CreationState
-        if creation_state.StatusCode != '0':  # pragma: no cover
-            log.debug(client.last_sent())
-            log.debug(client.last_received())
-            self.raise_user_error('\n'.join(creation_state.StatusMessage))
-        tracking_number = \
-            creation_state.ShipmentNumber.shipmentNumber
-        label_url = creation_state.Labelurl
+        tracking_number = creation_state.shipment_number
 
         self.tracking_number = unicode(tracking_number)
         self.save()
 
-        # DHL returns the tracking number of each piece in reverse order
-        piece_info = creation_state.PieceInformation
-        piece_info.reverse()
-        for package, package_info in zip(self.packages, piece_info):
-            package.tracking_number = package_info.PieceNumber.licensePlate
+        for package, piece_number in zip(
+                self.packages, creation_state.piece_numbers):
+            package.tracking_number = piece_number
             package.save()
 
-        try:
-            pdf_label = requests.get(label_url)
-        except:  # pragma: no cover
+        if isinstance(label, Exception):  # pragma: no cover
             self.raise_user_error(
-                'Error in downloading label from %s' % label_url)
-        Attachment.create([{
+                'Error in downloading label from %s' % creation_state.label_url
+            )
+        elif isinstance(label, dict):
+            values = dict(label)
+        elif label is not None:
+            values = self._file_dhl_de_label(*label)
+        elif creation_state.label_data:
+            values = self._store_dhl_de_label(
+                [base64.b64decode(creation_state.label_data)]
+            )
+        else:
+            values = self._download_dhl_de_label(creation_state.label_url)
+        values.update({
             'name': "%s.pdf" % (
                 tracking_number,
             ),
-            'data': pdf_label.content,
             'resource': '%s,%s' % (self.__name__, self.id)
-        }])
+        })
+        Attachment.create([values])
         return tracking_number
 
+    def _dhl_de_problem(self, error, *error_args):
+        """
+        Return the message of the error instead of raising it
+        """
+        return self.raise_user_error(
+            error, error_args=error_args or None, raise_exception=False
+        )
+
+    def _get_dhl_de_package_problems(self):
+        problems = []
+        if not self.packages:
+            problems.append(self._dhl_de_problem('no_packages', self.id))
+        elif len(self.packages) > 1 and \
+                self.carrier.dhl_de_api_version == '2.2':  # pragma: no cover
+            problems.append(self._dhl_de_problem(
+                'dhl_de_multiple_packages', self.id,
+                self.carrier.dhl_de_api_version
+            ))
+        for package in self.packages:
+            if not package.get_dhl_de_weight():  # pragma: no cover
+                problems.append(self._dhl_de_problem(
+                    'dhl_de_package_weight_missing', package.rec_name
+                ))
+        return problems
+
+    def _get_dhl_de_address_problems(self):
+        problems = []
+        from_address = self._get_ship_from_address()
+        if from_address:
+            problems.extend(from_address.get_dhl_de_problems())
+        else:  # pragma: no cover
+            problems.append(self._dhl_de_problem('warehouse_address_missing'))
+
+        to_address = self.delivery_address
+        problems.extend(to_address.get_dhl_de_problems())
+        if not (to_address.name or self.customer.name):  # pragma: no cover
+            problems.append(
+                self._dhl_de_problem('dhl_de_receiver_name_missing')
+            )
+        return problems
+
+    def _get_dhl_de_export_problems(self):
+        problems = []
+        if not (self.dhl_de_export_type and
+                self.dhl_de_export_type_description and
+                self.dhl_de_terms_of_trade):  # pragma: no cover
+            problems.append(self._dhl_de_problem('dhl_de_export_data_missing'))
+        for move in self.outgoing_moves:
+            if move.product.customs_value_used is None:  # pragma: no cover
+                problems.append(self._dhl_de_problem(
+                    'dhl_de_customs_value_missing', move.product.rec_name
+                ))
+        return problems
+
+    def get_dhl_de_problems(self):
+        """
+        Return the list of reasons why DHL would refuse to make labels for
+        this shipment, checked locally against the data sent by the label
+        building methods
+        """
+        if self.state not in ('packed', 'done'):  # pragma: no cover
+            return [self._dhl_de_problem('invalid_state')]
+        if not self.is_dhl_de_shipping:  # pragma: no cover
+            return [self._dhl_de_problem('wrong_carrier', 'DHL_DE')]
+        if self.tracking_number:  # pragma: no cover
+            return [self._dhl_de_problem('tracking_number_already_present')]
+
+        problems = self._get_dhl_de_package_problems()
+        if not self.dhl_de_product_code:  # pragma: no cover
+            problems.append(
+                self._dhl_de_problem('dhl_de_product_code_missing')
+            )
+        problems.extend(self._get_dhl_de_address_problems())
+        if self.is_international_shipping:
+            problems.extend(self._get_dhl_de_export_problems())
+        return problems
+
+    @classmethod
+    def validate_dhl_de_shipments(cls, shipments):
+        """
+        Check locally all the shipments before they are sent to DHL
+
+        :return: Dictionary of the list of problems by shipment, only for
+                 the shipments with problems
+        """
+        problems = {}
+        for shipment in shipments:
+            shipment_problems = shipment.get_dhl_de_problems()
+            if shipment_problems:
+                problems[shipment] = shipment_problems
+        return problems
+
+    @classmethod
+    def check_dhl_de_shipments(cls, shipments):
+        """
+        Raise an error listing all the problems of all the shipments which
+        DHL would refuse
+        """
+        problems = cls.validate_dhl_de_shipments(shipments)
+        if not problems:
+            return
+
+        cls.raise_user_error(
+            'dhl_de_invalid_shipments', error_args=('\n\n'.join(
+                '%s:\n%s' % (shipment.rec_name, '\n'.join(
+                    '  - %s' % message for message in messages
+                )) for shipment, messages in sorted(
+                    problems.iteritems(), key=lambda item: item[0].id
+                )
+            ),)
+        )
+
+    @classmethod
+    @profiled('labels_batch')
+    def make_dhl_de_labels_batch(cls, shipments, checked=False):
+        """
+        Make labels for many shipments using DHL DE, sending the orders of
+        each carrier in as few requests as its API version allows.
+
+        The result of each order is saved as soon as it is read from the
+        response. Orders or whole requests refused by DHL do not stop the
+        others, their messages are returned instead.
+
+        The requests flow through the stages of a pipeline one at a time,
+        so the orders, responses and labels of a request are released
+        before the next one is built. The next request is built while one
+        is sent and the labels of the previous one are downloaded. The
+        shipments of a carrier with a group are shared between the accounts
+        of the group, which send their requests at the same time.
+
+        :param checked: True if the shipments were validated already with
+                        `validate_dhl_de_shipments`
+        :return: Tuple of dictionaries by shipment id of the tracking
+                 numbers and of the error messages
+        """
+        tracking_numbers, errors = {}, {}
+
+        # Do not pay a request for orders DHL would refuse anyway
+        if not checked:
+            cls.check_dhl_de_shipments(shipments)
+
+        shipments = cls._reconcile_dhl_de_shipments(
+            shipments, tracking_numbers, errors
+        )
+        chunks = list(cls._iter_dhl_de_chunks(shipments))
+        senders = min(
+            len(set(carrier.id for carrier, _ in chunks)), LABEL_SEND_THREADS
+        ) or 1
+
+        # Closed at once on error, for the ledger to save what was read
+        with closing(pipeline(
+                chunks,
+                cls._load_dhl_de_chunks,
+                cls._build_dhl_de_orders,
+                threaded(
+                    send_label_chunk, LABEL_QUEUE_SIZE,
+                    abandon=cls._finish_dhl_de_chunk, workers=senders
+                ),
+                threaded(
+                    download_label_chunk, LABEL_QUEUE_SIZE,
+                    abandon=cls._finish_dhl_de_chunk
+                ),
+                cls._save_dhl_de_results)) as results:
+            for shipment, tracking_number, messages in results:
+                if tracking_number is None:
+                    errors[shipment.id] = messages
+                else:
+                    tracking_numbers[shipment.id] = tracking_number
+
+        return tracking_numbers, errors
+
+    @classmethod
+    def _reconcile_dhl_de_shipments(cls, shipments, tracking_numbers, errors):
+        """
+        Use the results saved in the ledger for shipments already sent to
+        DHL instead of creating them again
+
+        :return: List of the shipments to send
+        """
+        Request = Pool().get('shipping_dhl_de.request')
+
+        to_send = []
+        last_requests = Request.get_last_requests(shipments)
+        for shipment in shipments:
+            request = last_requests.get(shipment.id)
+            if request is None or request.state in ('failed', 'cancelled'):
+                to_send.append(shipment)
+            elif request.state == 'in_flight':
+                errors[shipment.id] = [shipment._dhl_de_problem(
+                    'dhl_de_request_in_flight', shipment.rec_name
+                )]
+            else:
+                # Created at DHL but the transaction saving it was lost,
+                # shipments with a tracking number are refused by
+                # check_dhl_de_shipments
+                if request.carrier:
+                    shipment.dhl_de_account = request.carrier
+                tracking_numbers[shipment.id] = \
+                    shipment._apply_dhl_de_creation_state(
+                        request.to_creation_state(),
+                        request.get_label_values()
+                    )
+        return to_send
+
+    @classmethod
+    def _iter_dhl_de_chunks(cls, shipments):
+        """
+        Yield the carrier of the account and the shipments of each request,
+        as many as the API version of the account allows
+
+        The shipments of a carrier are shared between the accounts of its
+        group in proportion to their weights, and the requests of the
+        accounts alternate so they are sent at the same time.
+        """
+        key = attrgetter('carrier.id')
+        for _, carrier_shipments in groupby(
+                sorted(shipments, key=key), key=key):
+            carrier_shipments = list(carrier_shipments)
+            accounts = carrier_shipments[0].carrier.get_dhl_de_accounts()
+
+            parts = split_by_weights(
+                carrier_shipments, [weight for _, weight in accounts]
+            )
+            account_chunks = []
+            for (account, _), account_shipments in zip(accounts, parts):
+                account_chunks.append([
+                    (account, list(sub_shipments))
+                    for sub_shipments in grouped_slice(
+                        account_shipments, account.get_dhl_de_batch_size()
+                    )
+                ])
+            for chunks in izip_longest(*account_chunks):
+                for chunk in filter(None, chunks):
+                    yield chunk
+
+    @classmethod
+    def _load_dhl_de_chunks(cls, chunks):
+        """
+        Read at once the data of the shipments of each request, yielding
+        the carrier, the shipments and their `ExportData` by shipment id
+        """
+        Address = Pool().get('party.address')
+
+        for carrier, shipments in chunks:
+            # Normalize the addresses of the request at once instead of one
+            # per order
+            addresses = set(s.delivery_address for s in shipments)
+            addresses.update(filter(None, (
+                s._get_ship_from_address() for s in shipments
+            )))
+            Address.get_dhl_de_normalized(list(addresses))
+
+            export_data = cls.get_dhl_de_export_data([
+                s for s in shipments if s.is_international_shipping
+            ])
+            yield carrier, shipments, export_data
+
+    @classmethod
+    def _build_dhl_de_orders(cls, chunks):
+        """
+        Yield the `LabelChunk` of each request with its ShipmentOrders,
+        recording the request in the ledger before it is sent
+        """
+        Request = Pool().get('shipping_dhl_de.request')
+
+        directory = cls._get_dhl_de_label_directory()
+        for carrier, shipments, export_data in chunks:
+            for shipment in shipments:
+                # Saved with the tracking number once created
+                shipment.dhl_de_account = carrier
+            client = carrier.get_dhl_de_client()
+            shipment_orders = [
+                shipment._get_dhl_de_shipment_order(
+                    client, export_data.get(shipment.id)
+                )
+                for shipment in shipments
+            ]
+            requests = Request.start(shipments, carrier)
+            yield LabelChunk(
+                carrier=carrier,
+                shipments=shipments,
+                requests=requests,
+                send=carrier._get_dhl_de_create_call(),
+                shipment_orders=shipment_orders,
+                directory=directory,
+                creation_states=None,
+                fault=None,
+                labels=None,
+            )
+
+    @classmethod
+    def _finish_dhl_de_chunk(cls, chunk):
+        """
+        Save the results of the request in the ledger and remove the labels
+        spooled but not saved
+        """
+        Request = Pool().get('shipping_dhl_de.request')
+
+        if chunk.creation_states is None:
+            # Never sent
+            Request.finish(chunk.requests, [], True)
+            return
+
+        # Orders without result stay in flight unless refused, DHL may have
+        # created them before the connection was lost
+        refused = chunk.fault is not None and not chunk.creation_states \
+            and isinstance(chunk.fault[1], DHLDEFault)
+        Request.finish(chunk.requests, chunk.creation_states, refused)
+        for label in chunk.labels or []:
+            if isinstance(label, tuple) and os.path.isfile(label[0]):
+                os.remove(label[0])
+
+    @classmethod
+    def _save_dhl_de_results(cls, chunks):
+        """
+        Save the tracking numbers and labels of the shipments created by DHL
+        and the results of each request in the ledger, yielding each
+        shipment with its tracking number or the messages of DHL if refused,
+        alone or with its whole request
+        """
+        for chunk in chunks:
+            by_sequence = dict(('%s' % s.id, s) for s in chunk.shipments)
+            try:
+                for creation_state, label in izip(
+                        chunk.creation_states, chunk.labels):
+                    shipment = by_sequence[creation_state.sequence_number]
+                    if creation_state.status_code != '0':  # pragma: no cover
+                        shipment.dhl_de_account = None
+                        yield shipment, None, creation_state.status_messages
+                        continue
+                    tracking_number = shipment._apply_dhl_de_creation_state(
+                        creation_state, label
+                    )
+                    yield shipment, tracking_number, None
+            finally:
+                cls._finish_dhl_de_chunk(chunk)
+
+            if chunk.fault is not None:
+                exc_type, exc, traceback = chunk.fault
+                if not isinstance(exc, DHLDEFault):  # pragma: no cover
+                    raise exc_type, exc, traceback
+                message = chunk.carrier.raise_user_error(
+                    'dhl_de_label_error', error_args=(exc.message, ),
+                    raise_exception=False
+                )
+                answered = set(
+                    c.sequence_number for c in chunk.creation_states
+                )
+                for shipment in chunk.shipments:
+                    if '%s' % shipment.id not in answered:
+                        shipment.dhl_de_account = None
+                        yield shipment, None, [message]
+
+    @profiled('labels')
+    def make_dhl_de_labels(self):
+        """
+        Make labels for the shipment using DHL DE
+
+        :return: Tracking number as string
+        """
+        tracking_numbers, errors = self.make_dhl_de_labels_batch([self])
+
+        if self.id in errors:  # pragma: no cover
+            get_wire_capture().dump('shipment %s refused' % self.id)
+            self.raise_user_error('\n'.join(errors[self.id]))
+        if self.id not in tracking_numbers:  # pragma: no cover
+            # The response of DHL ended before the state of the shipment
+            self.raise_user_error('dhl_de_no_answer', error_args=(self.id, ))
+        return tracking_numbers[self.id]
+
+    @classmethod
+    def _group_by_dhl_de_account(cls, shipments):
+        """
+        Yield the carrier of each account with the shipments created at DHL
+        with it
+        """
+        for _, carrier_shipments in groupby(
+                sorted(shipments, key=dhl_de_account_key),
+                key=dhl_de_account_key):
+            carrier_shipments = list(carrier_shipments)
+            yield carrier_shipments[0].get_dhl_de_account(), carrier_shipments
+
+    @classmethod
+    def _iter_dhl_de_shipment_states(cls, shipments, method):
+        """
+        Send the tracking numbers of the shipments to DHL with the carrier
+        method `method`, in as few requests as possible, and yield each
+        shipment with its state returned by DHL
+        """
+        shipments = [s for s in shipments if s.tracking_number]
+        for carrier, carrier_shipments in cls._group_by_dhl_de_account(
+                shipments):
+            for sub_shipments in grouped_slice(
+                    carrier_shipments, DHL_DE_NUMBER_BATCH_SIZE):
+                by_number = dict(
+                    (s.tracking_number, s) for s in sub_shipments
+                )
+                for state in getattr(carrier, method)(by_number.keys()):
+                    yield by_number[state.shipment_number], state
+
+    @classmethod
+    def cancel_dhl_de_shipments(cls, shipments):
+        """
+        Cancel at DHL the shipments created with DHL DE, sending as few
+        requests as possible, and forget their tracking numbers and labels
+
+        :return: Dictionary of the error messages by shipment id of the
+                 shipments DHL refused to cancel
+        """
+        pool = Pool()
+        Package = pool.get('stock.package')
+        Attachment = pool.get('ir.attachment')
+        Request = pool.get('shipping_dhl_de.request')
+
+        errors = {}
+        cancelled = []
+        for shipment, deletion_state in cls._iter_dhl_de_shipment_states(
+                shipments, 'send_dhl_de_delete_shipments'):
+            if deletion_state.status_code != '0':  # pragma: no cover
+                errors[shipment.id] = deletion_state.status_messages
+            else:
+                cancelled.append(shipment)
+
+        if cancelled:
+            Attachment.delete(Attachment.search([
+                ('resource', 'in', [
+                    '%s,%s' % (s.__name__, s.id) for s in cancelled
+                ]),
+                ('name', 'in', [
+                    '%s.pdf' % s.tracking_number for s in cancelled
+                ]),
+            ]))
+            Package.write(
+                [p for s in cancelled for p in s.packages],
+                {'tracking_number': None}
+            )
+            Request.cancel(cancelled)
+            cls.write(cancelled, {
+                'tracking_number': None,
+                'dhl_de_account': None,
+                'dhl_de_manifest_state': None,
+                'dhl_de_manifest_date': None,
+            })
+        return errors
+
+    @classmethod
+    @ModelView.button
+    def cancel_dhl_de_labels(cls, shipments):
+        """
+        Cancel the shipments at DHL DE
+        """
+        errors = cls.cancel_dhl_de_shipments(shipments)
+        if errors:  # pragma: no cover
+            cls._raise_dhl_de_errors('dhl_de_cancel_failed', errors)
+
+    @classmethod
+    def _raise_dhl_de_errors(cls, error, errors):
+        """
+        Raise `error` listing the messages of each shipment
+
+        :param errors: Dictionary of the error messages by shipment id
+        """
+        cls.raise_user_error(
+            error, error_args=('\n\n'.join(
+                '%s:\n%s' % (cls(id_).rec_name, '\n'.join(
+                    '  - %s' % message for message in messages
+                )) for id_, messages in sorted(errors.iteritems())
+            ),)
+        )
+
+    @classmethod
+    def _fetch_dhl_de_labels(cls, label_urls):
+        """
+        Download the labels at the same time into the filestore directory
+
+        :param label_urls: List of the URLs of the labels
+        :return: List of tuples of the name of the temporary file and md5
+                 digest of each label, or of the exception raised if it
+                 could not be downloaded
+        """
+        import requests
+
+        directory = cls._get_dhl_de_label_directory()
+
+        def fetch(label_url):
+            # No database access from the threads
+            try:
+                return fetch_label(label_url, directory)
+            except requests.RequestException, exc:  # pragma: no cover
+                return exc
+
+        if not label_urls:
+            return []
+        pool = ThreadPool(min(LABEL_DOWNLOAD_THREADS, len(label_urls)))
+        try:
+            return pool.map(fetch, label_urls)
+        finally:
+            pool.close()
+            pool.join()
+
+    @classmethod
+    def fetch_dhl_de_labels(cls, shipments):
+        """
+        Get again from DHL the labels of shipments already created, sending
+        as few requests as possible and downloading the labels at the same
+        time, and replace their label attachments
+
+        :return: Dictionary of the error messages by shipment id of the
+                 shipments whose label could not be fetched
+        """
+        Attachment = Pool().get('ir.attachment')
+
+        errors = {}
+        labels, to_download = {}, []
+        for shipment, label_state in cls._iter_dhl_de_shipment_states(
+                shipments, 'send_dhl_de_get_labels'):
+            if label_state.status_code != '0':  # pragma: no cover
+                errors[shipment.id] = label_state.status_messages
+            elif label_state.label_data:
+                labels[shipment] = spool_label(
+                    [base64.b64decode(label_state.label_data)],
+                    cls._get_dhl_de_label_directory()
+                )
+            else:
+                to_download.append((shipment, label_state.label_url))
+
+        downloaded = cls._fetch_dhl_de_labels(
+            [label_url for _, label_url in to_download]
+        )
+        for (shipment, label_url), spooled in zip(to_download, downloaded):
+            if isinstance(spooled, Exception):  # pragma: no cover
+                errors[shipment.id] = [shipment._dhl_de_problem(
+                    'dhl_de_label_download_failed', label_url, spooled
+                )]
+            else:
+                labels[shipment] = spooled
+
+        if labels:
+            Attachment.delete(Attachment.search([
+                ('resource', 'in', [
+                    '%s,%s' % (s.__name__, s.id) for s in labels
+                ]),
+                ('name', 'in', [
+                    '%s.pdf' % s.tracking_number for s in labels
+                ]),
+            ]))
+            Attachment.create([
+                dict(cls._file_dhl_de_label(*spooled), **{
+                    'name': '%s.pdf' % shipment.tracking_number,
+                    'resource': '%s,%s' % (shipment.__name__, shipment.id),
+                }) for shipment, spooled in labels.iteritems()
+            ])
+        return errors
+
+    @classmethod
+    @ModelView.button
+    def refetch_dhl_de_labels(cls, shipments):
+        """
+        Replace the labels of the shipments by the ones of DHL DE
+        """
+        errors = cls.fetch_dhl_de_labels(shipments)
+        if errors:  # pragma: no cover
+            cls._raise_dhl_de_errors('dhl_de_fetch_labels_failed', errors)
+
+    @classmethod
+    def manifest_dhl_de_shipments(cls, shipments, date=None):
+        """
+        Manifest at DHL the shipments created with DHL DE, sending as few
+        requests as possible
+
+        :return: Dictionary of the error messages by shipment id of the
+                 shipments DHL refused to manifest
+        """
+        Date = Pool().get('ir.date')
+
+        if date is None:
+            date = Date.today()
+
+        errors = {}
+        manifested, failed = [], []
+        for shipment, manifest_state in cls._iter_dhl_de_shipment_states(
+                shipments, 'send_dhl_de_manifest'):
+            if manifest_state.status_code != '0':  # pragma: no cover
+                errors[shipment.id] = manifest_state.status_messages
+                failed.append(shipment)
+            else:
+                manifested.append(shipment)
+
+        to_write = []
+        if manifested:
+            to_write.extend([manifested, {
+                'dhl_de_manifest_state': 'manifested',
+                'dhl_de_manifest_date': date,
+            }])
+        if failed:  # pragma: no cover
+            to_write.extend([failed, {
+                'dhl_de_manifest_state': 'failed',
+            }])
+        if to_write:
+            cls.write(*to_write)
+        return errors
+
+    @classmethod
+    def get_dhl_de_shipments_to_manifest(cls, date):
+        """
+        Return the shipments created at DHL on `date` and not manifested yet
+        """
+        Request = Pool().get('shipping_dhl_de.request')
+
+        start, end = utc_day_bounds(date)
+        requests = Request.search([
+            ('state', '=', 'succeeded'),
+            ('create_date', '>=', start),
+            ('create_date', '<', end),
+        ])
+        shipments = dict(
+            (r.shipment.id, r.shipment) for r in requests
+            if r.shipment.tracking_number == r.shipment_number
+        )
+        return [
+            s for s in shipments.itervalues()
+            if s.dhl_de_manifest_state != 'manifested'
+        ]
+
+    @classmethod
+    def manifest_dhl_de_day(cls, date=None):
+        """
+        Manifest all the shipments created at DHL on `date` (today by
+        default). Meant to run from the cron after the last label batch of
+        the day.
+        """
+        Date = Pool().get('ir.date')
+
+        if date is None:
+            date = Date.today()
+
+        shipments = cls.get_dhl_de_shipments_to_manifest(date)
+        errors = cls.manifest_dhl_de_shipments(shipments, date)
+        for id_, messages in errors.iteritems():  # pragma: no cover
+            log.warning('Shipment %s not manifested by DHL DE: %s' % (
+                id_, ', '.join(messages)
+            ))
+        return errors
+
+    @staticmethod
+    def default_dhl_de_delivered():
+        return False
+
+    def get_dhl_de_piece_numbers(self):
+        """
+        Return the numbers DHL tracks the pieces of the shipment with
+        """
+        piece_numbers = [
+            p.tracking_number for p in self.packages if p.tracking_number
+        ]
+        return piece_numbers or [self.tracking_number]
+
+    def is_dhl_de_tracking_due(self, now):
+        """
+        Return True if the tracking of the shipment must be synced, less
+        often as the shipment gets older
+        """
+        if self.dhl_de_tracking_sync is None:
+            return True
+        age = now - self.create_date
+        interval = DHL_DE_TRACKING_MAX_INTERVAL
+        for max_age, backoff in DHL_DE_TRACKING_BACKOFF:
+            if age < max_age:
+                interval = backoff
+                break
+        return now - self.dhl_de_tracking_sync >= interval
+
+    @classmethod
+    def get_dhl_de_tracking_provider(cls):
+        """
+        Return the tracking provider set in the configuration
+        """
+        name = config.get(
+            'shipping_dhl_de', 'tracking_provider',
+            default='sendungsverfolgung'
+        )
+        if name not in TRACKING_PROVIDERS:
+            cls.raise_user_error('dhl_de_tracking_provider_unknown', (
+                name, ', '.join(sorted(TRACKING_PROVIDERS))
+            ))
+        return TRACKING_PROVIDERS[name]()
+
+    @classmethod
+    def _get_dhl_de_pieces(cls, provider, carrier, shipments):
+        """
+        Return the `PieceState` by piece number of the shipments of the
+        carrier, asking the provider for as many pieces at once as it
+        accepts
+        """
+        import requests
+
+        pieces = {}
+        piece_numbers = [
+            n for s in shipments for n in s.get_dhl_de_piece_numbers()
+        ]
+        for sub_numbers in grouped_slice(piece_numbers, provider.batch_size):
+            try:
+                pieces.update(provider.get_pieces(carrier, list(sub_numbers)))
+            except requests.RequestException, exc:  # pragma: no cover
+                log.warning('DHL DE tracking failed: %s' % exc)
+        return pieces
+
+    @classmethod
+    def sync_dhl_de_tracking(cls, shipments=None):
+        """
+        Store the tracking events of the shipments (by default the ones
+        not delivered yet and due for a sync) from the tracking provider
+
+        Meant to run from the cron, lookups then read the local events.
+        """
+        TrackingEvent = Pool().get('shipping_dhl_de.tracking_event')
+
+        # Naive UTC, like create_date
+        now = datetime.utcnow()
+        if shipments is None:
+            shipments = cls.search([
+                ('carrier.carrier_cost_method', '=', 'dhl_de'),
+                ('tracking_number', '!=', None),
+                ('dhl_de_delivered', '=', False),
+                ('create_date', '>=', now - DHL_DE_TRACKING_MAX_AGE),
+            ])
+        shipments = [s for s in shipments if s.is_dhl_de_tracking_due(now)]
+        provider = cls.get_dhl_de_tracking_provider()
+
+        events, delivered = {}, []
+        for carrier, carrier_shipments in cls._group_by_dhl_de_account(
+                shipments):
+            pieces = cls._get_dhl_de_pieces(
+                provider, carrier, carrier_shipments
+            )
+            for shipment in carrier_shipments:
+                states = []
+                for piece_number in shipment.get_dhl_de_piece_numbers():
+                    state = pieces.get(piece_number)
+                    if state:
+                        events[(shipment, piece_number)] = state.events
+                    states.append(state)
+                if all(state and state.delivered for state in states):
+                    delivered.append(shipment)
+
+        TrackingEvent.add_events(events)
+        to_write = [shipments, {'dhl_de_tracking_sync': now}]
+        if delivered:
+            to_write.extend([delivered, {'dhl_de_delivered': True}])
+        if shipments:
+            cls.write(*to_write)
+
 
 class GenerateShippingLabel(Wizard):
     'Generate Labels'
@@ -400,3 +1750,195 @@ class ShippingDHLDE(ModelView):
             ('//page[@id="international"]', 'states', {
                 'invisible':  ~Bool(Eval('is_international_shipping'))
             })]
+
+
+class GenerateLabelsStart(ModelView):
+    'Generate DHL DE Labels'
+    __name__ = 'shipping_dhl_de.wizard_generate_labels.start'
+
+    shipments = fields.Many2Many(
+        'stock.shipment.out', None, None, 'Shipments', readonly=True
+    )
+    is_domestic_shipping = fields.Boolean("Is Domestic Shipping")
+    product_code = fields.Selection(
+        DHL_DE_PRODUCTS, 'DHL DE Product Code',
+        states={
+            'required': Bool(Eval('is_domestic_shipping'))
+        }, depends=['is_domestic_shipping']
+    )
+    is_international_shipping = fields.Boolean("Is International Shipping")
+    international_product_code = fields.Selection(
+        DHL_DE_PRODUCTS, 'DHL DE International Product Code',
+        states={
+            'required': Bool(Eval('is_international_shipping'))
+        }, depends=['is_international_shipping']
+    )
+    export_type = fields.Selection(
+        DHL_DE_EXPORT_TYPES, 'DHL DE Export Type',
+        states={
+            'required': Bool(Eval('is_international_shipping'))
+        }, depends=['is_international_shipping']
+    )
+    export_type_description = fields.Char('Export Type Description')
+    terms_of_trade = fields.Selection(
+        DHL_DE_INCOTERMS, 'Terms of Trade (incoterms)',
+        states={
+            'required': Bool(Eval('is_international_shipping'))
+        }, depends=['is_international_shipping']
+    )
+
+    @classmethod
+    def view_attributes(cls):
+        return super(GenerateLabelsStart, cls).view_attributes() + [
+            ('//group[@id="domestic"]', 'states', {
+                'invisible': ~Bool(Eval('is_domestic_shipping'))
+            }),
+            ('//group[@id="international"]', 'states', {
+                'invisible': ~Bool(Eval('is_international_shipping'))
+            })]
+
+
+class GenerateLabelsResult(ModelView):
+    'Generate DHL DE Labels'
+    __name__ = 'shipping_dhl_de.wizard_generate_labels.result'
+
+    labelled = fields.Many2Many(
+        'stock.shipment.out', None, None, 'Labelled Shipments', readonly=True
+    )
+    failed = fields.Many2Many(
+        'stock.shipment.out', None, None, 'Failed Shipments', readonly=True
+    )
+    messages = fields.Text('Messages', readonly=True)
+
+
+class GenerateLabels(Wizard):
+    """
+    Make the DHL DE labels of many shipments at once
+    """
+    __name__ = 'shipping_dhl_de.wizard_generate_labels'
+
+    start = StateView(
+        'shipping_dhl_de.wizard_generate_labels.start',
+        'shipping_dhl_de.wizard_generate_labels_start_view_form',
+        [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Generate', 'result', 'tryton-go-next', default=True),
+        ]
+    )
+    result = StateView(
+        'shipping_dhl_de.wizard_generate_labels.result',
+        'shipping_dhl_de.wizard_generate_labels_result_view_form',
+        [
+            Button('Ok', 'end', 'tryton-ok', default=True),
+        ]
+    )
+
+    def default_start(self, data):
+        Shipment = Pool().get('stock.shipment.out')
+
+        shipments = Shipment.browse(
+            Transaction().context.get('active_ids') or []
+        )
+        domestic = [s for s in shipments if not s.is_international_shipping]
+        international = [s for s in shipments if s.is_international_shipping]
+
+        values = {
+            'shipments': [s.id for s in shipments],
+            'is_domestic_shipping': bool(domestic),
+            'is_international_shipping': bool(international),
+        }
+        if domestic:
+            values['product_code'] = domestic[0].dhl_de_product_code
+        if international:
+            shipment = international[0]
+            values.update({
+                'international_product_code': shipment.dhl_de_product_code,
+                'export_type': shipment.dhl_de_export_type,
+                'export_type_description':
+                    shipment.dhl_de_export_type_description,
+                'terms_of_trade': shipment.dhl_de_terms_of_trade,
+            })
+        return values
+
+    def update_shipments(self):
+        """
+        Save the DHL DE settings of the wizard on all the shipments at once
+        """
+        Shipment = Pool().get('stock.shipment.out')
+
+        to_write = []
+        domestic = [
+            s for s in self.start.shipments if not s.is_international_shipping
+        ]
+        if domestic:
+            to_write.extend([domestic, {
+                'dhl_de_product_code': self.start.product_code,
+            }])
+        international = [
+            s for s in self.start.shipments if s.is_international_shipping
+        ]
+        if international:
+            to_write.extend([international, {
+                'dhl_de_product_code': self.start.international_product_code,
+                'dhl_de_export_type': self.start.export_type,
+                'dhl_de_export_type_description':
+                    self.start.export_type_description,
+                'dhl_de_terms_of_trade': self.start.terms_of_trade,
+            }])
+        if to_write:
+            Shipment.write(*to_write)
+
+    def create_packages(self):
+        """
+        Create a single package for each packed shipment without any
+        """
+        pool = Pool()
+        Package = pool.get('stock.package')
+        ModelData = pool.get('ir.model.data')
+
+        type_id = ModelData.get_id('shipping', 'shipment_package_type')
+        Package.create([{
+            'shipment': '%s,%d' % (shipment.__name__, shipment.id),
+            'type': type_id,
+            'moves': [('add', [m.id for m in shipment.outgoing_moves])],
+        } for shipment in self.start.shipments
+            if shipment.state in ('packed', 'done') and not shipment.packages
+        ])
+
+    def default_result(self, data):
+        Shipment = Pool().get('stock.shipment.out')
+
+        self.update_shipments()
+        self.create_packages()
+
+        # Read again with the settings and packages just saved
+        shipments = Shipment.browse([s.id for s in self.start.shipments])
+        problems = Shipment.validate_dhl_de_shipments(shipments)
+        errors = dict((s.id, messages) for s, messages in problems.items())
+        tracking_numbers, batch_errors = Shipment.make_dhl_de_labels_batch(
+            [s for s in shipments if s not in problems], checked=True
+        )
+        errors.update(batch_errors)
+
+        messages = []
+        for shipment in shipments:
+            if shipment.id in tracking_numbers:
+                messages.append('%s: %s' % (
+                    shipment.rec_name, tracking_numbers[shipment.id]
+                ))
+            else:
+                # The response of DHL may end before the state of the
+                # shipment
+                shipment_errors = errors.get(shipment.id, [
+                    shipment._dhl_de_problem('dhl_de_no_answer', shipment.id)
+                ])
+                messages.append('%s:\n%s' % (shipment.rec_name, '\n'.join(
+                    '  - %s' % message for message in shipment_errors
+                )))
+        return {
+            'labelled': [s.id for s in shipments if s.id in tracking_numbers],
+            'failed': [
+                s.id for s in shipments if s.id not in tracking_numbers
+            ],
+            'messages': '\n'.join(messages),
+        }
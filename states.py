@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+    states.py
+
+    States answered by DHL DE for the shipments, independent of the SOAP
+    backend, readable without importing suds, lxml and requests.
+
+"""
+from collections import namedtuple
+
+__all__ = [
+    'CreationState', 'DeletionState', 'ManifestState', 'LabelState',
+    'DHLDEFault',
+]
+
+# Outcome of a single ShipmentOrder, independent of the API version
+CreationState = namedtuple('CreationState', [
+    'sequence_number', 'status_code', 'status_messages', 'shipment_number',
+    'piece_numbers', 'label_url', 'label_data',
+])
+
+# Outcome of the cancellation of a single shipment
+DeletionState = namedtuple('DeletionState', [
+    'shipment_number', 'status_code', 'status_messages',
+])
+
+# Outcome of the manifest of a single shipment
+ManifestState = namedtuple('ManifestState', DeletionState._fields)
+
+# Label of a single shipment already created
+LabelState = namedtuple('LabelState', [
+    'shipment_number', 'status_code', 'status_messages', 'label_url',
+    'label_data',
+])
+
+
+class DHLDEFault(Exception):
+    """
+    SOAP Fault returned by DHL
+    """
+    @property
+    def message(self):
+        return self.args[0]
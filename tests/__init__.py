@@ -9,6 +9,17 @@ import trytond.tests.test_tryton
 
 from tests.test_views_depends import TestViewsDepends
 from tests.test_shipment import TestDHLDEShipment
+from tests.test_transport import TestLxmlTransport, TestSudsClient
+from tests.test_ratelimit import TestTokenBucket
+from tests.test_label import TestLabel
+from tests.test_tracking import TestSendungsverfolgung
+from tests.test_profiling import TestProfiling
+from tests.test_capture import TestWireCapture
+from tests.test_startup import TestStartup
+from tests.test_credentials import TestCredentialsCheck
+from tests.test_pipeline import TestPipeline, TestThreadedPipeline
+from tests.test_forksafe import TestProcessLocal
+from tests.test_accounts import TestSplitByWeights
 
 
 def suite():
@@ -19,6 +30,21 @@ def suite():
     test_suite.addTests([
         unittest.TestLoader().loadTestsFromTestCase(TestViewsDepends),
         unittest.TestLoader().loadTestsFromTestCase(TestDHLDEShipment),
+        unittest.TestLoader().loadTestsFromTestCase(TestLxmlTransport),
+        unittest.TestLoader().loadTestsFromTestCase(TestSudsClient),
+        unittest.TestLoader().loadTestsFromTestCase(TestTokenBucket),
+        unittest.TestLoader().loadTestsFromTestCase(TestLabel),
+        unittest.TestLoader().loadTestsFromTestCase(
+            TestSendungsverfolgung
+        ),
+        unittest.TestLoader().loadTestsFromTestCase(TestProfiling),
+        unittest.TestLoader().loadTestsFromTestCase(TestWireCapture),
+        unittest.TestLoader().loadTestsFromTestCase(TestStartup),
+        unittest.TestLoader().loadTestsFromTestCase(TestCredentialsCheck),
+        unittest.TestLoader().loadTestsFromTestCase(TestPipeline),
+        unittest.TestLoader().loadTestsFromTestCase(TestThreadedPipeline),
+        unittest.TestLoader().loadTestsFromTestCase(TestProcessLocal),
+        unittest.TestLoader().loadTestsFromTestCase(TestSplitByWeights),
     ])
     return test_suite
 
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/benchmark_transport.py
+
+    Compare the CPU time spent per label by the SOAP backends to build the
+    createShipmentDD request and to read its response. Nothing is sent to
+    DHL, only the WSDL is downloaded.
+
+    Usage: python tests/benchmark_transport.py [number of labels]
+
+"""
+import os
+import sys
+import time
+
+from trytond.modules.shipping_dhl_de.transport import (
+    SudsTransport, LxmlTransport, FixPrefix
+)
+from test_transport import CREATE_SHIPMENT_DD_RESPONSE
+
+WSDL_URL = "https://cig.dhl.de/cig-wsdls/com/dpdhl/wsdl/geschaeftskundenversand-api/1.0/geschaeftskundenversand-api-1.0.wsdl"    # noqa
+LOCATION = 'https://cig.dhl.de/services/sandbox/soap'
+VERSION = {
+    'majorRelease': '1',
+    'minorRelease': '0',
+}
+
+
+def build_shipment_order(factory):
+    """
+    Return a domestic ShipmentOrder like the one built by the shipment
+    """
+    def address(street, number, zip_, city):
+        native_address = factory.create('ns1:NativeAddressType')
+        native_address.streetName = street
+        native_address.streetNumber = number
+        native_address.Zip = factory.create('ns1:ZipType')
+        native_address.Zip.germany = zip_
+        native_address.city = city
+        native_address.Origin = factory.create('ns1:CountryType')
+        native_address.Origin.country = 'Germany'
+        native_address.Origin.countryISOCode = 'DE'
+        return native_address
+
+    def communication(email, name):
+        comm_type = factory.create('ns1:CommunicationType')
+        comm_type.email = email
+        comm_type.contactPerson = name
+        return comm_type
+
+    details = factory.create('ns0:ShipmentDetailsDDType')
+    details.ProductCode = 'EPN'
+    details.ShipmentDate = '2016-01-01'
+    details.EKP = '5000000008'
+    details.Attendance = {'partnerID': '01'}
+    details.CustomerReference = 'C-1'
+    item = factory.create('ns0:ShipmentItemDDType')
+    item.WeightInKG = 0.5
+    item.PackageType = 'PK'
+    details.ShipmentItem = [item]
+
+    shipper = factory.create('ns0:ShipperDDType')
+    shipper.Company = {'Company': {'name1': 'Deutsche Post IT Brief GmbH'}}
+    shipper.Address = address('Heinrich-Bruening-Str.', '7', '53113', 'Bonn')
+    shipper.Communication = communication('max@muster.de', 'Max Muster')
+
+    receiver = factory.create('ns0:ReceiverDDType')
+    receiver.Company = {'Person': {'firstname': 'Kai', 'lastname': 'Wahn'}}
+    receiver.Address = address('Marktplatz', '1', '70173', 'Stuttgart')
+    receiver.Communication = communication('kai@wahn.de', 'Kai Wahn')
+
+    shipment = factory.create('ns0:Shipment')
+    shipment.ShipmentDetails = details
+    shipment.Shipper = shipper
+    shipment.Receiver = receiver
+
+    shipment_order = factory.create('ns0:ShipmentOrderDDType')
+    shipment_order.SequenceNumber = '1'
+    shipment_order.Shipment = shipment
+    return shipment_order
+
+
+def bench_suds(transport, shipment_order, labels):
+    client = transport.client
+    client.set_options(plugins=[FixPrefix()])
+    for i in xrange(labels):
+        # Marshal the request and unmarshal the injected reply
+        client.service.createShipmentDD(
+            VERSION, [shipment_order],
+            __inject={'reply': CREATE_SHIPMENT_DD_RESPONSE},
+        )
+
+
+def bench_lxml(transport, shipment_order, labels):
+    for i in xrange(labels):
+        transport.build_envelope('createShipmentDD', [
+            ('Version', VERSION),
+            ('ShipmentOrder', [shipment_order]),
+        ])
+        transport.parse_creation_states(CREATE_SHIPMENT_DD_RESPONSE)
+
+
+def main(labels):
+    username = os.environ['DHL_DE_USERNAME']
+    password = os.environ['DHL_DE_PASSWORD']
+
+    for transport_class, bench in (
+            (SudsTransport, bench_suds), (LxmlTransport, bench_lxml)):
+        start = time.clock()
+        transport = transport_class(WSDL_URL, LOCATION, username, password)
+        transport.set_authentication(
+            'geschaeftskunden_api', 'Dhl_ep_test1', 0
+        )
+        setup = time.clock() - start
+
+        shipment_order = build_shipment_order(transport.factory)
+        start = time.clock()
+        bench(transport, shipment_order, labels)
+        elapsed = time.clock() - start
+
+        print '%-5s client: %8.1f ms  per label: %6.3f ms' % (
+            transport_class.name, setup * 1000, elapsed * 1000 / labels,
+        )
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
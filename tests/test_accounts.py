@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_accounts.py
+
+    Test the sharing of the label batches between the accounts of a group
+
+"""
+import unittest
+
+from trytond.modules.shipping_dhl_de.carrier import split_by_weights
+
+
+class TestSplitByWeights(unittest.TestCase):
+    """Test the split of the shipments of a batch between accounts
+    """
+
+    def test_0010_proportional(self):
+        """Test that the lengths are in proportion to the weights.
+        """
+        self.assertEqual(
+            split_by_weights(range(8), [1, 2, 1]),
+            [[0, 1], [2, 3, 4, 5], [6, 7]]
+        )
+
+    def test_0020_remainders(self):
+        """Test that the items left go to the largest remainders.
+        """
+        self.assertEqual(
+            map(len, split_by_weights(range(10), [1, 1, 1])), [4, 3, 3]
+        )
+        self.assertEqual(
+            map(len, split_by_weights(range(5), [1, 3])), [1, 4]
+        )
+        self.assertEqual(split_by_weights(range(1), [1, 2]), [[], [0]])
+
+    def test_0030_all_items(self):
+        """Test that each item is in a single list, in order.
+        """
+        for size in range(20):
+            parts = split_by_weights(range(size), [3, 1, 2, 5])
+            self.assertEqual(sum(parts, []), range(size))
+
+
+def suite():
+    """
+    Define suite
+    """
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestSplitByWeights)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_capture.py
+
+    Test the capture of the SOAP exchanges of the failed or slow calls
+
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from trytond.modules.shipping_dhl_de.capture import WireCapture
+
+ENVELOPE = (
+    '<soap:Envelope><soap:Header><cis:Authentification>'
+    '<cis:user>2222222222_01</cis:user>'
+    '<cis:signature>pass</cis:signature>'
+    '</cis:Authentification></soap:Header>'
+    '<soap:Body><createShipmentOrder/></soap:Body></soap:Envelope>'
+)
+
+
+class TestWireCapture(unittest.TestCase):
+    """Test the wire capture
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, path):
+        with open(path, 'rb') as dump_file:
+            return dump_file.read()
+
+    def test_0010_success(self):
+        """Test that nothing is written for the calls going well.
+        """
+        capture = WireCapture(size=2, threshold=10, directory=self.directory)
+
+        for i in range(5):
+            self.assertIsNone(
+                capture.record('createShipmentOrder', ENVELOPE, '<ok/>', 0.1)
+            )
+
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(len(capture.exchanges), 2)
+
+    def test_0020_failure(self):
+        """Test that the exchanges are written without the credentials when
+        a call fails.
+        """
+        capture = WireCapture(size=5, directory=self.directory)
+
+        capture.record('getVersion', '<getVersion/>', u'<v>2.0</v>', 0.1)
+        received = ['<fault>', 'Login failed', '</fault>']
+        path = capture.record(
+            'createShipmentOrder', ENVELOPE, received, 0.2, failed=True
+        )
+
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(path)])
+        content = self.read(path)
+        self.assertTrue(content.startswith('# createShipmentOrder failed'))
+        self.assertIn('<v>2.0</v>', content)
+        self.assertIn('<cis:user>***</cis:user>', content)
+        self.assertIn('<cis:signature>***</cis:signature>', content)
+        self.assertNotIn('2222222222_01', content)
+        self.assertNotIn('>pass<', content)
+        self.assertIn('<fault>Login failed</fault>', content)
+        self.assertEqual(len(capture.exchanges), 0)
+
+    def test_0030_slow(self):
+        """Test that the exchanges are written when a call is slow.
+        """
+        capture = WireCapture(size=5, threshold=1, directory=self.directory)
+
+        self.assertIsNone(capture.record('getLabel', '<a/>', '<b/>', 0.5))
+        path = capture.record('getLabel', '<a/>', None, 1.5)
+
+        content = self.read(path)
+        self.assertTrue(content.startswith('# getLabel took 1.500s'))
+        self.assertIn('(nothing)', content)
+
+    def test_0040_rotation(self):
+        """Test that only the last files are kept.
+        """
+        capture = WireCapture(size=5, directory=self.directory, max_files=3)
+
+        paths = [capture.dump('test %d' % i) for i in range(5)]
+
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            [os.path.basename(p) for p in paths[-3:]]
+        )
+
+    def test_0050_disabled(self):
+        """Test that nothing is kept with a size of 0.
+        """
+        capture = WireCapture(size=0, directory=self.directory)
+
+        self.assertIsNone(
+            capture.record('getLabel', '<a/>', '<b/>', 1, failed=True)
+        )
+        self.assertEqual(os.listdir(self.directory), [])
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_credentials.py
+
+    Test the concurrent credentials test of the carriers
+
+"""
+import time
+import unittest
+
+from trytond.modules.shipping_dhl_de.carrier import check_dhl_de_credentials
+from trytond.modules.shipping_dhl_de.states import DHLDEFault
+from tests.test_pipeline import Rendezvous
+
+
+def answer(latency):
+    def call():
+        time.sleep(latency)
+        return latency
+    return call
+
+
+def meet(rendezvous, latency):
+    def call():
+        if not rendezvous.wait():
+            raise Exception('Not tested at the same time')
+        return latency
+    return call
+
+
+def refuse(exc):
+    def call():
+        raise exc
+    return call
+
+
+class TestCredentialsCheck(unittest.TestCase):
+    """Test the credentials test of many carriers
+    """
+
+    def test_0010_concurrent(self):
+        """Test that the carriers are tested at the same time.
+        """
+        rendezvous = Rendezvous(4)
+        checks = check_dhl_de_credentials([
+            meet(rendezvous, 0.3), meet(rendezvous, 0.2),
+            meet(rendezvous, 0.3), meet(rendezvous, 0.1),
+        ])
+
+        self.assertEqual([c.status for c in checks], ['ok'] * 4)
+        self.assertEqual([c.latency for c in checks], [0.3, 0.2, 0.3, 0.1])
+        self.assertEqual(check_dhl_de_credentials([]), [])
+
+    def test_0020_failures(self):
+        """Test that a refused carrier does not stop the others.
+        """
+        checks = check_dhl_de_credentials([
+            refuse(DHLDEFault('Login failed')),
+            answer(0),
+            refuse(Exception((401, 'Unauthorized'))),
+            refuse(Exception((500, 'Internal Server Error'))),
+        ])
+
+        self.assertEqual(
+            [c.status for c in checks], ['failed', 'ok', 'failed', 'failed']
+        )
+        self.assertEqual(checks[0].message, 'Login failed')
+        self.assertIsNone(checks[0].latency)
+        self.assertEqual(checks[2].message, 'Invalid Credentials')
+        self.assertEqual(
+            checks[3].message, 'Status: 500\nReason: Internal Server Error'
+        )
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_forksafe.py
+
+    Test the state of the workers built again in the forked processes
+
+"""
+import os
+import threading
+import unittest
+
+from trytond.modules.shipping_dhl_de.forksafe import ProcessLocal, \
+    get_http_session
+
+
+class TestProcessLocal(unittest.TestCase):
+    """Test the state built again in the forked processes
+    """
+
+    def test_0010_built_once(self):
+        """Test that the value is built on first use only.
+        """
+        built = []
+        local = ProcessLocal(lambda: built.append(1) or object())
+
+        self.assertIs(local.get(), local.get())
+        self.assertEqual(len(built), 1)
+
+    def test_0015_threads(self):
+        """Test that the threads building the value at the same time get
+        the same one.
+        """
+        start = threading.Event()
+
+        def factory():
+            start.wait()
+            return object()
+        local = ProcessLocal(factory)
+        values = []
+        threads = [
+            threading.Thread(target=lambda: values.append(local.get()))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(values), 8)
+        self.assertEqual(len(set(map(id, values))), 1)
+        self.assertIs(local.get(), values[0])
+
+    def test_0020_forked(self):
+        """Test that a forked process builds its own value.
+        """
+        local = ProcessLocal(object)
+        value = local.get()
+
+        pid = os.fork()
+        if not pid:
+            try:
+                child_value = local.get()
+                os._exit(int(child_value is value or
+                             child_value is not local.get()))
+            finally:
+                os._exit(2)
+        _, status = os.waitpid(pid, 0)
+
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+        self.assertIs(local.get(), value)
+
+    def test_0030_held_lock(self):
+        """Test that a lock held by a thread of the parent at fork is not
+        held in the child.
+        """
+        lock = ProcessLocal(threading.Lock)
+        held, release = threading.Event(), threading.Event()
+
+        def hold():
+            with lock.get():
+                held.set()
+                release.wait()
+        thread = threading.Thread(target=hold)
+        thread.start()
+        held.wait()
+        try:
+            pid = os.fork()
+            if not pid:
+                try:
+                    os._exit(int(not lock.get().acquire(False)))
+                finally:
+                    os._exit(2)
+            _, status = os.waitpid(pid, 0)
+        finally:
+            release.set()
+            thread.join()
+
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+
+    def test_0040_http_session(self):
+        """Test that each thread has its own HTTP session.
+        """
+        sessions = []
+        thread = threading.Thread(
+            target=lambda: sessions.append(get_http_session())
+        )
+        thread.start()
+        thread.join()
+
+        self.assertIs(get_http_session(), get_http_session())
+        self.assertIsNot(sessions[0], get_http_session())
+
+
+def suite():
+    """
+    Define suite
+    """
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestProcessLocal)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_label.py
+
+    Test the download of labels without calling DHL
+
+"""
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+from threading import Thread
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+from trytond.modules.shipping_dhl_de.shipment import (
+    spool_label, fetch_label, LABEL_CHUNK_SIZE
+)
+
+# Larger than a chunk to be streamed in several parts
+LABEL = '%PDF-1.4\n' + 'x' * (LABEL_CHUNK_SIZE * 3)
+
+
+class LabelHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != '/label.pdf':
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(len(LABEL)))
+        self.end_headers()
+        self.wfile.write(LABEL)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestLabel(unittest.TestCase):
+    """Test the download of labels
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = HTTPServer(('127.0.0.1', 0), LabelHandler)
+        self.url = 'http://127.0.0.1:%s' % self.server.server_port
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.directory)
+
+    def test_0010_spool_label(self):
+        """Test that the label is written and hashed at once.
+        """
+        name, digest = spool_label(['%PDF', '-1.4'], self.directory)
+
+        self.assertEqual(os.path.dirname(name), self.directory)
+        self.assertEqual(open(name, 'rb').read(), '%PDF-1.4')
+        self.assertEqual(digest, hashlib.md5('%PDF-1.4').hexdigest())
+
+    def test_0020_fetch_label(self):
+        """Test that the label is streamed into the directory.
+        """
+        name, digest = fetch_label(self.url + '/label.pdf', self.directory)
+
+        self.assertEqual(open(name, 'rb').read(), LABEL)
+        self.assertEqual(digest, hashlib.md5(LABEL).hexdigest())
+
+        with self.assertRaises(requests.RequestException):
+            fetch_label(self.url + '/missing.pdf', self.directory)
+
+    def test_0030_interrupted(self):
+        """Test that nothing is left when the label is interrupted.
+        """
+        def chunks():
+            yield '%PDF'
+            raise IOError('Connection reset')
+
+        with self.assertRaises(IOError):
+            spool_label(chunks(), self.directory)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+def suite():
+    """
+    Define suite
+    """
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestLabel)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
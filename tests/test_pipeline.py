@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_pipeline.py
+
+    Test that the label batches flow through the pipeline one chunk at a
+    time, with the stages waiting on the network in worker threads
+
+"""
+import gc
+import time
+import unittest
+import threading
+from weakref import WeakSet
+
+from trytond.modules.shipping_dhl_de.pipeline import pipeline, threaded
+
+# Shipments per chunk
+CHUNK_SIZE = 30
+
+
+class Data(object):
+    """
+    Data made by a stage, counted while alive
+    """
+    alive = WeakSet()
+
+    def __init__(self, size):
+        self.payload = bytearray(size)
+        self.alive.add(self)
+
+
+def load(size):
+    for i in range(size):
+        yield [Data(10) for _ in range(CHUNK_SIZE)]
+
+
+def build(chunks):
+    for shipments in chunks:
+        yield shipments, [Data(1000) for _ in shipments]
+
+
+def send(chunks):
+    for shipments, orders in chunks:
+        states = []
+        for shipment in shipments:
+            states.append(Data(10000))
+            yield shipment, states[-1]
+
+
+def save(results):
+    for shipment, state in results:
+        yield Data(10)
+
+
+class TestPipeline(unittest.TestCase):
+    """Test the pipeline of the label batches
+    """
+
+    def run_batch(self, size):
+        """
+        Return the number of results and the most data alive at once
+        """
+        gc.collect()
+        peak = count = 0
+        for result in pipeline(load(size), build, send, save):
+            count += 1
+            peak = max(peak, len(Data.alive))
+        return count, peak
+
+    def test_0010_constant_memory(self):
+        """Test that the data alive does not grow with the batch.
+        """
+        count, small_peak = self.run_batch(2)
+        self.assertEqual(count, 2 * CHUNK_SIZE)
+
+        count, large_peak = self.run_batch(200)
+        self.assertEqual(count, 200 * CHUNK_SIZE)
+
+        self.assertEqual(large_peak, small_peak)
+        # The shipments, orders and states of a single chunk
+        self.assertTrue(large_peak <= 3 * CHUNK_SIZE + 2)
+
+    def test_0020_released(self):
+        """Test that nothing is kept once the batch is done.
+        """
+        self.run_batch(5)
+        gc.collect()
+        self.assertEqual(len(Data.alive), 0)
+
+    def test_0030_closed(self):
+        """Test that closing the pipeline closes the stages at once.
+        """
+        finished, stages = [], []
+
+        def run(items):
+            try:
+                for item in items:
+                    yield item
+            finally:
+                finished.append(True)
+
+        def stage(items):
+            # Kept alive as by a traceback, not closed by the refcount
+            stages.append(run(items))
+            return stages[-1]
+
+        results = pipeline(load(5), stage, stage)
+        next(results)
+        results.close()
+        self.assertEqual(finished, [True, True])
+
+
+def slow(seconds):
+    def function(item):
+        time.sleep(seconds)
+        return item
+    return function
+
+
+class Rendezvous(object):
+    """
+    Meeting point of calls made from many threads: a call waits until
+    `count` calls are running, or for `timeout` seconds at most
+    """
+
+    def __init__(self, count, timeout=10):
+        self.count = count
+        self.timeout = timeout
+        self.running = 0
+        self.condition = threading.Condition()
+
+    def wait(self):
+        """
+        Return True if `count` calls ran at the same time
+        """
+        with self.condition:
+            self.running += 1
+            self.condition.notify_all()
+            deadline = time.time() + self.timeout
+            while self.running < self.count and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+            return self.running >= self.count
+
+
+class TestThreadedPipeline(unittest.TestCase):
+    """Test the stages run in worker threads
+    """
+
+    def setUp(self):
+        self.pulled, self.abandoned = [], []
+        self.threads = set()
+
+    def source(self, size, seconds=0):
+        for i in range(size):
+            time.sleep(seconds)
+            self.threads.add(threading.current_thread())
+            self.pulled.append(i)
+            yield i
+
+    def send(self, item):
+        self.threads.add(threading.current_thread())
+        return 'sent', item
+
+    def test_0010_overlap(self):
+        """Test that the stages work at the same time, in order.
+        """
+        def save(items):
+            for item in items:
+                time.sleep(0.05)
+                yield item
+
+        start = time.time()
+        results = list(pipeline(
+            self.source(10, 0.05),
+            threaded(slow(0.05), 2),
+            threaded(slow(0.05), 2),
+            save,
+        ))
+
+        self.assertEqual(results, range(10))
+        # 2 seconds one stage after the other, 1.2 seconds at best
+        self.assertTrue(time.time() - start < 1.6)
+        self.assertEqual(threading.active_count(), 1)
+
+    def test_0020_bounded(self):
+        """Test that a slow stage holds back the ones before it.
+        """
+        in_flight = []
+        for result in pipeline(
+                self.source(20),
+                threaded(self.send, 1),
+                threaded(slow(0.01), 1)):
+            in_flight.append(len(self.pulled) - result[1])
+
+        # Waiting to be sent, sent, sent and waiting to be saved, saved
+        self.assertTrue(max(in_flight) <= 7)
+        self.assertEqual(len(self.threads), 2)
+
+    def test_0030_abandon(self):
+        """Test that the items not taken are abandoned when closed early.
+        """
+        results = pipeline(
+            self.source(20),
+            threaded(self.send, 2, abandon=self.abandoned.append),
+        )
+        taken = [next(results), next(results)]
+        results.close()
+
+        self.assertEqual(taken, [('sent', 0), ('sent', 1)])
+        # Either sent or not, each item pulled is taken or abandoned once
+        self.assertEqual(sorted(
+            i[1] if isinstance(i, tuple) else i
+            for i in self.abandoned + taken
+        ), self.pulled)
+        self.assertEqual(threading.active_count(), 1)
+
+    def test_0040_error(self):
+        """Test that an error of a worker is raised in the calling thread.
+        """
+        def send(item):
+            if item == 3:
+                raise ValueError(item)
+            return item
+
+        taken = []
+        with self.assertRaises(ValueError):
+            for item in pipeline(
+                    self.source(20),
+                    threaded(send, 1, abandon=self.abandoned.append)):
+                taken.append(item)
+
+        self.assertEqual(taken, [0, 1, 2])
+        self.assertEqual(sorted(taken + [3] + self.abandoned), self.pulled)
+        self.assertEqual(threading.active_count(), 1)
+
+    def test_0050_workers(self):
+        """Test that the items are processed at the same time by many
+        workers.
+        """
+        rendezvous = Rendezvous(4)
+
+        def meet(item):
+            return item, rendezvous.wait()
+
+        results = list(pipeline(
+            self.source(12),
+            threaded(meet, 1, abandon=self.abandoned.append, workers=4),
+        ))
+
+        self.assertEqual(sorted(results), [(i, True) for i in range(12)])
+        self.assertEqual(self.abandoned, [])
+        self.assertEqual(threading.active_count(), 1)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_profiling.py
+
+    Test the opt-in profiling of the label making
+
+"""
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+from trytond.config import config
+from trytond.modules.shipping_dhl_de.profiling import profiled
+
+
+class Shipment(object):
+
+    def __init__(self, id):
+        self.id = id
+
+    @classmethod
+    @profiled('labels_batch')
+    def make_labels_batch(cls, shipments):
+        return [s.id for s in shipments]
+
+    @profiled('labels')
+    def make_labels(self):
+        return self.make_labels_batch([self])
+
+
+class TestProfiling(unittest.TestCase):
+    """Test the profiling of the label making
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        if not config.has_section('shipping_dhl_de'):
+            config.add_section('shipping_dhl_de')
+        config.set('shipping_dhl_de', 'profile_path', self.directory)
+
+    def tearDown(self):
+        config.remove_option('shipping_dhl_de', 'profile_path')
+        config.remove_option('shipping_dhl_de', 'profile')
+        shutil.rmtree(self.directory)
+
+    def test_0010_disabled(self):
+        """Test that nothing is dumped unless enabled.
+        """
+        self.assertEqual(Shipment.make_labels_batch([Shipment(1)]), [1])
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_0020_batch(self):
+        """Test that a batch is dumped with the ids of its shipments.
+        """
+        config.set('shipping_dhl_de', 'profile', 'True')
+
+        shipments = [Shipment(i) for i in range(1, 13)]
+        self.assertEqual(Shipment.make_labels_batch(shipments), range(1, 13))
+
+        filename, = os.listdir(self.directory)
+        self.assertTrue(filename.startswith('shipping_dhl_de-labels_batch-'))
+        self.assertTrue(
+            filename.endswith('-1_2_3_4_5_6_7_8_9_10_and_2.pstats')
+        )
+        stats = pstats.Stats(os.path.join(self.directory, filename))
+        self.assertTrue(stats.total_calls > 0)
+
+    def test_0030_nested(self):
+        """Test that the batch made for a single shipment is not dumped
+        again.
+        """
+        config.set('shipping_dhl_de', 'profile', 'True')
+
+        self.assertEqual(Shipment(7).make_labels(), [7])
+
+        filename, = os.listdir(self.directory)
+        self.assertTrue(filename.startswith('shipping_dhl_de-labels-'))
+        self.assertTrue(filename.endswith('-7.pstats'))
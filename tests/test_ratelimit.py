@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_ratelimit.py
+
+    Test the token bucket shared by the workers
+
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from threading import Thread
+
+from logbook import TestHandler
+
+from trytond.modules.shipping_dhl_de.ratelimit import TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+    """Test the token bucket
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_0010_burst_then_rate(self):
+        """Test that calls beyond the burst wait for the rate.
+        """
+        bucket = TokenBucket('5000000008', 20, 2, self.directory)
+
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertTrue(bucket.acquire() > 0)
+
+        stats = bucket.get_stats()
+        self.assertEqual(stats['calls'], 3)
+        self.assertEqual(stats['waited'], 1)
+        self.assertTrue(stats['wait_time'] > 0)
+
+    def test_0020_shared_by_key(self):
+        """Test that buckets of the same key share their tokens.
+        """
+        buckets = [
+            TokenBucket('5000000008', 10, 1, self.directory)
+            for i in range(4)
+        ]
+        other = TokenBucket('6000000008', 10, 1, self.directory)
+
+        start = time.time()
+        threads = [Thread(target=b.acquire) for b in buckets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # One token at once then one every 100ms
+        self.assertTrue(time.time() - start >= 0.25)
+        self.assertEqual(buckets[0].get_stats()['calls'], 4)
+        self.assertEqual(buckets[0].get_stats()['waited'], 3)
+
+        self.assertEqual(other.acquire(), 0)
+
+    def test_0030_shared_by_processes(self):
+        """Test that forked workers share the tokens of the bucket.
+        """
+        bucket = TokenBucket('5000000008', 10, 1, self.directory)
+        bucket.acquire()
+
+        pid = os.fork()
+        if not pid:
+            try:
+                bucket.acquire()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+        self.assertTrue(bucket.acquire() > 0)
+        self.assertEqual(bucket.get_stats()['calls'], 3)
+
+    def test_0040_long_wait_logged(self):
+        """Test that a wait above the threshold is logged as a warning.
+        """
+        bucket = TokenBucket('5000000008', 20, 1, self.directory, 0)
+        quiet = TokenBucket('5000000008', 20, 1, self.directory)
+
+        with TestHandler() as handler:
+            bucket.acquire()
+            bucket.acquire()
+            quiet.acquire()
+
+        levels = [r.level_name for r in handler.records]
+        self.assertEqual(levels, ['WARNING', 'DEBUG'])
+        self.assertIn('5000000008', handler.records[0].message)
+
+
+def suite():
+    """
+    Define suite
+    """
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestTokenBucket)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
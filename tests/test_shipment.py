@@ -6,13 +6,16 @@
 
 """
 from decimal import Decimal
-from time import time
+from time import time, tzset
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
 import sys
 import os
+import shutil
+import tempfile
 import unittest
+from contextlib import contextmanager
 import trytond.tests.test_tryton
 from trytond.tests.test_tryton import POOL, DB_NAME, USER, CONTEXT
 from trytond.transaction import Transaction
@@ -27,6 +30,14 @@ if os.path.isdir(DIR):
     sys.path.insert(0, os.path.dirname(DIR))
 
 
+@contextmanager
+def same_transaction():
+    """
+    Run the block in the transaction of the test
+    """
+    yield
+
+
 class TestDHLDEShipment(unittest.TestCase):
     """Test DHL DE Integration
     """
@@ -57,6 +68,16 @@ class TestDHLDEShipment(unittest.TestCase):
         self.Template = POOL.get('product.template')
         self.GenerateLabel = POOL.get('shipping.label', type="wizard")
 
+        if DB_NAME == ':memory:':
+            # The memory database has a single connection, the ledger
+            # committing its own transaction would commit the test data
+            Request = POOL.get('shipping_dhl_de.request')
+            self.addCleanup(
+                setattr, Request, '_ledger_transaction',
+                Request.__dict__['_ledger_transaction']
+            )
+            Request._ledger_transaction = staticmethod(same_transaction)
+
         assert 'DHL_DE_USERNAME' in os.environ, \
             "DHL_DE_USERNAME missing. Hint:Use export DHL_DE_USERNAME=<string>"
         assert 'DHL_DE_PASSWORD' in os.environ, \
@@ -469,6 +490,42 @@ class TestDHLDEShipment(unittest.TestCase):
                 ], count=True) > 0
             )
 
+    def test_0011_generate_dhl_de_labels_api_v2(self):
+        """Test case to generate DHL DE labels with the 2.2 API.
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+
+            # Call method to create sale order
+            self.setup_defaults()
+            self.carrier.dhl_de_api_version = '2.2'
+            self.carrier.save()
+            self.Carrier.test_dhl_de_credentials([self.carrier])
+            self.create_sale(self.sale_party)
+
+            shipment, = self.StockShipmentOut.search([])
+            self.StockShipmentOut.write([shipment], {
+                'code': str(int(time())),
+            })
+
+            # Make shipment in packed state.
+            shipment.assign([shipment])
+            shipment.pack([shipment])
+
+            with Transaction().set_context(company=self.company.id):
+                self.create_shipment_package(shipment)
+                # Call method to generate labels.
+                shipment.make_dhl_de_labels()
+
+            self.assertTrue(shipment.tracking_number)
+            self.assertEqual(
+                shipment.packages[0].tracking_number,
+                shipment.tracking_number
+            )
+            attachment, = self.IrAttachment.search([
+                ('resource', '=', 'stock.shipment.out,%s' % shipment.id)
+            ])
+            self.assertTrue(str(attachment.data).startswith('%PDF'))
+
     def test_0012_generate_dhl_de_labels_using_wizard(self):
         """
         Test case to generate DHL DE labels using wizard
@@ -539,6 +596,572 @@ class TestDHLDEShipment(unittest.TestCase):
                 ], count=True) > 0
             )
 
+    def test_0013_dhl_de_warm_up(self):
+        """Test that the carriers are warmed up only when asked and not
+        while the database is updated.
+        """
+        from trytond.modules.shipping_dhl_de.carrier import (
+            is_dhl_de_warm_up_wanted, _dhl_de_versions
+        )
+        Module = POOL.get('ir.module.module')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            self.assertFalse(is_dhl_de_warm_up_wanted(DB_NAME))
+
+            if not config.has_section('shipping_dhl_de'):
+                config.add_section('shipping_dhl_de')
+            config.set('shipping_dhl_de', 'warm_up', 'True')
+            self.addCleanup(
+                config.remove_option, 'shipping_dhl_de', 'warm_up'
+            )
+            self.assertTrue(is_dhl_de_warm_up_wanted(DB_NAME))
+
+            module, = Module.search([('name', '=', 'shipping_dhl_de')])
+            Module.write([module], {'state': 'to upgrade'})
+            self.assertFalse(is_dhl_de_warm_up_wanted(DB_NAME))
+            Module.write([module], {'state': 'installed'})
+
+            # The version is shared by the carriers of the endpoint,
+            # whatever their credentials
+            key = self.carrier._get_dhl_de_transport_args()[1][:2]
+            self.addCleanup(_dhl_de_versions.pop, key, None)
+            _dhl_de_versions[key] = ({
+                'majorRelease': '1',
+                'minorRelease': '0',
+            }, time())
+            self.Carrier.write([self.carrier], {'dhl_de_password': 'other'})
+            carrier = self.Carrier(self.carrier.id)
+            self.assertEqual(carrier.get_dhl_de_version(), {
+                'majorRelease': '1',
+                'minorRelease': '0',
+            })
+
+            # A carrier failing to warm up is logged only
+            self.Carrier.write([carrier], {
+                'dhl_de_soap_backend': 'lxml',
+                'dhl_de_api_version': '2.2',
+            })
+            self.Carrier.warm_up_dhl_de([self.Carrier(carrier.id)])
+
+    def test_0014_dhl_de_rate_stats(self):
+        """Test that the carrier shows the waits for its rate limit.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        if not config.has_section('shipping_dhl_de'):
+            config.add_section('shipping_dhl_de')
+        config.set('shipping_dhl_de', 'rate_limit_path', directory)
+        self.addCleanup(
+            config.remove_option, 'shipping_dhl_de', 'rate_limit_path'
+        )
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            self.Carrier.write([self.carrier], {'dhl_de_rate_limit': 0})
+            carrier = self.Carrier(self.carrier.id)
+            self.assertIsNone(carrier.dhl_de_rate_calls)
+
+            self.Carrier.write([self.carrier], {
+                'dhl_de_rate_limit': 20,
+                'dhl_de_rate_burst': 1,
+            })
+            carrier = self.Carrier(self.carrier.id)
+            carrier._wait_dhl_de_rate_limit()
+            carrier._wait_dhl_de_rate_limit()
+
+            carrier = self.Carrier(self.carrier.id)
+            self.assertEqual(carrier.dhl_de_rate_calls, 2)
+            self.assertEqual(carrier.dhl_de_rate_waited, 1)
+            self.assertTrue(carrier.dhl_de_rate_wait_time > 0)
+
+    def test_0020_generate_dhl_de_labels_batch(self):
+        """Test case to generate DHL DE labels for many shipments at once.
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+
+            # Call method to create sale orders
+            self.setup_defaults()
+            self.create_sale(self.sale_party)
+            self.create_sale(self.sale_party)
+
+            shipments = self.StockShipmentOut.search([])
+            self.assertEqual(len(shipments), 2)
+            self.StockShipmentOut.write(shipments, {
+                'code': str(int(time())),
+            })
+
+            # Make shipments in packed state.
+            self.StockShipmentOut.assign(shipments)
+            self.StockShipmentOut.pack(shipments)
+
+            with Transaction().set_context(company=self.company.id):
+                for shipment in shipments:
+                    self.create_shipment_package(shipment)
+                # Packages filled before the weight of the product changed
+                self.Template.write([self.product.template], {'weight': 1})
+                # Call method to generate labels.
+                tracking_numbers, errors = \
+                    self.StockShipmentOut.make_dhl_de_labels_batch(shipments)
+
+            self.assertEqual(errors, {})
+            for shipment in shipments:
+                self.assertEqual(
+                    shipment.tracking_number, tracking_numbers[shipment.id]
+                )
+                self.assertAlmostEqual(
+                    shipment.packages[0].dhl_de_weight, 0.45, places=2
+                )
+                self.assertTrue(shipment.packages[0].tracking_number)
+                self.assertEqual(
+                    self.IrAttachment.search([
+                        ('resource', '=', 'stock.shipment.out,%s' % shipment.id)
+                    ], count=True), 1
+                )
+
+    def test_0021_cancel_dhl_de_labels(self):
+        """Test case to cancel DHL DE shipments at once.
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+
+            # Call method to create sale orders
+            self.setup_defaults()
+            self.create_sale(self.sale_party)
+            self.create_sale(self.sale_party)
+
+            shipments = self.StockShipmentOut.search([])
+            self.StockShipmentOut.write(shipments, {
+                'code': str(int(time())),
+            })
+            self.StockShipmentOut.assign(shipments)
+            self.StockShipmentOut.pack(shipments)
+
+            with Transaction().set_context(company=self.company.id):
+                for shipment in shipments:
+                    self.create_shipment_package(shipment)
+                self.StockShipmentOut.make_dhl_de_labels_batch(shipments)
+
+                self.StockShipmentOut.cancel_dhl_de_labels(shipments)
+
+            for shipment in shipments:
+                self.assertFalse(shipment.tracking_number)
+                self.assertFalse(shipment.packages[0].tracking_number)
+                self.assertEqual(
+                    shipment.dhl_de_requests[0].state, 'cancelled'
+                )
+            self.assertEqual(self.IrAttachment.search([], count=True), 0)
+
+    def test_0022_refetch_dhl_de_labels(self):
+        """Test case to fetch again the labels of DHL DE shipments.
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+
+            # Call method to create sale orders
+            self.setup_defaults()
+            self.create_sale(self.sale_party)
+            self.create_sale(self.sale_party)
+
+            shipments = self.StockShipmentOut.search([])
+            self.StockShipmentOut.write(shipments, {
+                'code': str(int(time())),
+            })
+            self.StockShipmentOut.assign(shipments)
+            self.StockShipmentOut.pack(shipments)
+
+            with Transaction().set_context(company=self.company.id):
+                for shipment in shipments:
+                    self.create_shipment_package(shipment)
+                self.StockShipmentOut.make_dhl_de_labels_batch(shipments)
+
+                # Labels lost
+                self.IrAttachment.delete(self.IrAttachment.search([]))
+
+                self.StockShipmentOut.refetch_dhl_de_labels(shipments)
+
+            for shipment in shipments:
+                resource = 'stock.shipment.out,%s' % shipment.id
+                self.assertEqual(
+                    self.IrAttachment.search([
+                        ('resource', '=', resource),
+                        ('name', '=', '%s.pdf' % shipment.tracking_number),
+                    ], count=True), 1
+                )
+
+    def test_0023_generate_dhl_de_labels_batch_with_group(self):
+        """Test that the shipments of a batch are shared between the
+        accounts of the group of their carrier.
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            self.create_sale(self.sale_party)
+            self.create_sale(self.sale_party)
+            self.create_sale(self.sale_party)
+
+            # The sandbox has a single account
+            account, = self.Carrier.copy([self.carrier])
+            self.Carrier.write([account], {
+                'dhl_de_weight': 2,
+            }, [self.carrier], {
+                'dhl_de_group_accounts': [('add', [account.id])],
+            })
+
+            shipments = self.StockShipmentOut.search(
+                [], order=[('id', 'ASC')]
+            )
+            self.StockShipmentOut.write(shipments, {
+                'code': str(int(time())),
+            })
+            self.StockShipmentOut.assign(shipments)
+            self.StockShipmentOut.pack(shipments)
+
+            with Transaction().set_context(company=self.company.id):
+                for shipment in shipments:
+                    self.create_shipment_package(shipment)
+                tracking_numbers, errors = \
+                    self.StockShipmentOut.make_dhl_de_labels_batch(shipments)
+
+            self.assertEqual(errors, {})
+            self.assertEqual(
+                [s.dhl_de_account for s in shipments],
+                [self.carrier, account, account]
+            )
+            for shipment in shipments:
+                self.assertEqual(
+                    shipment.tracking_number, tracking_numbers[shipment.id]
+                )
+                self.assertEqual(
+                    shipment.dhl_de_requests[0].carrier,
+                    shipment.dhl_de_account
+                )
+
+    def test_0024_dhl_de_request_refused(self):
+        """Test that a request refused by DHL does not stop the others.
+        """
+        from trytond.modules.shipping_dhl_de.states import DHLDEFault
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            self.create_sale(self.sale_party)
+            self.create_sale(self.sale_party)
+            self.create_sale(self.sale_party)
+
+            account, = self.Carrier.copy([self.carrier])
+            self.Carrier.write([account], {
+                'dhl_de_weight': 2,
+            }, [self.carrier], {
+                'dhl_de_group_accounts': [('add', [account.id])],
+            })
+
+            # DHL refuses the whole request of the account
+            create_call = self.Carrier._get_dhl_de_create_call
+
+            def refusing_create_call(carrier):
+                if carrier != account:
+                    return create_call(carrier)
+
+                def call(shipment_orders):
+                    raise DHLDEFault('Login failed')
+                return call
+            self.Carrier._get_dhl_de_create_call = refusing_create_call
+            self.addCleanup(
+                delattr, self.Carrier, '_get_dhl_de_create_call'
+            )
+
+            shipments = self.StockShipmentOut.search(
+                [], order=[('id', 'ASC')]
+            )
+            self.StockShipmentOut.write(shipments, {
+                'code': str(int(time())),
+            })
+            self.StockShipmentOut.assign(shipments)
+            self.StockShipmentOut.pack(shipments)
+
+            with Transaction().set_context(company=self.company.id):
+                for shipment in shipments:
+                    self.create_shipment_package(shipment)
+                tracking_numbers, errors = \
+                    self.StockShipmentOut.make_dhl_de_labels_batch(shipments)
+
+            labelled, refused1, refused2 = shipments
+            self.assertEqual(tracking_numbers.keys(), [labelled.id])
+            self.assertEqual(labelled.dhl_de_account, self.carrier)
+            self.assertEqual(
+                sorted(errors.keys()), [refused1.id, refused2.id]
+            )
+            for shipment in (refused1, refused2):
+                self.assertIn('Login failed', errors[shipment.id][0])
+                self.assertFalse(shipment.tracking_number)
+                self.assertEqual(
+                    shipment.dhl_de_requests[0].state, 'failed'
+                )
+
+    def test_0025_validate_dhl_de_shipments(self):
+        """Test that all problems of all shipments are found locally.
+        """
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+
+            # Call method to create sale orders
+            self.setup_defaults()
+            self.create_sale(self.sale_party)
+            self.create_sale(self.sale_party2)
+
+            shipment1, shipment2 = self.StockShipmentOut.search(
+                [], order=[('id', 'ASC')]
+            )
+            self.StockShipmentOut.assign([shipment1, shipment2])
+            self.StockShipmentOut.pack([shipment1, shipment2])
+
+            with Transaction().set_context(company=self.company.id):
+                self.create_shipment_package(shipment1)
+                self.Address.write([shipment2.delivery_address], {
+                    'zip': None,
+                })
+
+                problems = self.StockShipmentOut.validate_dhl_de_shipments(
+                    [shipment1, shipment2]
+                )
+                self.assertEqual(problems.keys(), [shipment2])
+                # No package and no zip
+                self.assertEqual(len(problems[shipment2]), 2)
+
+                with self.assertRaises(UserError):
+                    self.StockShipmentOut.make_dhl_de_labels_batch(
+                        [shipment1, shipment2]
+                    )
+            # Nothing was sent to DHL
+            self.assertFalse(shipment1.tracking_number)
+
+    def test_0026_normalize_dhl_de_addresses(self):
+        """Test that addresses are normalized once per revision.
+        """
+        AddressDHLDE = POOL.get('party.address.dhl_de')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+
+            address = self.sale_party.addresses[0]
+            # Stored when the address was created
+            record, = AddressDHLDE.search([('address', '=', address.id)])
+            self.assertEqual(record.firstname, 'Kai')
+
+            values = address.get_dhl_de_values()
+            self.assertEqual(values['firstname'], 'Kai')
+            self.assertEqual(values['lastname'], 'Wahn')
+            self.assertEqual(values['street_name'], 'Marktplatz')
+            self.assertEqual(values['zip_type'], 'germany')
+
+            # Read only, the labels made at the same time do not write
+            write_date = record.write_date
+            self.Address.get_dhl_de_normalized([address])
+            self.assertEqual(
+                AddressDHLDE(record.id).write_date, write_date
+            )
+
+            # House number is split from the street
+            self.Address.write([address], {
+                'street': 'Hauptstr. 12a',
+                'streetbis': None,
+            })
+            address = self.Address(address.id)
+            values = address.get_dhl_de_values()
+            self.assertEqual(values['street_name'], 'Hauptstr.')
+            self.assertEqual(values['street_number'], '12a')
+            record, = AddressDHLDE.search([('address', '=', address.id)])
+            self.assertEqual(record.street_number, '12a')
+
+            # The party gives the name of its addresses without one
+            self.Address.write([address], {'name': None})
+            self.Party.write([self.sale_party], {'name': 'Max Mustermann'})
+            address = self.Address(address.id)
+            values = address.get_dhl_de_values()
+            self.assertEqual(values['firstname'], 'Max')
+            self.assertEqual(values['lastname'], 'Mustermann')
+            record, = AddressDHLDE.search([('address', '=', address.id)])
+            self.assertEqual(record.firstname, 'Max')
+
+    def test_0027_reconcile_dhl_de_requests(self):
+        """Test that shipments already sent to DHL are not sent again.
+        """
+        Request = POOL.get('shipping_dhl_de.request')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            self.create_sale(self.sale_party)
+            self.create_sale(self.sale_party)
+
+            shipment1, shipment2 = self.StockShipmentOut.search(
+                [], order=[('id', 'ASC')]
+            )
+            self.StockShipmentOut.assign([shipment1, shipment2])
+            self.StockShipmentOut.pack([shipment1, shipment2])
+
+            with Transaction().set_context(company=self.company.id):
+                self.create_shipment_package(shipment1)
+                self.create_shipment_package(shipment2)
+
+                # Created at DHL but the transaction saving it was lost
+                # and no answer received for the other one
+                label = self.StockShipmentOut._store_dhl_de_label(
+                    ['%PDF-1.4']
+                )
+                Request.create([{
+                    'shipment': 'stock.shipment.out,%s' % shipment1.id,
+                    'carrier': 'carrier,%s' % self.carrier.id,
+                    'sequence_number': '%s' % shipment1.id,
+                    'state': 'succeeded',
+                    'status_code': '0',
+                    'shipment_number': '00340433836000000001',
+                    'piece_numbers': '00340433836000000001',
+                    'label_digest': label['digest'],
+                    'label_collision': label['collision'],
+                }, {
+                    'shipment': 'stock.shipment.out,%s' % shipment2.id,
+                    'sequence_number': '%s' % shipment2.id,
+                }])
+
+                tracking_numbers, errors = \
+                    self.StockShipmentOut.make_dhl_de_labels_batch(
+                        [shipment1, shipment2]
+                    )
+
+            self.assertEqual(
+                tracking_numbers, {shipment1.id: '00340433836000000001'}
+            )
+            self.assertEqual(errors.keys(), [shipment2.id])
+            self.assertEqual(
+                shipment1.tracking_number, '00340433836000000001'
+            )
+            self.assertEqual(shipment1.dhl_de_account, self.carrier)
+            self.assertEqual(
+                shipment1.packages[0].tracking_number,
+                '00340433836000000001'
+            )
+            self.assertEqual(
+                self.IrAttachment.search([
+                    ('resource', '=', 'stock.shipment.out,%s' % shipment1.id)
+                ], count=True), 1
+            )
+            self.assertFalse(shipment2.tracking_number)
+
+            # Checked at DHL, it can be sent again
+            request, = shipment2.dhl_de_requests
+            Request.fail([request])
+            self.assertEqual(request.state, 'failed')
+
+    def test_0028_dhl_de_shipments_to_manifest(self):
+        """Test that shipments created at DHL today are to be manifested.
+        """
+        Request = POOL.get('shipping_dhl_de.request')
+        Date = POOL.get('ir.date')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            self.create_sale(self.sale_party)
+            self.create_sale(self.sale_party)
+
+            shipment1, shipment2 = self.StockShipmentOut.search(
+                [], order=[('id', 'ASC')]
+            )
+            self.StockShipmentOut.write([shipment1, shipment2], {
+                'tracking_number': '00340433836000000001',
+            })
+            self.StockShipmentOut.write([shipment2], {
+                'dhl_de_manifest_state': 'manifested',
+            })
+            Request.create([{
+                'shipment': 'stock.shipment.out,%s' % shipment.id,
+                'state': 'succeeded',
+                'shipment_number': '00340433836000000001',
+            } for shipment in (shipment1, shipment2)])
+
+            today = Date.today()
+            self.assertEqual(
+                self.StockShipmentOut.get_dhl_de_shipments_to_manifest(
+                    today
+                ), [shipment1]
+            )
+            self.assertEqual(
+                self.StockShipmentOut.get_dhl_de_shipments_to_manifest(
+                    today - relativedelta(days=1)
+                ), []
+            )
+
+    def test_0029_sync_dhl_de_tracking(self):
+        """Test that tracking events are stored from the provider.
+        """
+        from trytond.modules.shipping_dhl_de.tracking import (
+            StubProvider, PieceState, PieceEvent
+        )
+        TrackingEvent = POOL.get('shipping_dhl_de.tracking_event')
+
+        if not config.has_section('shipping_dhl_de'):
+            config.add_section('shipping_dhl_de')
+        config.set('shipping_dhl_de', 'tracking_provider', 'stub')
+        self.addCleanup(
+            config.remove_option, 'shipping_dhl_de', 'tracking_provider'
+        )
+        self.addCleanup(setattr, StubProvider, 'pieces', {})
+        StubProvider.pieces = {
+            '00340433836000000001': PieceState(True, [
+                PieceEvent(
+                    datetime(2016, 3, 18, 10, 2),
+                    'Eingeliefert', 'Eingeliefert', 'Bonn',
+                ),
+                PieceEvent(
+                    datetime(2016, 3, 19, 9, 15),
+                    'Zugestellt', 'Zugestellt', 'Stuttgart',
+                ),
+            ]),
+            '00340433836000000002': PieceState(False, [
+                PieceEvent(
+                    datetime(2016, 3, 18, 10, 2),
+                    'Eingeliefert', 'Eingeliefert', 'Bonn',
+                ),
+            ]),
+        }
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            self.create_sale(self.sale_party)
+            self.create_sale(self.sale_party)
+
+            shipment1, shipment2 = self.StockShipmentOut.search(
+                [], order=[('id', 'ASC')]
+            )
+            self.StockShipmentOut.write([shipment1], {
+                'tracking_number': '00340433836000000001',
+            })
+            self.StockShipmentOut.write([shipment2], {
+                'tracking_number': '00340433836000000002',
+            })
+
+            self.StockShipmentOut.sync_dhl_de_tracking()
+
+            self.assertTrue(shipment1.dhl_de_delivered)
+            self.assertEqual(len(shipment1.dhl_de_tracking_events), 2)
+            self.assertFalse(shipment2.dhl_de_delivered)
+            self.assertEqual(len(shipment2.dhl_de_tracking_events), 1)
+            self.assertTrue(shipment2.dhl_de_tracking_sync)
+
+            # Not due yet, and events are not duplicated when synced
+            self.StockShipmentOut.sync_dhl_de_tracking()
+            self.StockShipmentOut.sync_dhl_de_tracking([shipment2])
+            self.assertEqual(TrackingEvent.search([], count=True), 3)
+
+            self.assertTrue(shipment2.is_dhl_de_tracking_due(
+                shipment2.dhl_de_tracking_sync + relativedelta(hours=1)
+            ))
+            self.assertFalse(shipment2.is_dhl_de_tracking_due(
+                shipment2.dhl_de_tracking_sync + relativedelta(minutes=30)
+            ))
+
+            # A misconfigured provider is reported to the user
+            config.set('shipping_dhl_de', 'tracking_provider', 'unknown')
+            with self.assertRaises(UserError):
+                self.StockShipmentOut.sync_dhl_de_tracking([shipment2])
+
     def test_0030_generate_dhl_de_international_labels(self):
         """Test case to generate DHL DE labels for international shipments.
         """
@@ -578,6 +1201,138 @@ class TestDHLDEShipment(unittest.TestCase):
                 ], count=True) > 0
             )
 
+    def test_0031_dhl_de_export_positions(self):
+        """Test the export positions of international shipments.
+        """
+        Move = POOL.get('stock.move')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            self.create_sale(self.sale_party2)
+
+            country_tw, = self.Country.search([('code', '=', 'TW')])
+            self.Product.write([self.product], {
+                'country_of_origin': country_tw.id,
+                'use_list_price_as_customs_value': False,
+                'customs_value': Decimal('7.255'),
+            })
+            shipment, = self.StockShipmentOut.search([])
+            Move.write(list(shipment.outgoing_moves), {'quantity': 3})
+
+            positions = self.StockShipmentOut.get_dhl_de_export_positions(
+                [shipment]
+            )
+            position, = positions[shipment.id]
+            self.assertEqual(position.description, 'Test Product')
+            self.assertEqual(position.country_code, 'TW')
+            self.assertEqual(position.amount, 3)
+            self.assertEqual(position.value, Decimal('7.255'))
+            self.assertAlmostEqual(position.net_weight, 0.68, places=2)
+
+            # BPI declares one position per product, in the currency
+            self.assertEqual(shipment.dhl_de_product_code, 'BPI')
+            declared, = shipment._get_dhl_de_declared_positions(
+                positions[shipment.id]
+            )
+            self.assertEqual(declared.value, Decimal('7.26'))
+            self.assertEqual(declared.amount, 3)
+
+            export_doc = shipment._get_dhl_de_export_doc_v2()
+            doc_position, = export_doc['ExportDocPosition']
+            self.assertEqual(doc_position['countryCodeOrigin'], 'TW')
+            self.assertEqual(doc_position['customsValue'], Decimal('7.26'))
+
+    def test_0032_dhl_de_package_weight(self):
+        """Test that the weight in kg of the packages follows their moves.
+        """
+        Package = POOL.get('stock.package')
+        ModelData = POOL.get('ir.model.data')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            self.create_sale(self.sale_party)
+
+            shipment, = self.StockShipmentOut.search([])
+            shipment.assign([shipment])
+            shipment.pack([shipment])
+
+            package, = Package.create([{
+                'shipment': '%s,%d' % (shipment.__name__, shipment.id),
+                'type': ModelData.get_id('shipping', 'shipment_package_type'),
+            }])
+            self.assertEqual(package.dhl_de_weight, 0)
+
+            # 0.5 lb
+            Package.write([package], {
+                'moves': [('add', shipment.outgoing_moves)],
+            })
+            self.assertAlmostEqual(
+                Package(package.id).dhl_de_weight, 0.23, places=2
+            )
+
+            # 1 lb
+            self.Template.write([self.product.template], {'weight': 1})
+            self.assertAlmostEqual(
+                Package(package.id).dhl_de_weight, 0.45, places=2
+            )
+
+            Package.write([package], {'override_weight': 2})
+            self.assertEqual(Package(package.id).dhl_de_weight, 2)
+
+            Package.write([package], {
+                'override_weight': None,
+                'moves': [('remove', shipment.outgoing_moves)],
+            })
+            self.assertEqual(Package(package.id).dhl_de_weight, 0)
+
+    def test_0033_dhl_de_export_invoice_dates(self):
+        """Test the export invoice date of many shipments at once.
+        """
+        Date = POOL.get('ir.date')
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            self.create_sale(self.sale_party2)
+            self.create_sale(self.sale_party2)
+
+            sale1, sale2 = self.Sale.search([], order=[('id', 'ASC')])
+            self.Sale.write([sale1], {
+                'sale_date': datetime(2016, 3, 1).date(),
+            })
+            shipment1, = sale1.shipments
+            shipment2, = sale2.shipments
+
+            dates = self.StockShipmentOut.get_dhl_de_export_invoice_dates(
+                [shipment1, shipment2]
+            )
+            self.assertEqual(dates, {
+                shipment1.id: datetime(2016, 3, 1).date(),
+                shipment2.id: Date.today(),
+            })
+
+    def test_0034_dhl_de_manifest_day_bounds(self):
+        """Test that the manifest day is converted to UTC.
+        """
+        from trytond.modules.shipping_dhl_de.shipment import utc_day_bounds
+
+        timezone = os.environ.get('TZ')
+        os.environ['TZ'] = 'Europe/Berlin'
+        tzset()
+        try:
+            self.assertEqual(utc_day_bounds(datetime(2016, 3, 1).date()), (
+                datetime(2016, 2, 29, 23), datetime(2016, 3, 1, 23),
+            ))
+            # Summer time starts on the 27th
+            self.assertEqual(utc_day_bounds(datetime(2016, 3, 27).date()), (
+                datetime(2016, 3, 26, 23), datetime(2016, 3, 27, 22),
+            ))
+        finally:
+            if timezone is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = timezone
+            tzset()
+
     def test_0040_generate_dhl_de_labels_multiple_packages_using_wizard(self):
         """
         Test case to generate DHL DE labels using wizard
@@ -702,6 +1457,73 @@ class TestDHLDEShipment(unittest.TestCase):
                 ], count=True) == 1
             )
 
+    def test_0041_generate_dhl_de_labels_of_many_shipments(self):
+        """
+        Test the wizard making the labels of many shipments at once
+        """
+        GenerateLabels = POOL.get(
+            'shipping_dhl_de.wizard_generate_labels', type='wizard'
+        )
+
+        with Transaction().start(DB_NAME, USER, context=CONTEXT):
+            self.setup_defaults()
+            self.create_sale(self.sale_party)
+            self.create_sale(self.sale_party2)
+
+            domestic, international = self.StockShipmentOut.search(
+                [], order=[('id', 'ASC')]
+            )
+            domestic.assign([domestic])
+            domestic.pack([domestic])
+
+            with Transaction().set_context(
+                company=self.company.id,
+                active_ids=[domestic.id, international.id],
+            ):
+                session_id, _, _ = GenerateLabels.create()
+                generate_labels = GenerateLabels(session_id)
+
+                result = generate_labels.default_start({})
+                self.assertEqual(
+                    result['shipments'], [domestic.id, international.id]
+                )
+                self.assertTrue(result['is_domestic_shipping'])
+                self.assertTrue(result['is_international_shipping'])
+                self.assertEqual(result['international_product_code'], 'BPI')
+
+                generate_labels.start.shipments = result['shipments']
+                generate_labels.start.product_code = 'EPN'
+                generate_labels.start.international_product_code = 'BPI'
+                generate_labels.start.export_type = '2'
+                generate_labels.start.export_type_description = 'Samples'
+                generate_labels.start.terms_of_trade = 'DDU'
+                generate_labels.update_shipments()
+                generate_labels.create_packages()
+
+                domestic = self.StockShipmentOut(domestic.id)
+                international = self.StockShipmentOut(international.id)
+                self.assertEqual(domestic.dhl_de_product_code, 'EPN')
+                self.assertEqual(len(domestic.packages), 1)
+                self.assertEqual(international.dhl_de_export_type, '2')
+                self.assertEqual(
+                    international.dhl_de_export_type_description, 'Samples'
+                )
+                self.assertEqual(international.dhl_de_terms_of_trade, 'DDU')
+                # Not packed yet
+                self.assertFalse(international.packages)
+
+                # Refused locally, nothing is sent to DHL
+                self.StockShipmentOut.write([domestic], {
+                    'tracking_number': '00340433836000000001',
+                })
+                result = generate_labels.default_result({})
+                self.assertEqual(result['labelled'], [])
+                self.assertEqual(
+                    result['failed'], [domestic.id, international.id]
+                )
+                self.assertIn(domestic.rec_name, result['messages'])
+                self.assertIn(international.rec_name, result['messages'])
+
     def test_0050_sale_quotation(self):
         """
         Test how export type description field will be populated
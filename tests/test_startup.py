@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_startup.py
+
+    Test that registering the module does not import the SOAP backends
+
+"""
+import sys
+import json
+import unittest
+import subprocess
+
+# Run in a new interpreter, the backends are already imported by the tests
+SCRIPT = """
+import sys
+import json
+import time
+
+import trytond.pool
+import trytond.model
+import trytond.wizard
+
+HEAVY = ('suds', 'requests')
+
+start = time.time()
+from trytond.modules.shipping_dhl_de import register
+register()
+registered = time.time()
+loaded = [m for m in HEAVY if m in sys.modules]
+
+from trytond.modules.shipping_dhl_de import transport
+json.dump({
+    'register': registered - start,
+    'loaded': loaded,
+    'loaded_by_transport': [m for m in HEAVY if m in sys.modules],
+}, sys.stdout)
+"""
+
+
+class TestStartup(unittest.TestCase):
+    """Test the startup cost of the module
+    """
+
+    def test_0010_lazy_backends(self):
+        """Test that suds and requests are imported with the transports
+        only.
+        """
+        output = subprocess.check_output([sys.executable, '-c', SCRIPT])
+        timings = json.loads(output.splitlines()[-1])
+
+        self.assertEqual(
+            timings['loaded'], [],
+            'Imported on register in %.3fs: %s' % (
+                timings['register'], ', '.join(timings['loaded'])
+            )
+        )
+        self.assertEqual(
+            timings['loaded_by_transport'], ['suds', 'requests']
+        )
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_tracking.py
+
+    Test the tracking providers without calling DHL
+
+"""
+import unittest
+from datetime import datetime
+
+from lxml import etree
+
+from trytond.modules.shipping_dhl_de.tracking import (
+    SendungsverfolgungProvider, TrackingProvider
+)
+
+PIECE_DETAIL_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<data name="piece-shipment-list" code="0" request-id="1">
+  <data name="piece-shipment" piece-code="00340433836000013741"
+      delivery-event-flag="1" status="Zugestellt">
+    <data name="piece-event-list" piece-code="00340433836000013741">
+      <data name="piece-event" event-timestamp="18.03.2016 10:02"
+          event-status="Eingeliefert" event-text="Eingeliefert"
+          event-location="Bonn"/>
+      <data name="piece-event" event-timestamp="19.03.2016 09:15"
+          event-status="Zugestellt" event-text="Zugestellt"
+          event-location="Stuttgart"/>
+    </data>
+  </data>
+  <data name="piece-shipment" piece-code="00340433836000013742"
+      delivery-event-flag="0">
+    <data name="piece-event-list" piece-code="00340433836000013742"/>
+  </data>
+</data>"""
+
+
+class TestSendungsverfolgung(unittest.TestCase):
+    """Test the Sendungsverfolgung provider
+    """
+
+    def setUp(self):
+        self.provider = SendungsverfolgungProvider()
+
+    def test_0010_parse_response(self):
+        """Test that pieces and their events are read.
+        """
+        pieces = self.provider.parse_response(PIECE_DETAIL_RESPONSE)
+
+        delivered = pieces['00340433836000013741']
+        self.assertTrue(delivered.delivered)
+        self.assertEqual(len(delivered.events), 2)
+        self.assertEqual(
+            delivered.events[1].time, datetime(2016, 3, 19, 8, 15)
+        )
+        self.assertEqual(delivered.events[1].location, 'Stuttgart')
+
+        pending = pieces['00340433836000013742']
+        self.assertFalse(pending.delivered)
+        self.assertEqual(pending.events, [])
+
+    def test_0015_parse_event_time(self):
+        """Test that the German local time is stored as UTC.
+        """
+        self.assertEqual(
+            self.provider.parse_event_time('19.03.2016 09:15'),
+            datetime(2016, 3, 19, 8, 15)
+        )
+        self.assertEqual(
+            self.provider.parse_event_time('01.07.2016 09:15'),
+            datetime(2016, 7, 1, 7, 15)
+        )
+
+    def test_0016_provider_abstract(self):
+        """Test that the base provider can not be used.
+        """
+        self.assertRaises(TypeError, TrackingProvider)
+
+    def test_0020_build_request(self):
+        """Test that all the pieces are asked at once.
+        """
+        class Carrier(object):
+            dhl_de_api_user = 'zt12345'
+            dhl_de_api_signature = 'ge"heim'
+
+        request = etree.fromstring(self.provider.build_request(
+            Carrier(), ['00340433836000013741', '00340433836000013742']
+        ))
+        self.assertEqual(request.get('password'), 'ge"heim')
+        self.assertEqual(
+            request.get('piece-code'),
+            '00340433836000013741;00340433836000013742'
+        )
+
+
+def suite():
+    """
+    Define suite
+    """
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestSendungsverfolgung)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
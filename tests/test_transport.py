@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+    tests/test_transport.py
+
+    Test the lxml transport without calling DHL
+
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+
+from lxml import etree
+
+from trytond.modules.shipping_dhl_de.transport import (
+    LxmlTransport, CapturingReader, CIS_NS, DHLDEFault, DeletionState,
+    ManifestState, get_suds_client
+)
+
+CREATE_SHIPMENT_DD_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
+  <soapenv:Body>
+    <ns2:CreateShipmentResponse xmlns:ns2="http://de.ws.intraship"
+        xmlns="http://dhl.de/webservice/cisbase">
+      <ns2:Version>
+        <majorRelease>1</majorRelease>
+        <minorRelease>0</minorRelease>
+      </ns2:Version>
+      <status>
+        <StatusCode>0</StatusCode>
+        <StatusMessage>ok</StatusMessage>
+      </status>
+      <CreationState>
+        <StatusCode>0</StatusCode>
+        <StatusMessage>ok</StatusMessage>
+        <SequenceNumber>1</SequenceNumber>
+        <ShipmentNumber>
+          <shipmentNumber>00340433836000013741</shipmentNumber>
+        </ShipmentNumber>
+        <PieceInformation>
+          <PieceNumber>
+            <licensePlate>00340433836000013742</licensePlate>
+          </PieceNumber>
+        </PieceInformation>
+        <PieceInformation>
+          <PieceNumber>
+            <licensePlate>00340433836000013741</licensePlate>
+          </PieceNumber>
+        </PieceInformation>
+        <Labelurl>https://example.com/label/1</Labelurl>
+      </CreationState>
+      <CreationState>
+        <StatusCode>1000</StatusCode>
+        <StatusMessage>General error</StatusMessage>
+        <StatusMessage>Zip is missing</StatusMessage>
+        <SequenceNumber>2</SequenceNumber>
+      </CreationState>
+    </ns2:CreateShipmentResponse>
+  </soapenv:Body>
+</soapenv:Envelope>
+"""
+
+VERSION_WSDL = """<?xml version="1.0" encoding="UTF-8"?>
+<definitions xmlns="http://schemas.xmlsoap.org/wsdl/"
+    xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+    xmlns:tns="http://example.com/version"
+    xmlns:xsd="http://www.w3.org/2001/XMLSchema"
+    targetNamespace="http://example.com/version">
+  <message name="getVersionRequest"/>
+  <message name="getVersionResponse">
+    <part name="version" type="xsd:string"/>
+  </message>
+  <portType name="VersionPortType">
+    <operation name="getVersion">
+      <input message="tns:getVersionRequest"/>
+      <output message="tns:getVersionResponse"/>
+    </operation>
+  </portType>
+  <binding name="VersionBinding" type="tns:VersionPortType">
+    <soap:binding style="rpc" transport="http://schemas.xmlsoap.org/soap/http"/>
+    <operation name="getVersion">
+      <soap:operation soapAction="urn:getVersion"/>
+      <input><soap:body use="literal" namespace="http://example.com/version"/></input>
+      <output><soap:body use="literal" namespace="http://example.com/version"/></output>
+    </operation>
+  </binding>
+  <service name="VersionService">
+    <port name="VersionPort" binding="tns:VersionBinding">
+      <soap:address location="http://example.com/soap"/>
+    </port>
+  </service>
+</definitions>
+"""  # noqa
+
+
+class TestSudsClient(unittest.TestCase):
+    """Test the suds clients sharing the WSDL of the worker
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, 'version.wsdl')
+        with open(path, 'wb') as wsdl_file:
+            wsdl_file.write(VERSION_WSDL)
+        self.wsdl_url = 'file://' + path
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_0010_shared_wsdl(self):
+        """
+        Test that the WSDL is parsed once and the options are not shared
+        """
+        first = get_suds_client(
+            self.wsdl_url, username='first', password='1',
+            location='https://first.example.com/soap',
+        )
+        second = get_suds_client(
+            self.wsdl_url, username='second', password='2',
+            location='https://second.example.com/soap',
+        )
+
+        self.assertIs(first.wsdl, second.wsdl)
+        self.assertEqual(first.options.username, 'first')
+        self.assertEqual(second.options.username, 'second')
+        self.assertEqual(
+            second.options.location, 'https://second.example.com/soap'
+        )
+        self.assertIsNot(first.options.transport, second.options.transport)
+        self.assertEqual(second.options.transport.options.password, '2')
+
+
+class TestLxmlTransport(unittest.TestCase):
+    """Test the lxml transport
+    """
+
+    def setUp(self):
+        # The WSDL is not needed to build elements and read responses
+        self.transport = LxmlTransport.__new__(LxmlTransport)
+
+    def test_0005_unsupported_operations(self):
+        """
+        The operations of the API 2.2 raise a DHL fault
+        """
+        with self.assertRaises(DHLDEFault):
+            self.transport.create_shipment_order('2.2', [])
+        for operation in (
+                self.transport.delete_shipment_order,
+                self.transport.get_label,
+                self.transport.do_manifest):
+            with self.assertRaises(DHLDEFault):
+                operation('2.2', ['00340433836000013741'])
+
+    def test_0010_parse_creation_states(self):
+        """
+        Read CreationState from a createShipmentDD response
+        """
+        success, failure = self.transport.parse_creation_states(
+            CREATE_SHIPMENT_DD_RESPONSE
+        )
+
+        self.assertEqual(success.sequence_number, '1')
+        self.assertEqual(success.status_code, '0')
+        self.assertEqual(success.shipment_number, '00340433836000013741')
+        # Pieces come in reverse order from DHL
+        self.assertEqual(success.piece_numbers, [
+            '00340433836000013741', '00340433836000013742'
+        ])
+        self.assertEqual(success.label_url, 'https://example.com/label/1')
+
+        self.assertEqual(failure.sequence_number, '2')
+        self.assertEqual(failure.status_code, '1000')
+        self.assertEqual(
+            failure.status_messages, ['General error', 'Zip is missing']
+        )
+        self.assertIsNone(failure.shipment_number)
+
+    def test_0015_iter_creation_states(self):
+        """
+        Read CreationState incrementally from a response with many orders
+        """
+        creation_state = """
+      <CreationState>
+        <StatusCode>0</StatusCode>
+        <SequenceNumber>%d</SequenceNumber>
+        <ShipmentNumber>
+          <shipmentNumber>%d</shipmentNumber>
+        </ShipmentNumber>
+        <Labelurl>https://example.com/label/%d</Labelurl>
+      </CreationState>"""
+        response = '<CreateShipmentResponse>%s</CreateShipmentResponse>' % (
+            ''.join(creation_state % (i, i, i) for i in xrange(1000))
+        )
+
+        for i, state in enumerate(
+                self.transport.iter_creation_states(BytesIO(response))):
+            self.assertEqual(state.sequence_number, '%d' % i)
+            self.assertEqual(state.shipment_number, '%d' % i)
+        self.assertEqual(i, 999)
+
+    def test_0016_capturing_reader(self):
+        """
+        Keep only the start and the end of a large response for the capture
+        """
+        content = ''.join('%04d' % i for i in xrange(1000))
+        reader = CapturingReader(BytesIO(content), size=400)
+
+        while reader.read(40):
+            pass
+
+        captured = ''.join(reader.chunks)
+        self.assertTrue(captured.startswith(content[:200]))
+        self.assertTrue(captured.endswith(content[-200:]))
+        self.assertIn('[... 3600 bytes not captured ...]', captured)
+        self.assertLess(len(captured), 500)
+
+    def test_0020_append_dict(self):
+        """
+        Serialize values given as dict in schema order and namespace
+        """
+        root = etree.Element('Shipper')
+        self.transport._append(root, 'Company', {
+            'Person': {
+                'lastname': 'Wahn',
+                'firstname': 'Kai',
+            },
+        }, False)
+        self.transport._append(root, 'Attendance', {
+            'partnerID': '01',
+        }, False)
+        self.transport._append(root, 'Empty', {'value': None}, False)
+
+        company, attendance = root
+        self.assertEqual(company.tag, 'Company')
+        person, = company
+        self.assertEqual(person.tag, '{%s}Person' % CIS_NS)
+        self.assertEqual([e.tag for e in person], [
+            '{%s}firstname' % CIS_NS, '{%s}lastname' % CIS_NS,
+        ])
+        self.assertEqual(attendance[0].tag, '{%s}partnerID' % CIS_NS)
+        self.assertEqual(attendance[0].text, '01')
+
+    def test_0030_parse_deletion_states(self):
+        """
+        Read DeletionState from a deleteShipmentDD response
+        """
+        root = etree.Element('DeleteShipmentDDRequest')
+        self.transport._append(root, 'ShipmentNumber', [
+            {'shipmentNumber': '00340433836000013741'},
+        ], False)
+        number, = root
+        self.assertEqual(number.tag, 'ShipmentNumber')
+        self.assertEqual(number[0].tag, '{%s}shipmentNumber' % CIS_NS)
+
+        success, failure = self.transport.parse_shipment_states("""
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/">
+  <soapenv:Body>
+    <ns2:DeleteShipmentResponse xmlns:ns2="http://de.ws.intraship"
+        xmlns="http://dhl.de/webservice/cisbase">
+      <DeletionState>
+        <ShipmentNumber>
+          <shipmentNumber>00340433836000013741</shipmentNumber>
+        </ShipmentNumber>
+        <Status>
+          <StatusCode>0</StatusCode>
+          <StatusMessage>ok</StatusMessage>
+        </Status>
+      </DeletionState>
+      <DeletionState>
+        <ShipmentNumber>
+          <shipmentNumber>00340433836000013742</shipmentNumber>
+        </ShipmentNumber>
+        <Status>
+          <StatusCode>2000</StatusCode>
+          <StatusMessage>Unknown shipment number</StatusMessage>
+        </Status>
+      </DeletionState>
+    </ns2:DeleteShipmentResponse>
+  </soapenv:Body>
+</soapenv:Envelope>""", DeletionState)
+
+        self.assertEqual(success.shipment_number, '00340433836000013741')
+        self.assertEqual(success.status_code, '0')
+        self.assertEqual(failure.status_code, '2000')
+        self.assertEqual(
+            failure.status_messages, ['Unknown shipment number']
+        )
+
+    def test_0035_parse_manifest_states(self):
+        """
+        Read ManifestState from a doManifestDD response
+        """
+        state, = self.transport.parse_shipment_states("""
+<DoManifestResponse xmlns="http://dhl.de/webservice/cisbase">
+  <status>
+    <StatusCode>0</StatusCode>
+  </status>
+  <ManifestState>
+    <ShipmentNumber>
+      <shipmentNumber>00340433836000013741</shipmentNumber>
+    </ShipmentNumber>
+    <Status>
+      <StatusCode>0</StatusCode>
+      <StatusMessage>ok</StatusMessage>
+    </Status>
+  </ManifestState>
+</DoManifestResponse>""", ManifestState)
+
+        self.assertTrue(isinstance(state, ManifestState))
+        self.assertEqual(state.shipment_number, '00340433836000013741')
+        self.assertEqual(state.status_code, '0')
+
+    def test_0040_parse_label_states(self):
+        """
+        Read LabelData from a getLabelDD response
+        """
+        state, = self.transport.parse_label_states("""
+<GetLabelResponse xmlns="http://dhl.de/webservice/cisbase">
+  <LabelData>
+    <Status>
+      <StatusCode>0</StatusCode>
+      <StatusMessage>ok</StatusMessage>
+    </Status>
+    <ShipmentNumber>
+      <shipmentNumber>00340433836000013741</shipmentNumber>
+    </ShipmentNumber>
+    <Labelurl>https://example.com/label/1</Labelurl>
+  </LabelData>
+</GetLabelResponse>""")
+
+        self.assertEqual(state.shipment_number, '00340433836000013741')
+        self.assertEqual(state.label_url, 'https://example.com/label/1')
+        self.assertIsNone(state.label_data)
+        self.assertEqual(state.status_code, '0')
+
+
+def suite():
+    """
+    Define suite
+    """
+    test_suite = unittest.TestSuite()
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestLxmlTransport)
+    )
+    test_suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(TestSudsClient)
+    )
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
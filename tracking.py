@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+    tracking.py
+
+    Tracking events of the DHL DE shipments, pulled in bulk from a tracking
+    provider and kept locally so they are read without calling DHL.
+
+"""
+from abc import ABCMeta, abstractmethod
+from datetime import datetime
+from collections import namedtuple
+from xml.sax.saxutils import quoteattr
+
+from dateutil import tz
+
+from trytond.model import ModelSQL, ModelView, fields
+
+__all__ = ['TrackingEvent']
+
+# State of a single piece as reported by the tracking provider
+PieceState = namedtuple('PieceState', ['delivered', 'events'])
+
+# Time zone of the event timestamps sent by DHL
+DHL_DE_TIMEZONE = tz.gettz('Europe/Berlin')
+
+# Single event of a piece, `time` is in UTC
+PieceEvent = namedtuple('PieceEvent', [
+    'time', 'status', 'description', 'location',
+])
+
+
+class TrackingProvider(object):
+    """
+    Source of the tracking events of the pieces
+    """
+    __metaclass__ = ABCMeta
+
+    name = None
+    # Maximum number of pieces per call
+    batch_size = 20
+
+    @abstractmethod
+    def get_pieces(self, carrier, piece_numbers):
+        """
+        Return the state of the pieces
+
+        :return: Dictionary of `PieceState` by piece number, pieces unknown
+                 to the provider are missing
+        """
+
+
+class SendungsverfolgungProvider(TrackingProvider):
+    """
+    Shipment tracking API (Sendungsverfolgung) of the DHL developer portal
+    """
+    name = 'sendungsverfolgung'
+
+    def get_url(self, carrier):
+        environment = 'sandbox'
+        if carrier.dhl_de_environment == 'production':  # pragma: no cover
+            environment = 'production'
+        return (
+            'https://cig.dhl.de/services/%s/rest/sendungsverfolgung'
+            % environment
+        )
+
+    def build_request(self, carrier, piece_numbers):
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="no"?>'
+            '<data appname=%s password=%s language-code="de" '
+            'request="d-get-piece-detail" piece-code=%s/>' % (
+                quoteattr(carrier.dhl_de_api_user or ''),
+                quoteattr(carrier.dhl_de_api_signature or ''),
+                quoteattr(';'.join(piece_numbers)),
+            )
+        )
+
+    @staticmethod
+    def parse_event_time(value):
+        """
+        Return the naive UTC time of a timestamp in German local time
+        """
+        local = datetime.strptime(value, '%d.%m.%Y %H:%M').replace(
+            tzinfo=DHL_DE_TIMEZONE
+        )
+        return local.astimezone(tz.tzutc()).replace(tzinfo=None)
+
+    def parse_response(self, content):
+        """
+        Return the `PieceState` by piece number of a d-get-piece-detail
+        response
+        """
+        from lxml import etree
+
+        pieces = {}
+        root = etree.fromstring(content)
+        for piece in root.iter('data'):
+            if piece.get('name') != 'piece-shipment':
+                continue
+            events = [
+                PieceEvent(
+                    time=self.parse_event_time(event.get('event-timestamp')),
+                    status=event.get('event-status'),
+                    description=event.get('event-text'),
+                    location=event.get('event-location'),
+                )
+                for event in piece.iter('data')
+                if event.get('name') == 'piece-event'
+            ]
+            pieces[piece.get('piece-code')] = PieceState(
+                delivered=piece.get('delivery-event-flag') == '1',
+                events=events,
+            )
+        return pieces
+
+    def get_pieces(self, carrier, piece_numbers):  # pragma: no cover
+        import requests
+
+        response = requests.get(
+            self.get_url(carrier),
+            params={'xml': self.build_request(carrier, piece_numbers)},
+            auth=(carrier.dhl_de_username, carrier.dhl_de_password),
+        )
+        response.raise_for_status()
+        return self.parse_response(response.content)
+
+
+class StubProvider(TrackingProvider):
+    """
+    Provider answering from `pieces`, to be filled by the tests
+    """
+    name = 'stub'
+    pieces = {}
+
+    def get_pieces(self, carrier, piece_numbers):
+        return dict(
+            (n, self.pieces[n]) for n in piece_numbers if n in self.pieces
+        )
+
+
+TRACKING_PROVIDERS = dict(
+    (p.name, p) for p in (SendungsverfolgungProvider, StubProvider)
+)
+
+
+class TrackingEvent(ModelSQL, ModelView):
+    "DHL DE Tracking Event"
+    __name__ = 'shipping_dhl_de.tracking_event'
+
+    shipment = fields.Many2One(
+        'stock.shipment.out', 'Shipment', required=True, select=True,
+        ondelete='CASCADE', readonly=True
+    )
+    piece_number = fields.Char('Piece Number', required=True, readonly=True)
+    time = fields.DateTime('Time', required=True, readonly=True)
+    status = fields.Char('Status', readonly=True)
+    description = fields.Char('Description', readonly=True)
+    location = fields.Char('Location', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super(TrackingEvent, cls).__setup__()
+        cls._order.insert(0, ('time', 'DESC'))
+        cls._sql_constraints += [
+            ('event_uniq', 'UNIQUE(shipment, piece_number, time, status)',
+                'The tracking event must be unique.'),
+        ]
+
+    @classmethod
+    def add_events(cls, events):
+        """
+        Create the events not known yet
+
+        :param events: Dictionary of the lists of `PieceEvent` by tuple of
+                       shipment and piece number
+        """
+        known = set(
+            (e.shipment.id, e.piece_number, e.time, e.status)
+            for e in cls.search([
+                    ('shipment', 'in', list(set(
+                        shipment.id for shipment, _ in events
+                    ))),
+                    ])
+        )
+        to_create = []
+        for (shipment, piece_number), piece_events in events.iteritems():
+            for event in piece_events:
+                key = (shipment.id, piece_number, event.time, event.status)
+                if key in known:
+                    continue
+                known.add(key)
+                to_create.append({
+                    'shipment': shipment.id,
+                    'piece_number': piece_number,
+                    'time': event.time,
+                    'status': event.status,
+                    'description': event.description,
+                    'location': event.location,
+                })
+        if to_create:
+            cls.create(to_create)
@@ -0,0 +1,821 @@
+# -*- coding: utf-8 -*-
+"""
+    transport.py
+
+    SOAP backends used by the carrier to talk to DHL DE
+
+"""
+import os
+import time
+import threading
+from collections import deque
+from io import BytesIO
+
+import requests
+from lxml import etree
+from suds import WebFault
+from suds.client import Client
+from suds.plugin import MessagePlugin
+from suds.transport.https import HttpAuthenticated
+from suds.sudsobject import Object, items
+
+from capture import get_wire_capture
+from forksafe import ProcessLocal
+from states import CreationState, DeletionState, ManifestState, \
+    LabelState, DHLDEFault
+
+__all__ = [
+    'CreationState', 'DeletionState', 'ManifestState', 'LabelState',
+    'DHLDEFault',
+    'SudsTransport', 'LxmlTransport', 'TRANSPORTS', 'get_suds_client',
+]
+
+SOAP_ENV_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+CIS_NS = 'http://dhl.de/webservice/cisbase'
+
+# Bytes of a streamed response kept for the capture, its start and its end
+CAPTURED_RESPONSE_SIZE = 64 * 1024
+
+# Elements of the cisbase namespace used within unqualified shipment types
+CIS_ELEMENTS = ('Version', 'EKP', 'partnerID')
+
+# Elements whose children (given as dict) belong to the cisbase namespace
+CIS_CONTAINERS = ('Company', 'ShipmentNumber')
+
+# Order of the elements given as dict, as expected by the schema
+ELEMENT_ORDER = {
+    'Authentification': ('user', 'signature', 'type'),
+    'Company': ('Company', 'Person'),
+    'Person': ('salutation', 'title', 'firstname', 'middlename', 'lastname'),
+    'ExportDocPosition': (
+        'Description', 'CountryCodeOrigin', 'CustomsTariffNumber', 'Amount',
+        'NetWeightInKG', 'GrossWeightInKG', 'CustomsValue', 'CustomsCurrency',
+    ),
+}
+
+
+class FixPrefix(MessagePlugin):
+    """
+    Suds client plugin to fix prefixes
+    """
+    def __init__(self, request='CreateShipmentDDRequest'):
+        self.request = request
+
+    def marshalled(self, context):
+        shipment_dd = context.envelope.getChild(
+            'Body'
+        ).getChild(self.request)
+
+        shipment_dd.getChild('Version').setPrefix('ns0')
+        if self.request != 'CreateShipmentDDRequest':
+            return
+        shipment_details = shipment_dd.getChild('ShipmentOrder') \
+            .getChild('Shipment').getChild('ShipmentDetails')
+        shipment_details.getChild('EKP').setPrefix('ns0')
+        shipment_details.getChild('Attendance').getChild('partnerID') \
+            .setPrefix('ns0')
+
+
+class CapturePlugin(MessagePlugin):
+    """
+    Suds client plugin keeping the bytes of the last exchange
+    """
+    def __init__(self):
+        self.envelope = self.reply = None
+
+    def reset(self):
+        self.envelope = self.reply = None
+
+    def sending(self, context):
+        self.envelope = context.envelope
+
+    def received(self, context):
+        self.reply = context.reply
+
+
+# suds clients of each WSDL, parsed once and shared by the forked workers
+_prototypes = {}
+_prototypes_lock = ProcessLocal(threading.Lock)
+
+
+def get_suds_client(wsdl_url, **options):
+    """
+    Return a suds client of the WSDL with the options set
+
+    The WSDL is read and parsed by the first client of the worker only, the
+    next ones are clones sharing it.
+    """
+    with _prototypes_lock.get():
+        prototype = _prototypes.get(wsdl_url)
+        if prototype is None:
+            prototype = _prototypes[wsdl_url] = Client(wsdl_url, **options)
+    client = prototype.clone()
+    # Not shared with the prototype, and set before the credentials which
+    # are options of the transport
+    client.set_options(transport=HttpAuthenticated())
+    client.set_options(**options)
+    return client
+
+
+def creation_state_from_suds(creation_state):
+    """
+    Return `CreationState` from a suds CreationState of the 1.0 API
+    """
+    # DHL returns the tracking number of each piece in reverse order
+    piece_numbers = [
+        piece.PieceNumber.licensePlate
+        for piece in reversed(creation_state.PieceInformation or [])
+    ]
+    shipment_number = creation_state.ShipmentNumber and \
+        creation_state.ShipmentNumber.shipmentNumber
+    return CreationState(
+        sequence_number=creation_state.SequenceNumber,
+        status_code='%s' % creation_state.StatusCode,
+        status_messages=list(creation_state.StatusMessage or []),
+        shipment_number=shipment_number,
+        piece_numbers=piece_numbers,
+        label_url=creation_state.Labelurl,
+        label_data=None,
+    )
+
+
+def creation_state_from_suds_v2(creation_state):
+    """
+    Return `CreationState` from a suds CreationState of the 2.x API
+    """
+    label_data = creation_state.LabelData
+    shipment_number = getattr(creation_state, 'shipmentNumber', None)
+    return CreationState(
+        sequence_number=creation_state.sequenceNumber,
+        status_code='%s' % label_data.Status.statusCode,
+        status_messages=list(
+            getattr(label_data.Status, 'statusMessage', None) or []
+        ),
+        shipment_number=shipment_number,
+        # Every order carries a single piece in 2.x
+        piece_numbers=[shipment_number] if shipment_number else [],
+        label_url=getattr(label_data, 'labelUrl', None),
+        label_data=getattr(label_data, 'labelData', None),
+    )
+
+
+def shipment_state_from_suds(state, state_class):
+    """
+    Return `state_class` (`DeletionState` or `ManifestState`) from a suds
+    DeletionState or ManifestState of the 1.0 API
+    """
+    return state_class(
+        shipment_number=state.ShipmentNumber.shipmentNumber,
+        status_code='%s' % state.Status.StatusCode,
+        status_messages=list(state.Status.StatusMessage or []),
+    )
+
+
+def shipment_state_from_suds_v2(state, state_class):
+    """
+    Return `state_class` (`DeletionState` or `ManifestState`) from a suds
+    DeletionState or ManifestState of the 2.x API
+    """
+    return state_class(
+        shipment_number=state.shipmentNumber,
+        status_code='%s' % state.Status.statusCode,
+        status_messages=list(
+            getattr(state.Status, 'statusMessage', None) or []
+        ),
+    )
+
+
+def label_state_from_suds(label_data):
+    """
+    Return `LabelState` from a suds LabelData of the 1.0 API
+    """
+    return LabelState(
+        shipment_number=label_data.ShipmentNumber.shipmentNumber,
+        status_code='%s' % label_data.Status.StatusCode,
+        status_messages=list(label_data.Status.StatusMessage or []),
+        label_url=getattr(label_data, 'Labelurl', None),
+        label_data=None,
+    )
+
+
+def label_state_from_suds_v2(label_data):
+    """
+    Return `LabelState` from a suds LabelData of the 2.x API
+    """
+    return LabelState(
+        shipment_number=label_data.shipmentNumber,
+        status_code='%s' % label_data.Status.statusCode,
+        status_messages=list(
+            getattr(label_data.Status, 'statusMessage', None) or []
+        ),
+        label_url=getattr(label_data, 'labelUrl', None),
+        label_data=getattr(label_data, 'labelData', None),
+    )
+
+
+class SudsTransport(object):
+    """
+    Transport marshalling requests and responses with suds
+    """
+    name = 'suds'
+
+    def __init__(self, wsdl_url, location, username, password):
+        # Its connections are not to be used by the forked processes
+        self.pid = os.getpid()
+        # Held by the thread using the transport, which is not thread-safe
+        self.lock = threading.Lock()
+        self.location = location
+        self.username = username
+        self.password = password
+        self.capture = get_wire_capture()
+        self.capture_plugin = CapturePlugin()
+        self.client = get_suds_client(
+            wsdl_url,
+            username=username,
+            password=password,
+            location=location,
+            plugins=[self.capture_plugin],
+        )
+
+    @property
+    def factory(self):
+        return self.client.factory
+
+    def set_authentication(self, user, signature, type_=None):
+        """
+        Set the Authentification soap header sent with each request
+        """
+        header = {
+            'user': user,
+            'signature': signature,
+        }
+        if type_ is not None:
+            header['type'] = type_
+        self.client.set_options(soapheaders=[header])
+
+    def _call(self, operation, *args, **kwargs):
+        """
+        Call the operation of the service, keeping the exchange in the
+        capture of the worker
+
+        :param plugins: Additional suds plugins used for this call only
+        """
+        plugins = kwargs.pop('plugins', [])
+        capture_plugin = self.capture_plugin
+        if plugins:
+            self.client.set_options(plugins=[capture_plugin] + plugins)
+        capture_plugin.reset()
+        self.client.messages['rx'] = None
+        start = time.time()
+        succeeded = False
+        try:
+            response = getattr(self.client.service, operation)(
+                *args, **kwargs
+            )
+            succeeded = True
+            return response
+        except WebFault, exc:  # pragma: no cover
+            raise DHLDEFault(exc.message)
+        finally:
+            if plugins:
+                self.client.set_options(plugins=[capture_plugin])
+            reply = capture_plugin.reply
+            if reply is None and not succeeded:  # pragma: no cover
+                # suds parses the faults without the plugins
+                reply = self.client.last_received()
+            self.capture.record(
+                operation, capture_plugin.envelope, reply,
+                time.time() - start, not succeeded
+            )
+
+    def get_version(self, version=None):
+        """
+        Return the Version of the API as reported by DHL
+        """
+        args = () if version is None else (version, )
+        return self._call('getVersion', *args)
+
+    def create_shipment_dd(self, version, shipment_orders):
+        """
+        Send createShipmentDD request of the 1.0 API
+
+        :return: List of `CreationState`, one per order
+        """
+        response = self._call(
+            'createShipmentDD', version, shipment_orders,
+            plugins=[FixPrefix()]
+        )
+        return map(creation_state_from_suds, response.CreationState)
+
+    def iter_create_shipment_dd(self, version, shipment_orders):
+        """
+        Send createShipmentDD request of the 1.0 API and yield the
+        `CreationState` of each order.
+
+        suds reads the whole response before the first one is available.
+        """
+        for creation_state in self.create_shipment_dd(
+                version, shipment_orders):
+            yield creation_state
+
+    def create_shipment_order(self, version, shipment_orders):
+        """
+        Send createShipmentOrder request of the 2.x API, asking for the
+        labels to be returned base64 encoded within the response
+
+        :return: List of `CreationState`, one per order
+        """
+        response = self._call(
+            'createShipmentOrder', Version=version,
+            ShipmentOrder=shipment_orders, labelResponseType='B64',
+        )
+        return map(creation_state_from_suds_v2, response.CreationState)
+
+    def delete_shipment_dd(self, version, shipment_numbers):
+        """
+        Send deleteShipmentDD request of the 1.0 API
+
+        :return: List of `DeletionState`, one per shipment number
+        """
+        response = self._call(
+            'deleteShipmentDD', version,
+            [{'shipmentNumber': n} for n in shipment_numbers],
+            plugins=[FixPrefix('DeleteShipmentDDRequest')]
+        )
+        return [
+            shipment_state_from_suds(state, DeletionState)
+            for state in response.DeletionState
+        ]
+
+    def delete_shipment_order(self, version, shipment_numbers):
+        """
+        Send deleteShipmentOrder request of the 2.x API
+
+        :return: List of `DeletionState`, one per shipment number
+        """
+        response = self._call(
+            'deleteShipmentOrder', Version=version,
+            shipmentNumber=shipment_numbers,
+        )
+        return [
+            shipment_state_from_suds_v2(state, DeletionState)
+            for state in response.DeletionState
+        ]
+
+    def do_manifest_dd(self, version, shipment_numbers):
+        """
+        Send doManifestDD request of the 1.0 API
+
+        :return: List of `ManifestState`, one per shipment number
+        """
+        response = self._call(
+            'doManifestDD', version,
+            [{'shipmentNumber': n} for n in shipment_numbers],
+            plugins=[FixPrefix('DoManifestDDRequest')]
+        )
+        return [
+            shipment_state_from_suds(state, ManifestState)
+            for state in response.ManifestState
+        ]
+
+    def do_manifest(self, version, shipment_numbers):
+        """
+        Send doManifest request of the 2.x API
+
+        :return: List of `ManifestState`, one per shipment number
+        """
+        response = self._call(
+            'doManifest', Version=version, shipmentNumber=shipment_numbers,
+        )
+        return [
+            shipment_state_from_suds_v2(state, ManifestState)
+            for state in response.ManifestState
+        ]
+
+    def get_label_dd(self, version, shipment_numbers):
+        """
+        Send getLabelDD request of the 1.0 API
+
+        :return: List of `LabelState`, one per shipment number
+        """
+        response = self._call(
+            'getLabelDD', version,
+            [{'shipmentNumber': n} for n in shipment_numbers],
+            plugins=[FixPrefix('GetLabelDDRequest')]
+        )
+        return map(label_state_from_suds, response.LabelData)
+
+    def get_label(self, version, shipment_numbers):
+        """
+        Send getLabel request of the 2.x API, asking for the labels to be
+        returned base64 encoded within the response
+
+        :return: List of `LabelState`, one per shipment number
+        """
+        response = self._call(
+            'getLabel', Version=version, shipmentNumber=shipment_numbers,
+            labelResponseType='B64',
+        )
+        return map(label_state_from_suds_v2, response.LabelData)
+
+    def last_sent(self):
+        return self.client.last_sent()
+
+    def last_received(self):
+        return self.client.last_received()
+
+
+class CapturingReader(object):
+    """
+    File like object keeping the start and the end of what is read from
+    `raw`, about `size` bytes in all, so a large response read in chunks
+    is not kept whole for the capture
+    """
+
+    def __init__(self, raw, size=CAPTURED_RESPONSE_SIZE):
+        self.raw = raw
+        self.head = []
+        self.head_size = 0
+        self.tail = deque()
+        self.tail_size = 0
+        self.skipped = 0
+        self.half = size // 2
+
+    def read(self, size=-1):
+        chunk = self.raw.read(size)
+        if self.head_size < self.half:
+            self.head.append(chunk)
+            self.head_size += len(chunk)
+            return chunk
+        self.tail.append(chunk)
+        self.tail_size += len(chunk)
+        while self.tail_size - len(self.tail[0]) >= self.half:
+            dropped = self.tail.popleft()
+            self.tail_size -= len(dropped)
+            self.skipped += len(dropped)
+        return chunk
+
+    @property
+    def chunks(self):
+        """
+        The chunks kept, with a marker where chunks were skipped
+        """
+        chunks = list(self.head)
+        if self.skipped:
+            chunks.append('\n[... %d bytes not captured ...]\n' % (
+                self.skipped
+            ))
+        chunks.extend(self.tail)
+        return chunks
+
+
+class LxmlTransport(SudsTransport):
+    """
+    Transport building the request envelope and reading the response with
+    lxml, which is much cheaper than the suds marshalling.
+
+    suds is still used to read the WSDL and to create the request types, so
+    the objects built by the shipment are the same for both transports.
+    Only the 1.0 API is supported.
+    """
+    name = 'lxml'
+
+    def __init__(self, wsdl_url, location, username, password):
+        super(LxmlTransport, self).__init__(
+            wsdl_url, location, username, password
+        )
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        self.authentication = []
+        self._last_sent = None
+        self._last_received = None
+
+    def set_authentication(self, user, signature, type_=None):
+        super(LxmlTransport, self).set_authentication(user, signature, type_)
+        self.authentication = [('user', user), ('signature', signature)]
+        if type_ is not None:
+            self.authentication.append(('type', type_))
+
+    def _get_method(self, name):
+        """
+        Return the SOAPAction and the qualified name of the request element
+        of the operation from the WSDL
+        """
+        method = self.client.wsdl.services[0].ports[0].method(name)
+        part, = method.soap.input.body.parts
+        element_name, namespace = part.element
+        return method.soap.action, '{%s}%s' % (namespace, element_name)
+
+    def _append(self, parent, name, value, qualified):
+        """
+        Append `value` to `parent` as element `name`
+        """
+        if value is None:
+            return
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                self._append(parent, name, item, qualified)
+            return
+
+        qualified = qualified or name in CIS_ELEMENTS
+        tag = '{%s}%s' % (CIS_NS, name) if qualified else name
+        element = etree.SubElement(parent, tag)
+
+        if isinstance(value, Object):
+            self._append_object(element, value, qualified)
+        elif isinstance(value, dict):
+            self._append_dict(element, value, qualified)
+        elif isinstance(value, bool):
+            element.text = 'true' if value else 'false'
+        else:
+            element.text = unicode(value)
+
+        if isinstance(value, (Object, dict)) and not len(element):
+            # Like suds, do not send types without any value set
+            parent.remove(element)
+
+    def _append_object(self, element, value, qualified):
+        """
+        Append the values of the suds object `value` to `element`
+        """
+        # Children of the types of the cisbase schema are qualified
+        sxtype = getattr(value.__metadata__, 'sxtype', None)
+        namespace = sxtype and sxtype.namespace()[1]
+        for child_name, child in items(value):
+            self._append(
+                element, child_name, child, qualified or namespace == CIS_NS
+            )
+
+    def _append_dict(self, element, value, qualified):
+        """
+        Append the values of the dict `value` to `element` in schema order
+        """
+        name = etree.QName(element).localname
+        order = ELEMENT_ORDER.get(name, ())
+        keys = sorted(value, key=lambda key: (
+            order.index(key) if key in order else len(order), key
+        ))
+        for key in keys:
+            self._append(
+                element, key, value[key], qualified or name in CIS_CONTAINERS
+            )
+
+    def build_envelope(self, operation, values):
+        """
+        Return the serialized envelope for `operation`
+
+        :param values: List of (name, value) for the request element
+        """
+        envelope = etree.Element(
+            '{%s}Envelope' % SOAP_ENV_NS,
+            nsmap={'soapenv': SOAP_ENV_NS, 'cis': CIS_NS}
+        )
+        header = etree.SubElement(envelope, '{%s}Header' % SOAP_ENV_NS)
+        self._append(
+            header, 'Authentification', dict(self.authentication), True
+        )
+        body = etree.SubElement(envelope, '{%s}Body' % SOAP_ENV_NS)
+        request = etree.SubElement(body, self._get_method(operation)[1])
+        for name, value in values:
+            self._append(request, name, value, False)
+        return etree.tostring(
+            envelope, xml_declaration=True, encoding='utf-8'
+        )
+
+    def send(self, operation, envelope, stream=False):
+        """
+        Post the envelope and return the response
+
+        :param stream: Do not read the body of the response
+        :return: `requests.Response`
+        """
+        action = self._get_method(operation)[0]
+        self._last_sent = envelope
+        self._last_received = None
+        start = time.time()
+        succeeded = False
+        try:
+            response = self.session.post(
+                self.location, data=envelope, stream=stream, headers={
+                    'Content-Type': 'text/xml; charset=utf-8',
+                    'SOAPAction': action,
+                }
+            )
+            if response.status_code == 500:  # pragma: no cover
+                self._last_received = response.content
+                raise DHLDEFault(self.parse_fault(response.content))
+            if response.status_code != 200:  # pragma: no cover
+                # Same as suds transport errors
+                raise Exception((response.status_code, response.reason))
+            if not stream:
+                self._last_received = response.content
+            succeeded = True
+        finally:
+            # Streamed responses are recorded once read by the caller
+            if not (stream and succeeded):
+                self.capture.record(
+                    operation, envelope, self._last_received,
+                    time.time() - start, not succeeded
+                )
+        return response
+
+    @staticmethod
+    def parse_fault(content):
+        """
+        Return the faultstring of a SOAP Fault
+        """
+        root = etree.fromstring(content)
+        faultstring = root.find('.//faultstring')
+        if faultstring is None:  # pragma: no cover
+            return content
+        return faultstring.text
+
+    @staticmethod
+    def parse_creation_state(element):
+        """
+        Return `CreationState` from a CreationState element of the 1.0 API
+        """
+        # DHL returns the tracking number of each piece in reverse order
+        piece_numbers = [
+            piece.text for piece in reversed(element.findall(
+                '{*}PieceInformation/{*}PieceNumber/{*}licensePlate'
+            ))
+        ]
+        return CreationState(
+            sequence_number=element.findtext('{*}SequenceNumber'),
+            status_code=element.findtext('{*}StatusCode'),
+            status_messages=[
+                message.text
+                for message in element.findall('{*}StatusMessage')
+            ],
+            shipment_number=element.findtext(
+                '{*}ShipmentNumber/{*}shipmentNumber'
+            ),
+            piece_numbers=piece_numbers,
+            label_url=element.findtext('{*}Labelurl'),
+            label_data=None,
+        )
+
+    def iter_creation_states(self, source):
+        """
+        Parse incrementally the createShipmentDD response read from the
+        file-like object `source` and yield the `CreationState` of each
+        order as soon as its element is complete.
+
+        Elements are freed once read, so the memory used does not depend
+        on the number of orders in the response.
+        """
+        for event, element in etree.iterparse(
+                source, events=('end', ), tag='{*}CreationState'):
+            yield self.parse_creation_state(element)
+
+            # Drop the element and the already read siblings
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+    def parse_creation_states(self, content):
+        """
+        Return list of `CreationState` from a createShipmentDD response
+        """
+        return list(self.iter_creation_states(BytesIO(content)))
+
+    def create_shipment_dd(self, version, shipment_orders):
+        return list(self.iter_create_shipment_dd(version, shipment_orders))
+
+    def iter_create_shipment_dd(self, version, shipment_orders):
+        envelope = self.build_envelope('createShipmentDD', [
+            ('Version', version),
+            ('ShipmentOrder', shipment_orders),
+        ])
+        start = time.time()
+        response = self.send('createShipmentDD', envelope, stream=True)
+        response.raw.decode_content = True
+        # Read straight from the response when nothing is captured
+        capturing = bool(self.capture.size)
+        source = CapturingReader(response.raw) if capturing else response.raw
+        succeeded = False
+        try:
+            for creation_state in self.iter_creation_states(source):
+                yield creation_state
+            succeeded = True
+        finally:
+            response.close()
+            if capturing:
+                self.capture.record(
+                    'createShipmentDD', envelope, source.chunks,
+                    time.time() - start, not succeeded
+                )
+
+    @staticmethod
+    def unsupported_operation(operation):
+        """
+        Raise the fault of an operation of the 2.2 API, which the carrier
+        shows to the user as any fault returned by DHL
+        """
+        raise DHLDEFault(
+            'The lxml transport does not support the operation %s of the '
+            'API 2.2, use the suds transport' % operation
+        )
+
+    def create_shipment_order(self, version, shipment_orders):
+        self.unsupported_operation('createShipmentOrder')
+
+    @staticmethod
+    def parse_shipment_states(content, state_class):
+        """
+        Return list of `state_class` (`DeletionState` or `ManifestState`)
+        from a deleteShipmentDD or doManifestDD response
+        """
+        return [
+            state_class(
+                shipment_number=element.findtext(
+                    '{*}ShipmentNumber/{*}shipmentNumber'
+                ),
+                status_code=element.findtext('{*}Status/{*}StatusCode'),
+                status_messages=[
+                    message.text for message in element.findall(
+                        '{*}Status/{*}StatusMessage'
+                    )
+                ],
+            )
+            for element in etree.fromstring(content).iterfind(
+                './/{*}%s' % state_class.__name__
+            )
+        ]
+
+    def _send_shipment_numbers(self, operation, version, shipment_numbers):
+        """
+        Send a request of the 1.0 API made of the version and shipment
+        numbers and return its content
+        """
+        envelope = self.build_envelope(operation, [
+            ('Version', version),
+            ('ShipmentNumber', [
+                {'shipmentNumber': n} for n in shipment_numbers
+            ]),
+        ])
+        return self.send(operation, envelope).content
+
+    def delete_shipment_dd(self, version, shipment_numbers):
+        return self.parse_shipment_states(
+            self._send_shipment_numbers(
+                'deleteShipmentDD', version, shipment_numbers
+            ), DeletionState
+        )
+
+    def do_manifest_dd(self, version, shipment_numbers):
+        return self.parse_shipment_states(
+            self._send_shipment_numbers(
+                'doManifestDD', version, shipment_numbers
+            ), ManifestState
+        )
+
+    @staticmethod
+    def parse_label_states(content):
+        """
+        Return list of `LabelState` from a getLabelDD response
+        """
+        return [
+            LabelState(
+                shipment_number=element.findtext(
+                    '{*}ShipmentNumber/{*}shipmentNumber'
+                ),
+                status_code=element.findtext('{*}Status/{*}StatusCode'),
+                status_messages=[
+                    message.text for message in element.findall(
+                        '{*}Status/{*}StatusMessage'
+                    )
+                ],
+                label_url=element.findtext('{*}Labelurl'),
+                label_data=None,
+            )
+            for element in etree.fromstring(content).iterfind(
+                './/{*}LabelData'
+            )
+        ]
+
+    def get_label_dd(self, version, shipment_numbers):
+        return self.parse_label_states(
+            self._send_shipment_numbers(
+                'getLabelDD', version, shipment_numbers
+            )
+        )
+
+    def delete_shipment_order(self, version, shipment_numbers):
+        self.unsupported_operation('deleteShipmentOrder')
+
+    def get_label(self, version, shipment_numbers):
+        self.unsupported_operation('getLabel')
+
+    def do_manifest(self, version, shipment_numbers):
+        self.unsupported_operation('doManifest')
+
+    def last_sent(self):
+        return self._last_sent
+
+    def last_received(self):
+        return self._last_received
+
+
+TRANSPORTS = dict((t.name, t) for t in (SudsTransport, LxmlTransport))